@@ -0,0 +1,415 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "pillow",
+# ]
+# ///
+
+"""
+Local stand-in for the Azure OpenAI chat completions and the Models as a Service
+image generation endpoints, with configurable latency, jitter, 429 rate and
+payload sizes. With --rpm, every deployment accepts that many requests per minute,
+checked over 10 seconds like Azure OpenAI, and answers 429 with the time until a
+request is accepted again. --down makes deployments answer 503, and
+--deployment-latency gives deployments their own latency, to try routing over a
+pool of deployments. With --tls, the server speaks HTTPS with a self-signed
+certificate. The server counts the connections and TLS handshakes made to it, and
+the bytes of the requests it received.
+
+  POST .../chat/completions       Forced tool calls get an extract_travel_search_parameters
+                                  call, other requests a plain reply of --reply-words words,
+                                  generated at one word per --token-interval seconds and
+                                  streamed when requested. A json_schema response format
+                                  gets {"parameters": ..., "reply": ...}.
+  POST /bria/images/generations   Bria response format, {"data": [{"b64_json": ...}]}
+  POST .../images/generations     Stability AI response format, {"image": ...}
+  GET  .../models, .../info       Model list and model info, to open a connection
+  GET  /mock/stats                Connections, TLS handshakes and request bytes received so far
+
+Usage: uv run mock_server.py [--port 8000] [--latency 0.5] [--jitter 0.1] [--error-rate 0] [--rpm 0]
+                             [--down NAME ...] [--deployment-latency NAME=SECONDS ...] [--tls]
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from PIL import Image
+
+MOCK_PARAMETERS = {
+    "destination": ["ES"],
+    "departure_date": "2025-07-15",
+    "duration": 7,
+    "participants": {"adults": 2, "children": 1},
+    "trip_type": "sun",
+}
+
+
+def make_image(size: str, output_format: str = "png") -> str:
+    """Return a base64 encoded image of random noise, which compresses like a photo."""
+    width, height = map(int, size.split("x"))
+    image = Image.frombytes(
+        "RGB", (width, height), random.randbytes(width * height * 3)
+    )
+    buffered = BytesIO()
+    image.save(buffered, format=output_format.upper())
+    return base64.b64encode(buffered.getvalue()).decode()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    latency = 0.5
+    jitter = 0.1
+    error_rate = 0.0
+    reply_words = 50
+    token_interval = 0.01
+    rpm = 0
+    # Deployment or model names in the path that answer 503, or have their own latency
+    down = ()
+    deployment_latency = {}
+    images = {}
+    # Times of the accepted requests of the last 10 seconds per deployment
+    accepted = defaultdict(deque)
+    accepted_lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        if isinstance(self.connection, ssl.SSLSocket):
+            # Handshake in the thread of the connection, not in the accept loop
+            self.connection.do_handshake()
+            with self.server.lock:
+                self.server.handshakes += 1
+
+    def do_GET(self):
+        if self.path == "/mock/stats":
+            with self.server.lock:
+                return self.send_json(
+                    200,
+                    {
+                        "connections": self.server.connections,
+                        "handshakes": self.server.handshakes,
+                        "received_bytes": self.server.received_bytes,
+                    },
+                )
+        if self.path.split("?")[0].endswith("/models"):
+            return self.send_json(200, {"object": "list", "data": []})
+        if self.path.endswith("/info"):
+            return self.send_json(
+                200,
+                {
+                    "model_name": "mock",
+                    "model_type": "text-to-image",
+                    "model_provider_name": "mock",
+                },
+            )
+        self.send_json(404, {"error": {"code": "404", "message": "Not found"}})
+
+    def do_POST(self):
+        content = self.rfile.read(int(self.headers["Content-Length"]))
+        with self.server.lock:
+            self.server.received_bytes += len(content)
+        body = json.loads(content)
+        if retry_after := self.rate_limit():
+            return self.send_json(
+                429,
+                {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                {
+                    "retry-after": str(max(round(retry_after), 1)),
+                    "retry-after-ms": str(round(retry_after * 1000)),
+                },
+            )
+        segments = self.path.split("?")[0].split("/")
+        latency = next(
+            (
+                self.deployment_latency[name]
+                for name in segments
+                if name in self.deployment_latency
+            ),
+            self.latency,
+        )
+        time.sleep(max(0.0, random.gauss(latency, self.jitter)))
+
+        if any(name in self.down for name in segments):
+            return self.send_json(
+                503,
+                {"error": {"code": "503", "message": "Service unavailable."}},
+            )
+
+        if random.random() < self.error_rate:
+            return self.send_json(
+                429,
+                {"error": {"code": "429", "message": "Rate limit is exceeded."}},
+                {"retry-after": "1", "retry-after-ms": "1000"},
+            )
+
+        if self.path.split("?")[0].endswith("/chat/completions"):
+            completion = self.chat_completion(body)
+            if body.get("stream"):
+                return self.send_stream(completion, body.get("stream_options") or {})
+            if completion["choices"][0]["finish_reason"] == "stop":
+                time.sleep(self.reply_words * self.token_interval)
+            return self.send_json(200, completion)
+
+        if self.path.endswith("/images/generations"):
+            key = (body.get("size", "1024x1024"), body.get("output_format", "png"))
+            if key not in self.images:
+                self.images[key] = make_image(*key)
+            image = self.images[key]
+            if self.path.startswith("/bria/"):
+                return self.send_json(200, {"data": [{"b64_json": image}]})
+            return self.send_json(200, {"image": image, "finish_reason": "SUCCESS"})
+
+        self.send_json(404, {"error": {"code": "404", "message": "Not found"}})
+
+    def rate_limit(self) -> float | None:
+        """Accept the request within the RPM, or return the seconds until it would be."""
+        if not self.rpm:
+            return None
+        now = time.monotonic()
+        with self.accepted_lock:
+            accepted = self.accepted[self.path.split("?")[0]]
+            while accepted and accepted[0] <= now - 10:
+                accepted.popleft()
+            if len(accepted) >= max(self.rpm // 6, 1):
+                return accepted[0] + 10 - now
+            accepted.append(now)
+        return None
+
+    def chat_completion(self, body: dict) -> dict:
+        prompt_tokens = len(json.dumps(body["messages"])) // 4
+        tool_choice = body.get("tool_choice")
+
+        if isinstance(tool_choice, dict):
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{random.getrandbits(64):016x}",
+                        "type": "function",
+                        "function": {
+                            "name": tool_choice["function"]["name"],
+                            "arguments": json.dumps(MOCK_PARAMETERS),
+                        },
+                    }
+                ],
+            }
+            finish_reason = "tool_calls"
+            completion_tokens = 40
+        else:
+            content = " ".join(["travel"] * self.reply_words)
+            if (body.get("response_format") or {}).get("type") == "json_schema":
+                content = json.dumps({"parameters": MOCK_PARAMETERS, "reply": content})
+            message = {"role": "assistant", "content": content}
+            finish_reason = "stop"
+            completion_tokens = self.reply_words
+
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [
+                {"index": 0, "finish_reason": finish_reason, "message": message}
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0},
+            },
+        }
+
+    def send_json(self, status: int, payload: dict, headers: dict | None = None):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_stream(self, completion: dict, stream_options: dict):
+        """Send a completion as server-sent events, one word per chunk."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data: str):
+            event = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.flush()
+
+        choice = completion["choices"][0]
+        chunk = {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": completion["created"],
+            "model": completion["model"],
+            "usage": None,
+        }
+        words = (choice["message"]["content"] or "").split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_interval)
+            delta = {"content": word if i == 0 else " " + word}
+            if i == 0:
+                delta["role"] = "assistant"
+            choices = [{"index": 0, "delta": delta, "finish_reason": None}]
+            send_event(json.dumps({**chunk, "choices": choices}))
+
+        choices = [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}]
+        send_event(json.dumps({**chunk, "choices": choices}))
+        if stream_options.get("include_usage"):
+            send_event(
+                json.dumps({**chunk, "choices": [], "usage": completion["usage"]})
+            )
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    """Serve HTTP, or HTTPS with a certificate and key file, and count connections."""
+
+    request_queue_size = 1024
+
+    def __init__(self, address: tuple, tls: tuple | None = None):
+        super().__init__(address, MockHandler)
+        self.connections = 0
+        self.handshakes = 0
+        self.received_bytes = 0
+        self.lock = threading.Lock()
+        self.ssl_context = None
+        if tls:
+            self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.ssl_context.load_cert_chain(*tls)
+
+    def get_request(self):
+        connection, address = super().get_request()
+        with self.lock:
+            self.connections += 1
+        if self.ssl_context:
+            connection = self.ssl_context.wrap_socket(
+                connection, server_side=True, do_handshake_on_connect=False
+            )
+        return connection, address
+
+
+def make_certificate(directory: str) -> tuple:
+    """Create a self-signed certificate for 127.0.0.1 with openssl, return its files."""
+    certfile = os.path.join(directory, "mock-cert.pem")
+    keyfile = os.path.join(directory, "mock-key.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1,DNS:localhost",
+            "-keyout",
+            keyfile,
+            "-out",
+            certfile,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def parse_deployment_latency(value: str) -> tuple:
+    name, seconds = value.split("=", 1)
+    return name, float(seconds)
+
+
+def serve(
+    port: int,
+    latency: float = 0.5,
+    jitter: float = 0.1,
+    error_rate: float = 0.0,
+    reply_words: int = 50,
+    token_interval: float = 0.01,
+    rpm: int = 0,
+    down: tuple = (),
+    deployment_latency: dict | None = None,
+    tls: tuple | None = None,
+):
+    MockHandler.latency = latency
+    MockHandler.jitter = jitter
+    MockHandler.error_rate = error_rate
+    MockHandler.reply_words = reply_words
+    MockHandler.token_interval = token_interval
+    MockHandler.rpm = rpm
+    MockHandler.down = tuple(down)
+    MockHandler.deployment_latency = deployment_latency or {}
+    MockServer(("127.0.0.1", port), tls).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reply-words", type=int, default=50)
+    parser.add_argument("--token-interval", type=float, default=0.01)
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute")
+    parser.add_argument("--down", nargs="+", default=[], metavar="NAME")
+    parser.add_argument(
+        "--deployment-latency",
+        nargs="+",
+        default=[],
+        metavar="NAME=SECONDS",
+        type=parse_deployment_latency,
+    )
+    parser.add_argument(
+        "--tls", action="store_true", help="serve HTTPS with a self-signed certificate"
+    )
+    args = parser.parse_args()
+
+    tls = None
+    scheme = "http"
+    if args.tls:
+        tls = make_certificate(tempfile.mkdtemp())
+        scheme = "https"
+        print(f"Trust the certificate with SSL_CERT_FILE={tls[0]}")
+    print(f"Mock server listening on {scheme}://127.0.0.1:{args.port}")
+    serve(
+        args.port,
+        args.latency,
+        args.jitter,
+        args.error_rate,
+        args.reply_words,
+        args.token_interval,
+        args.rpm,
+        args.down,
+        dict(args.deployment_latency),
+        tls,
+    )
+
+
+if __name__ == "__main__":
+    main()
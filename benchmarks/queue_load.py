@@ -0,0 +1,142 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "gradio",
+#     "gradio-client",
+#     "azure-identity",
+#     "httpx[http2]",
+#     "numpy",
+#     "openai",
+#     "pandas",
+#     "pillow",
+#     "python-dotenv",
+#     "redis",
+#     "requests",
+#     "tiktoken",
+# ]
+# ///
+
+"""
+Load test a demo through its Gradio queue, against the local mock server. The app
+is launched in this process and called with the Gradio client, one client per
+user, so requests wait in the queue for a free worker as they do from a browser.
+Reports the latency, the time requests waited in the queue and the requests turned
+away because the queue was full, to size the concurrency limits and queue size
+against the latency of the backend.
+
+Usage: uv run queue_load.py [--app conversational-search] [--users 64] [--requests 400]
+                            [--latency 0.5] [--env KEY=VALUE ...]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gradio_client import Client
+
+import mock_server
+import run
+
+# The endpoint and arguments of a request to every app
+CALLS = {
+    "conversational-search": (
+        "/chat_with_travel_assistant",
+        lambda i: (f"Somewhere warm for the holidays, request {i}", []),
+    ),
+    "function-calling-search": (
+        "/search_interface",
+        lambda i: (f"Somewhere warm for the holidays, request {i}",),
+    ),
+    "maas-image-generation": (
+        "/generate_stable_image_core",
+        lambda i: (
+            f"A serene mountain landscape, request {i}",
+            "png",
+            "",
+            "1024x1024",
+        ),
+    ),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", choices=list(CALLS), default="conversational-search")
+    parser.add_argument("--users", type=int, default=64)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="environment variable for the app, to compare its queue settings",
+    )
+    args = parser.parse_args()
+
+    port = run.free_port()
+    mock = multiprocessing.Process(
+        target=mock_server.serve,
+        args=(port, args.latency, args.latency / 10),
+        daemon=True,
+    )
+    mock.start()
+    for variable in args.env:
+        key, _, value = variable.partition("=")
+        os.environ[key] = value
+
+    app = run.load_app(args.app, f"http://127.0.0.1:{port}")
+    logging.disable(logging.INFO)
+    _, url, _ = app.demo.launch(
+        prevent_thread_lock=True,
+        quiet=True,
+        max_threads=max(40, args.users),
+        app_kwargs=app.queue_monitor.app_kwargs(),
+    )
+    api_name, arguments = CALLS[args.app]
+    clients = [Client(url, verbose=False) for _ in range(args.users)]
+
+    def call(i: int):
+        start = time.perf_counter()
+        try:
+            clients[i % args.users].predict(*arguments(i), api_name=api_name)
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, str(e)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.users) as executor:
+        results = list(executor.map(call, range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, error in results if error is None]
+    errors = [error for _, error in results if error is not None]
+    stats = app.queue_monitor.stats()
+    print(f"{'requests':<24} {args.requests}")
+    print(f"{'throughput_rps':<24} {len(latencies) / elapsed:.2f}")
+    if len(latencies) > 1:
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"{'p50_ms':<24} {quantiles[49] * 1000:.0f}")
+        print(f"{'p95_ms':<24} {quantiles[94] * 1000:.0f}")
+    print(f"{'errors':<24} {len(errors)}")
+    for error in sorted(set(errors)):
+        print(f"  {errors.count(error)}x {error[:200]}")
+    print(f"{'queued':<24} {stats['queued']}")
+    print(f"{'rejected':<24} {stats['rejected']}")
+    for concurrency_id, group in stats["groups"].items():
+        if group["wait_p50"] or group["wait_p95"]:
+            print(
+                f"{'queue ' + str(concurrency_id):<24} limit {group['limit']},"
+                f" wait p50 {group['wait_p50'] * 1000:.0f} ms,"
+                f" p95 {group['wait_p95'] * 1000:.0f} ms"
+            )
+    app.demo.close()
+    mock.terminate()
+
+
+if __name__ == "__main__":
+    main()
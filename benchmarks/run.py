@@ -0,0 +1,582 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "gradio",
+#     "azure-identity",
+#     "httpx[http2]",
+#     "openai",
+#     "pillow",
+#     "python-dotenv",
+#     "requests",
+#     "tiktoken",
+# ]
+# ///
+
+"""
+Benchmark the demos against the local mock server. Every app runs in its own
+process and is driven at the given concurrency, through the same functions the
+Gradio interface calls. Latency percentiles, throughput, peak RSS and CPU time per
+call are printed and saved as JSON, to compare runs across commits.
+
+Usage: uv run run.py [--apps ...] [--concurrency 16] [--requests 200] [--latency 0.5] [--prewarm]
+                     [--tls] [--env KEY=VALUE ...]
+                     [--output results.json] [--compare previous.json]
+"""
+
+import argparse
+import asyncio
+import base64
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import mock_server
+
+ROOT = Path(__file__).resolve().parent.parent
+APPS = ["function-calling-search", "conversational-search", "maas-image-generation"]
+IMAGE_MODELS = ["Stable Image Core", "Bria 2.3 Fast"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def load_app(name: str, endpoint: str, deployments: int = 1):
+    """
+    Import the app of a demo, pointed at the mock server. With several deployments,
+    every model gets a pool of mock deployments named deployment-1, deployment-2...
+    """
+    if (ROOT / name / ".env").exists():
+        sys.exit(
+            f"{name}/.env would override the mock endpoints, move it while benchmarking"
+        )
+
+    os.environ["AZURE_OPENAI_ENDPOINT"] = endpoint
+    os.environ["AZURE_OPENAI_API_KEY"] = "mock-key"
+    os.environ["STABLE_IMAGE_CORE_ENDPOINT"] = f"{endpoint}/stability"
+    os.environ["STABLE_IMAGE_CORE_KEY"] = "mock-key"
+    os.environ["BRIA_23_FAST_ENDPOINT"] = f"{endpoint}/bria"
+    os.environ["BRIA_23_FAST_KEY"] = "mock-key"
+    os.environ["STABLE_DIFFUSION_35_ENDPOINT"] = f"{endpoint}/sd35"
+    os.environ["STABLE_DIFFUSION_35_KEY"] = "mock-key"
+    if deployments > 1:
+        names = [f"deployment-{k}" for k in range(1, deployments + 1)]
+        os.environ["AZURE_OPENAI_DEPLOYMENT"] = ",".join(names)
+        for model, path in (
+            ("STABLE_IMAGE_CORE", "stability"),
+            ("BRIA_23_FAST", "bria"),
+            ("STABLE_DIFFUSION_35", "sd35"),
+        ):
+            os.environ[f"{model}_ENDPOINT"] = ",".join(
+                f"{endpoint}/{path}/{name}" for name in names
+            )
+
+    # Modules next to the app are imported as when it runs as a script
+    sys.path.insert(0, str(ROOT / name))
+    spec = importlib.util.spec_from_file_location(
+        name.replace("-", "_"), ROOT / name / "app.py"
+    )
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+
+def mock_stats(endpoint: str) -> dict:
+    """Return the connections and TLS handshakes made to the mock server so far."""
+    # With --tls, SSL_CERT_FILE holds the certificate of the mock server
+    context = ssl.create_default_context(cafile=os.getenv("SSL_CERT_FILE"))
+    with urllib.request.urlopen(endpoint + "/mock/stats", context=context) as response:
+        return json.load(response)
+
+
+def timed(call, latencies: list, errors: list):
+    start = time.perf_counter()
+    try:
+        call()
+    except Exception as e:
+        errors.append(type(e).__name__)
+    latencies.append(time.perf_counter() - start)
+
+
+async def timed_async(call, latencies: list, errors: list):
+    start = time.perf_counter()
+    try:
+        await call()
+    except Exception as e:
+        errors.append(type(e).__name__)
+    latencies.append(time.perf_counter() - start)
+
+
+def session_count(args) -> int:
+    # A session never has two calls in flight, like a user in the browser
+    return max(args.sessions or args.concurrency, args.concurrency)
+
+
+def count_cross_talk(app, sessions: int) -> int:
+    """Count the user messages that ended up in the conversation of another session."""
+    cross_talk = 0
+    for k in range(sessions):
+        state = app.session_store.get(f"session-{k}")
+        for message in state.message_history:
+            if message["role"] == "user" and f"session {k}," not in message["content"]:
+                cross_talk += 1
+    return cross_talk
+
+
+def drive(name: str, app, args):
+    """
+    Call the app `requests` times for `sessions` users, `concurrency` at a time. The
+    first call is made on its own, to measure the latency of the first request after
+    startup.
+    """
+    latencies, errors = [], []
+    concurrency = args.concurrency
+    sessions = session_count(args)
+
+    if name == "function-calling-search":
+        histories = [[] for _ in range(sessions)]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def search(i: int):
+            async with semaphore:
+                await timed_async(
+                    lambda: app.process_search_query(
+                        f"Somewhere warm for the holidays, session {i % sessions},"
+                        f" request {i}",
+                        histories[i % sessions],
+                    ),
+                    latencies,
+                    errors,
+                )
+
+        async def run():
+            # The app opens its connections when the server starts
+            if args.prewarm:
+                await app.client_factory.connect()
+            await search(0)
+            await asyncio.gather(*(search(i) for i in range(1, args.requests)))
+
+        asyncio.run(run())
+        return latencies, errors
+
+    if name == "conversational-search":
+        histories = [[] for _ in range(sessions)]
+
+        def call(i: int):
+            # The handler is a generator of interface updates
+            for _ in app.chat_with_travel_assistant(
+                f"Somewhere warm for the holidays, session {i % sessions}, request {i}",
+                histories[i % sessions],
+                app.gr.Request(session_hash=f"session-{i % sessions}"),
+            ):
+                pass
+
+    else:
+        model_choices = IMAGE_MODELS
+        image_prompt_path = None
+        if args.image_prompt:
+            # Only Stable Diffusion 3.5 takes an initial image
+            model_choices = ["Stable Diffusion 3.5"]
+            image_prompt_path = os.path.join(tempfile.mkdtemp(), "initial.png")
+            with open(image_prompt_path, "wb") as file:
+                file.write(base64.b64decode(mock_server.make_image(args.image_prompt)))
+
+        def call(i: int):
+            # The initial image as the input component passes it to the handler
+            image_prompt = None
+            if image_prompt_path:
+                image_prompt = app.image_prompt.preprocess(
+                    app.gr.data_classes.ImageData(
+                        path=image_prompt_path, orig_name="initial.png"
+                    )
+                )
+            # With --seeds, the same image is requested again every `seeds` calls
+            if args.seeds:
+                prompt, seed = "A serene mountain landscape", i % args.seeds + 1
+            else:
+                prompt, seed = f"A serene mountain landscape, request {i}", None
+            # The output component encodes the image for the browser
+            app.output_image.postprocess(
+                app.generate_image(
+                    model_choices[i % len(model_choices)],
+                    prompt,
+                    "png",
+                    "",
+                    args.size,
+                    seed,
+                    image_prompt=image_prompt,
+                )
+            )
+
+        if args.grid:
+            prompt_count, seed_count = map(int, args.grid.split("x"))
+
+            # Every call is a grid of one model, done when its last image is
+            def call(i: int):
+                for _ in app.generate_grid(
+                    "\n".join(
+                        f"A serene mountain landscape, request {i}, prompt {k}"
+                        for k in range(prompt_count)
+                    ),
+                    ", ".join(str(seed) for seed in range(1, seed_count + 1)),
+                    [model_choices[i % len(model_choices)]],
+                    "png",
+                    "",
+                    args.size,
+                ):
+                    pass
+
+    timed(lambda: call(0), latencies, errors)
+    with ThreadPoolExecutor(concurrency) as executor:
+        for i in range(1, args.requests):
+            executor.submit(timed, lambda i=i: call(i), latencies, errors)
+
+    return latencies, errors
+
+
+def worker(name: str, endpoint: str, args, output_path: str):
+    """Benchmark one app, in its own process so peak RSS is measured per app."""
+    for variable in args.env:
+        key, _, value = variable.partition("=")
+        os.environ[key] = value
+
+    # Every run starts with an empty image cache, unless it is set with --env
+    os.environ.setdefault("IMAGE_CACHE_DIR", tempfile.mkdtemp())
+    start = time.perf_counter()
+    app = load_app(name, endpoint, args.deployments)
+    import_s = time.perf_counter() - start
+    logging.disable(logging.INFO)
+
+    if args.prewarm:
+        app.client_factory.prewarm()
+        app.client_factory.ready.wait(timeout=60)
+    # The app loads its offer catalog at startup, prewarm or not
+    if hasattr(app, "offer_catalog"):
+        app.offer_catalog.get()
+    ready_s = time.perf_counter() - start
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    latencies, errors = drive(name, app, args)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    # Peak RSS is reported in bytes on macOS and in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = (
+        peak_rss / 1024 / 1024 if sys.platform == "darwin" else peak_rss / 1024
+    )
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    result = {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "import_s": import_s,
+        "ready_s": ready_s,
+        "first_request_ms": latencies[0] * 1000,
+        "p50_ms": quantiles[49] * 1000,
+        "p95_ms": quantiles[94] * 1000,
+        "p99_ms": quantiles[98] * 1000,
+        "throughput_rps": len(latencies) / elapsed,
+        "peak_rss_mb": peak_rss_mb,
+        "cpu_ms_per_call": cpu / len(latencies) * 1000,
+    }
+    if hasattr(app, "request_builder"):
+        usage = app.request_builder.stats()
+        result["tokens_per_call"] = (
+            usage["prompt_tokens"] + usage["completion_tokens"]
+        ) / len(latencies)
+    if hasattr(app, "session_store"):
+        session_stats = app.session_store.stats()
+        result["live_sessions"] = session_stats["sessions"]
+        result["session_mb"] = session_stats["bytes"] / 1024 / 1024
+        result["cross_talk"] = count_cross_talk(app, session_count(args))
+        # Offer searches are cached and refined per session, the mean over sessions
+        states = [
+            app.session_store.get(f"session-{k}") for k in range(session_count(args))
+        ]
+        if states and hasattr(states[0], "search_rates"):
+            for rate in ("hit_rate", "refinement_rate"):
+                result[f"search_{rate}"] = statistics.mean(
+                    state.search_rates()[rate] for state in states
+                )
+    # The image demo has a scheduler per model deployment
+    schedulers = getattr(app, "schedulers", {}).values()
+    if hasattr(app, "scheduler"):
+        schedulers = [app.scheduler]
+    if schedulers:
+        scheduler_stats = [scheduler.stats() for scheduler in schedulers]
+        result["throttled"] = sum(stats["throttled"] for stats in scheduler_stats)
+        result["rejected"] = sum(stats["rejected"] for stats in scheduler_stats)
+        result["failed_over"] = sum(
+            stats.get("failed_over", 0) for stats in scheduler_stats
+        )
+        used = sum(stats["used_tokens"] for stats in scheduler_stats)
+        if used:
+            # Tokens charged up front for every token the responses used
+            estimated = sum(stats["estimated_tokens"] for stats in scheduler_stats)
+            result["token_estimate_ratio"] = estimated / used
+    if hasattr(app, "extraction_cache"):
+        cache_stats = app.extraction_cache.stats()
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+        result["extraction_cache_hit_rate"] = (
+            cache_stats["hits"] / lookups if lookups else 0.0
+        )
+    if getattr(app, "image_cache", None):
+        cache_stats = app.image_cache.stats()
+        result["image_cache_hit_rate"] = cache_stats["hit_rate"]
+        result["image_cache_saved_mb"] = cache_stats["bytes_saved"] / 1024 / 1024
+    if hasattr(app, "response_time_metrics"):
+        result.update(app.response_time_metrics.stats())
+    with open(output_path, "w") as file:
+        json.dump(result, file)
+
+
+def print_results(results: dict, previous: dict | None = None):
+    columns = [
+        "ready_s",
+        "first_request_ms",
+        "p50_ms",
+        "p95_ms",
+        "p99_ms",
+        "throughput_rps",
+        "peak_rss_mb",
+        "cpu_ms_per_call",
+    ]
+
+    def format_value(name: str, column: str) -> str:
+        value = f"{results[name][column]:.2f}"
+        if previous and previous.get(name, {}).get(column):
+            change = results[name][column] / previous[name][column] - 1
+            value += f" ({change:+.0%})"
+        return value
+
+    print(f"{'app':<24} {'errors':>6} " + " ".join(f"{c:>16}" for c in columns))
+    for name, result in results.items():
+        values = " ".join(f"{format_value(name, column):>16}" for column in columns)
+        print(f"{name:<24} {result['errors']:>6} {values}")
+
+    # Metrics only some of the apps report
+    for name, result in results.items():
+        for column in result:
+            if column.startswith("time_to_") or column in (
+                "tokens_per_call",
+                "token_estimate_ratio",
+                "extraction_cache_hit_rate",
+                "live_sessions",
+                "session_mb",
+                "cross_talk",
+                "search_hit_rate",
+                "search_refinement_rate",
+                "throttled",
+                "rejected",
+                "failed_over",
+                "connections",
+                "handshakes",
+                "upload_kb_per_call",
+                "image_cache_hit_rate",
+                "image_cache_saved_mb",
+            ):
+                print(f"{name:<24} {column + ':':<26} {format_value(name, column)}")
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--apps", nargs="+", choices=APPS, default=APPS)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+        "--sessions", type=int, help="number of users, at least the concurrency"
+    )
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        default=0,
+        help="requests per minute of every mock deployment",
+    )
+    parser.add_argument(
+        "--deployments",
+        type=int,
+        default=1,
+        help="number of mock deployments per model, named deployment-1...",
+    )
+    parser.add_argument(
+        "--down", nargs="+", default=[], help="mock deployments that answer 503"
+    )
+    parser.add_argument(
+        "--deployment-latency",
+        nargs="+",
+        default=[],
+        metavar="NAME=SECONDS",
+        type=mock_server.parse_deployment_latency,
+        help="latency of single mock deployments",
+    )
+    parser.add_argument("--reply-words", type=int, default=50)
+    parser.add_argument("--token-interval", type=float, default=0.01)
+    parser.add_argument("--size", default="1024x1024", help="size of generated images")
+    parser.add_argument(
+        "--image-prompt",
+        metavar="SIZE",
+        help="send an initial image of this size to Stable Diffusion 3.5 with every call",
+    )
+    parser.add_argument(
+        "--grid",
+        metavar="PROMPTSxSEEDS",
+        help="generate a grid of this many prompts and seeds per call, like 4x4",
+    )
+    parser.add_argument(
+        "--seeds",
+        type=int,
+        default=0,
+        help="request the same images with this many seeds, to hit the image cache",
+    )
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        help="prewarm the clients of the apps before the first request",
+    )
+    parser.add_argument(
+        "--tls",
+        action="store_true",
+        help="serve the mock over HTTPS, to count connections and TLS handshakes",
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="environment variable for the apps, to benchmark their options",
+    )
+    parser.add_argument("--output", default="results.json")
+    parser.add_argument("--compare", help="results of a previous run to compare with")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--endpoint", help=argparse.SUPPRESS)
+    parser.add_argument("--worker-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args.worker, args.endpoint, args, args.worker_output)
+
+    port = free_port()
+    endpoint = f"http://127.0.0.1:{port}"
+    tls = None
+    if args.tls:
+        tls = mock_server.make_certificate(tempfile.mkdtemp())
+        endpoint = f"https://127.0.0.1:{port}"
+        # The apps and their HTTP clients trust the certificate of the mock
+        os.environ["SSL_CERT_FILE"] = os.environ["REQUESTS_CA_BUNDLE"] = tls[0]
+    mock = multiprocessing.Process(
+        target=mock_server.serve,
+        args=(
+            port,
+            args.latency,
+            args.jitter,
+            args.error_rate,
+            args.reply_words,
+            args.token_interval,
+            args.rpm,
+            args.down,
+            dict(args.deployment_latency),
+            tls,
+        ),
+        daemon=True,
+    )
+    mock.start()
+    for _ in range(50):
+        try:
+            mock_stats(endpoint)
+            break
+        except OSError:
+            time.sleep(0.1)
+
+    results = {}
+    for name in args.apps:
+        before = mock_stats(endpoint)
+        with tempfile.NamedTemporaryFile(suffix=".json") as worker_output:
+            subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    *sys.argv[1:],
+                    "--worker",
+                    name,
+                    "--endpoint",
+                    endpoint,
+                    "--worker-output",
+                    worker_output.name,
+                ],
+                check=True,
+            )
+            results[name] = json.load(worker_output)
+        # Not counting the connection of the stats request itself
+        after = mock_stats(endpoint)
+        results[name]["connections"] = after["connections"] - before["connections"] - 1
+        if args.tls:
+            results[name]["handshakes"] = after["handshakes"] - before["handshakes"] - 1
+        received = after["received_bytes"] - before["received_bytes"]
+        results[name]["upload_kb_per_call"] = (
+            received / results[name]["requests"] / 1024
+        )
+    mock.terminate()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous_run = json.load(file)
+        print(f"Compared with {args.compare} (commit {previous_run.get('commit')})")
+        previous = previous_run["results"]
+    print_results(results, previous)
+
+    config = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("output", "compare", "worker", "endpoint", "worker_output")
+    }
+    with open(args.output, "w") as file:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "timestamp": datetime.now().isoformat(timespec="seconds"),
+                "config": config,
+                "results": results,
+            },
+            file,
+            indent=2,
+        )
+    print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
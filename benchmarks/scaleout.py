@@ -0,0 +1,168 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "gradio",
+#     "azure-identity",
+#     "openai",
+#     "pillow",
+#     "python-dotenv",
+#     "redis",
+#     "requests",
+#     "tiktoken",
+# ]
+# ///
+
+"""
+Load test the conversational search with several worker processes sharing one
+session store, against the local mock server. Every turn of a session is picked up
+by whichever worker is free, like behind a load balancer without sticky sessions.
+Afterwards every session is checked for lost or mixed up turns.
+
+Usage: uv run scaleout.py --store sqlite:conversations.db [--workers 1 2 4] [--sessions 200]
+                          [--turns 5] [--threads 16] [--latency 0.2]
+"""
+
+import argparse
+import multiprocessing
+import os
+import statistics
+import threading
+import time
+import uuid
+
+import mock_server
+import run
+
+APP = "conversational-search"
+
+
+def worker(endpoint: str, tasks, results, threads: int):
+    """Serve turns from the task queue, and put every finished turn back."""
+    app = run.load_app(APP, endpoint)
+
+    def serve():
+        while (task := tasks.get()) is not None:
+            session_id, turn = task
+            start = time.perf_counter()
+            error = None
+            try:
+                for _ in app.chat_with_travel_assistant(
+                    f"Somewhere warm for the holidays, {session_id}, turn {turn}",
+                    [],
+                    app.gr.Request(session_hash=session_id),
+                ):
+                    pass
+            except Exception as e:
+                error = type(e).__name__
+            results.put((session_id, turn, time.perf_counter() - start, error))
+
+    results.put("ready")
+    serving = [threading.Thread(target=serve) for _ in range(threads)]
+    for thread in serving:
+        thread.start()
+    for thread in serving:
+        thread.join()
+
+
+def load(endpoint: str, workers: int, args, prefix: str) -> dict:
+    tasks, results = multiprocessing.Queue(), multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=worker, args=(endpoint, tasks, results, args.threads)
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        results.get()
+
+    # A session is in the queue at most once, so its turns never overlap
+    start = time.perf_counter()
+    for k in range(args.sessions):
+        tasks.put((f"{prefix}-session-{k}", 0))
+
+    latencies, errors = [], 0
+    while len(latencies) < args.sessions * args.turns:
+        session_id, turn, latency, error = results.get()
+        latencies.append(latency)
+        errors += error is not None
+        if turn + 1 < args.turns:
+            tasks.put((session_id, turn + 1))
+    elapsed = time.perf_counter() - start
+
+    for _ in range(workers * args.threads):
+        tasks.put(None)
+    for process in processes:
+        process.join()
+
+    return {
+        "turns": len(latencies),
+        "seconds": elapsed,
+        "turns_per_second": len(latencies) / elapsed,
+        "p95_ms": statistics.quantiles(latencies, n=100)[94] * 1000,
+        "errors": errors,
+    }
+
+
+def count_lost_turns(app, args, prefix: str) -> int:
+    """Count the turns missing from the stored sessions, or stored in the wrong one."""
+    lost = 0
+    for k in range(args.sessions):
+        session_id = f"{prefix}-session-{k}"
+        state = app.session_store.get(session_id)
+        user_messages = [m for m in state.message_history if m["role"] == "user"]
+        # User, tool call, tool result and reply are stored for every turn
+        lost += args.turns - state.stored_messages // 4
+        lost += sum(f"{session_id}," not in m["content"] for m in user_messages)
+    return lost
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--store", required=True, help="SESSION_STORE, sqlite:<path> or a Redis URL"
+    )
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=16, help="per worker")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--reply-words", type=int, default=20)
+    args = parser.parse_args()
+
+    port = run.free_port()
+    mock = multiprocessing.Process(
+        target=mock_server.serve,
+        args=(port, args.latency, args.latency / 10, 0.0, args.reply_words),
+        daemon=True,
+    )
+    mock.start()
+    endpoint = f"http://127.0.0.1:{port}"
+    os.environ["SESSION_STORE"] = args.store
+    os.environ["TURN_MODE"] = "two_call"
+
+    print(
+        f"{'workers':>7} {'turns':>6} {'seconds':>8} {'turns/sec':>10} {'scaling':>8}"
+        f" {'p95 ms':>8} {'errors':>6}"
+    )
+    prefixes, baseline = [], None
+    for workers in args.workers:
+        prefixes.append(prefix := f"{workers}w-{uuid.uuid4().hex[:8]}")
+        result = load(endpoint, workers, args, prefix)
+        baseline = baseline or result["turns_per_second"] / workers
+        print(
+            f"{workers:>7} {result['turns']:>6} {result['seconds']:>8.1f}"
+            f" {result['turns_per_second']:>10.1f}"
+            f" {result['turns_per_second'] / baseline:>7.2f}x"
+            f" {result['p95_ms']:>8.0f} {result['errors']:>6}"
+        )
+
+    app = run.load_app(APP, endpoint)
+    lost = sum(count_lost_turns(app, args, prefix) for prefix in prefixes)
+    print(f"Lost or misplaced turns: {lost}")
+    mock.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,50 +3,254 @@
 # dependencies = [
 #     "gradio",
 #     "azure-identity",
+#     "httpx",
+#     "numpy",
 #     "openai",
+#     "pandas",
+#     "pyarrow",
 #     "python-dotenv",
+#     "redis",
 #     "requests",
+#     "tiktoken",
 # ]
 # ///
 
 import json
+import logging
 import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List
 
 import gradio as gr
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+import httpx
+import redis
+import tiktoken
+from azure.identity import DefaultAzureCredential
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import APIConnectionError, AzureOpenAI, DefaultHttpxClient
 
+from offers import OfferSearch, SearchCache, generate_catalog, read_catalog
+
+# The modules shared by the demos are in the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.destinations import destination_index  # noqa: E402
+from shared.queueing import QueueMonitor  # noqa: E402
+from shared.scheduling import (  # noqa: E402
+    Deployment,
+    RequestScheduler,
+    SchedulerBusy,
+    request_priority,
+)
+
+logger = logging.getLogger(__name__)
 load_dotenv(override=True)
 
-token_provider = get_bearer_token_provider(
-    DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
+TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
+# Seconds before expiry at which the background refresh fetches a new token. A
+# request only waits for a token when less than half of this margin is left.
+TOKEN_REFRESH_MARGIN = 600
+
+
+class ClientFactory:
+    """
+    Build the Azure OpenAI clients and credential on first use instead of at import,
+    one client per deployment endpoint. With prewarm, a background thread builds
+    them at startup, fetches the Entra token, opens the connections and refreshes
+    the token before it expires, so the first request doesn't wait for any of it.
+    """
+
+    def __init__(self, keepalive_expiry: float, deployments: List["Deployment"]):
+        self.keepalive_expiry = keepalive_expiry
+        self.deployments = deployments
+        self.ready = threading.Event()
+        self._clients = {}
+        self._credential = None
+        self._access_token = None
+        self._client_lock = threading.Lock()
+        self._token_lock = threading.Lock()
+
+    @property
+    def uses_identity(self) -> bool:
+        return any(not deployment.api_key for deployment in self.deployments)
+
+    def get(self, deployment: "Deployment | None" = None) -> AzureOpenAI:
+        deployment = deployment or self.deployments[0]
+        key = (deployment.endpoint, deployment.api_key)
+        if (client := self._clients.get(key)) is None:
+            with self._client_lock:
+                if (client := self._clients.get(key)) is None:
+                    client = self._clients[key] = self._build(deployment)
+        return client
+
+    def _build(self, deployment: "Deployment") -> AzureOpenAI:
+        options = {
+            "api_version": "2025-02-01-preview",
+            "azure_endpoint": deployment.endpoint,
+            # The scheduler retries rate limited requests
+            "max_retries": 0,
+            # Keep idle connections open longer than the 5 seconds default of httpx,
+            # so the connection opened by the prewarm is still there for the first request
+            "http_client": DefaultHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=1000,
+                    max_keepalive_connections=100,
+                    keepalive_expiry=self.keepalive_expiry,
+                )
+            ),
+        }
+
+        # Initialize Azure OpenAI client with key or identity based auth
+        if not deployment.api_key:
+            return AzureOpenAI(azure_ad_token_provider=self.token, **options)
+        return AzureOpenAI(api_key=deployment.api_key, **options)
+
+    def _token_expires_within(self, seconds: float) -> bool:
+        return (
+            self._access_token is None
+            or self._access_token.expires_on - time.time() < seconds
+        )
+
+    def _fetch_token(self):
+        if self._credential is None:
+            self._credential = DefaultAzureCredential()
+        self._access_token = self._credential.get_token(TOKEN_SCOPE)
+
+    def token(self) -> str:
+        """Return the cached Entra token, fetched again when it's about to expire."""
+        if self._token_expires_within(TOKEN_REFRESH_MARGIN / 2):
+            with self._token_lock:
+                if self._token_expires_within(TOKEN_REFRESH_MARGIN / 2):
+                    self._fetch_token()
+        return self._access_token.token
+
+    def prewarm(self):
+        threading.Thread(target=self._keep_warm, daemon=True).start()
+
+    def _keep_warm(self):
+        try:
+            if self.uses_identity:
+                self.token()
+        except Exception as e:
+            logger.warning(f"Prewarming the Azure OpenAI client failed: {e}")
+        for deployment in self.deployments:
+            # Any request opens the connection, the response itself isn't needed
+            try:
+                self.get(deployment).models.list()
+            except Exception as e:
+                logger.warning(f"Opening a connection to {deployment} failed: {e}")
+        self.ready.set()
+
+        while self.uses_identity:
+            delay = 60.0
+            if not self._token_expires_within(TOKEN_REFRESH_MARGIN + delay):
+                delay = (
+                    self._access_token.expires_on - time.time() - TOKEN_REFRESH_MARGIN
+                )
+            time.sleep(delay)
+            try:
+                with self._token_lock:
+                    self._fetch_token()
+            except Exception as e:
+                logger.warning(f"Refreshing the Entra token failed: {e}")
+
+
+# Completion tokens counted against the tokens per minute before the response is in
+EXPECTED_COMPLETION_TOKENS = 500
+
+
+def env_list(name: str, default: str = "") -> List[str]:
+    """Split a comma separated environment variable."""
+    return [value.strip() for value in os.getenv(name, default).split(",")]
+
+
+def read_deployments() -> List[Deployment]:
+    """
+    Read the deployments of the pool from comma separated environment variables.
+    A variable with a single value applies to every deployment, so several
+    deployments on one endpoint, or one deployment name in several regions, only
+    need the values that differ.
+    """
+    values = {
+        "AZURE_OPENAI_ENDPOINT": env_list("AZURE_OPENAI_ENDPOINT"),
+        "AZURE_OPENAI_API_KEY": env_list("AZURE_OPENAI_API_KEY"),
+        "AZURE_OPENAI_DEPLOYMENT": env_list(
+            "AZURE_OPENAI_DEPLOYMENT", os.getenv("AZURE_OPENAI_MODEL", "gpt-4o-mini")
+        ),
+        "AZURE_OPENAI_RPM": env_list("AZURE_OPENAI_RPM", "0"),
+        "AZURE_OPENAI_TPM": env_list("AZURE_OPENAI_TPM", "0"),
+    }
+    count = max(len(value) for value in values.values())
+    for name, value in values.items():
+        if len(value) not in (1, count):
+            raise ValueError(f"{name} has {len(value)} values, expected 1 or {count}")
+        values[name] = value * count if len(value) == 1 else value
+
+    cooldown = float(os.getenv("DEPLOYMENT_COOLDOWN", "30"))
+    return [
+        Deployment(endpoint, api_key or None, name, int(rpm), int(tpm), cooldown)
+        for endpoint, api_key, name, rpm, tpm in zip(*values.values())
+    ]
+
+
+deployments = read_deployments()
+client_factory = ClientFactory(
+    float(os.getenv("CLIENT_KEEPALIVE_EXPIRY", "120")), deployments
 )
 
-# Initialize Azure OpenAI client with key or identity based auth
-if api_key := os.getenv("AZURE_OPENAI_API_KEY"):
-    client = AzureOpenAI(
-        azure_ad_token_provider=token_provider,
-        api_version="2025-02-01-preview",
-        api_key=api_key,
-    )
-else:
-    client = AzureOpenAI(
-        azure_ad_token_provider=token_provider,
-        api_version="2025-02-01-preview",
-        azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
+scheduler = RequestScheduler(
+    deployments,
+    max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", "64")),
+    max_wait=float(os.getenv("SCHEDULER_MAX_WAIT", "20")),
+    max_retries=int(os.getenv("SCHEDULER_MAX_RETRIES", "4")),
+    transport_errors=(APIConnectionError,),
+)
+
+
+def create_completion(request: Dict[str, Any], priority: int | None = None):
+    """
+    Create a chat completion on a deployment of the pool. The tokens per minute are
+    charged an estimate up front, corrected to the usage of the response, which a
+    stream brings in its last chunk.
+    """
+    tokens = len(json.dumps(request["messages"])) // 4 + request.get(
+        "max_tokens", EXPECTED_COMPLETION_TOKENS
     )
 
+    def call(deployment: Deployment):
+        response = client_factory.get(deployment).chat.completions.create(
+            **{**request, "model": deployment.name}
+        )
+        if request.get("stream"):
+            return settled_stream(response, deployment, tokens)
+        if response.usage:
+            scheduler.settle(deployment, tokens, response.usage.total_tokens)
+        return response
+
+    return scheduler.run(call, tokens, priority)
+
+
+def settled_stream(stream, deployment: Deployment, tokens: int):
+    for chunk in stream:
+        if chunk.usage:
+            scheduler.settle(deployment, tokens, chunk.usage.total_tokens)
+        yield chunk
 
-# Define system message with instructions and current date/time
+
+# Define system message with instructions. It holds no volatile context, so every
+# request starts with the same prefix and can hit the provider's prompt cache
 def get_system_message():
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     return {
         "role": "system",
-        "content": f"""You are a helpful travel assistant for a travel agency, a travel booking service.
-            Current date and time: {current_time}
+        "content": """You are a helpful travel assistant for a travel agency, a travel booking service.
 
             INSTRUCTIONS:
             - Help users find travel options based on their requirements
@@ -64,6 +268,14 @@ def get_system_message():
     }
 
 
+# Define the current date context, added late in the prompt
+def get_date_context_message():
+    return {
+        "role": "system",
+        "content": f"Current date: {datetime.now().strftime('%A %Y-%m-%d')}",
+    }
+
+
 # Define the travel search parameters extraction function
 travel_search_function = {
     "type": "function",
@@ -163,48 +375,1013 @@ def format_extracted_parameters(parameters: Dict[str, Any]) -> str:
     return "\n".join(parts)
 
 
+# Keep the history sent to the model within a token budget
+class HistoryManager:
+    """
+    Compact the message history of a conversation to a token budget.
+
+    The system message is always kept. Older turns are dropped once the budget is
+    exceeded and replaced by one synthetic system message carrying the latest merged
+    search parameters, so the model keeps the extracted context without the full
+    transcript. Token counts of every prompt are recorded for monitoring.
+
+    The encoding is loaded on first use, tiktoken downloads it the first time. When
+    it can't be loaded, tokens are estimated from the number of characters.
+    """
+
+    def __init__(self, token_budget: int, encoding: str = "o200k_base"):
+        self.token_budget = token_budget
+        self.encoding_name = encoding
+        self.prompt_tokens = deque(maxlen=1000)
+        self._encoding = None
+        self._encoding_loaded = False
+        self._encoding_lock = threading.Lock()
+
+    def count_text_tokens(self, text: str) -> int:
+        if not self._encoding_loaded:
+            with self._encoding_lock:
+                if not self._encoding_loaded:
+                    try:
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        logger.warning(
+                            f"Loading the {self.encoding_name} encoding failed,"
+                            f" estimating tokens instead: {e}"
+                        )
+                    self._encoding_loaded = True
+        if self._encoding is None:
+            # About four characters per token in English text
+            return -(-len(text) // 4)
+        return len(self._encoding.encode(text))
+
+    def count_message_tokens(self, message: Dict[str, Any]) -> int:
+        """Count the tokens of a single message, including tool call arguments."""
+        tokens = 3  # Every message is wrapped in role and separator tokens
+        if message.get("content"):
+            tokens += self.count_text_tokens(message["content"])
+        for tool_call in message.get("tool_calls") or []:
+            tokens += self.count_text_tokens(tool_call["function"]["name"])
+            tokens += self.count_text_tokens(tool_call["function"]["arguments"])
+        return tokens
+
+    def count_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """Count the prompt tokens of a list of messages."""
+        # Every reply is primed with the assistant role
+        return 3 + sum(self.count_message_tokens(message) for message in messages)
+
+    def record(self, messages: List[Dict[str, Any]]) -> int:
+        """Count and record the prompt tokens of a request about to be sent."""
+        tokens = self.count_tokens(messages)
+        self.prompt_tokens.append(tokens)
+        return tokens
+
+    def percentile(self, percentile: float) -> int:
+        """Return the given percentile of the recorded prompt token counts."""
+        if not self.prompt_tokens:
+            return 0
+        counts = sorted(self.prompt_tokens)
+        return counts[min(len(counts) - 1, int(len(counts) * percentile / 100))]
+
+    def summary_message(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the message that stands in for the dropped turns."""
+        return {
+            "role": "system",
+            "content": "Search parameters extracted earlier in this conversation: "
+            + json.dumps(parameters),
+        }
+
+    def compact(
+        self, message_history: List[Dict[str, Any]], parameters: Dict[str, Any]
+    ) -> None:
+        """Drop the oldest turns from the history in place until it fits the budget."""
+        system_message = message_history[0]
+
+        # A turn starts with a user message and holds the assistant and tool replies
+        turns = []
+        for message in message_history[1:]:
+            if message["role"] == "user":
+                turns.append([message])
+            elif turns:
+                turns[-1].append(message)
+
+        summary_message = self.summary_message(parameters)
+        summary_tokens = self.count_message_tokens(summary_message) if parameters else 0
+        tokens = self.count_tokens([system_message]) + summary_tokens
+
+        # Keep the most recent turns that fit, always keeping the latest one
+        kept_turns = []
+        for turn in reversed(turns):
+            turn_tokens = sum(self.count_message_tokens(message) for message in turn)
+            if kept_turns and tokens + turn_tokens > self.token_budget:
+                break
+            kept_turns.insert(0, turn)
+            tokens += turn_tokens
+
+        # Nothing to do while every turn fits and no summary has been added yet
+        has_summary = len(message_history) > 1 and message_history[1]["role"] != "user"
+        if len(kept_turns) == len(turns) and not has_summary:
+            return
+
+        message_history[:] = [system_message]
+        if parameters:
+            message_history.append(summary_message)
+        for turn in kept_turns:
+            message_history.extend(turn)
+
+
+history_manager = HistoryManager(int(os.getenv("HISTORY_TOKEN_BUDGET", "2000")))
+
+
+# Build chat completion requests that share the longest possible prompt prefix
+class ChatRequestBuilder:
+    """
+    Build chat completion requests for provider-side prompt caching.
+
+    Prompt caching only hits on an identical prompt prefix, so the static system
+    instructions and the tool schema come first on every call, followed by the
+    conversation. Volatile context, the current date, is only added right before
+    the latest user message. Cached token counts of every response are recorded.
+    """
+
+    def __init__(self, tools: List[Dict[str, Any]]):
+        self.tools = tools
+        self.calls = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def build(self, message_history: List[Dict[str, Any]], **options) -> Dict[str, Any]:
+        """Return the keyword arguments for client.chat.completions.create."""
+        last_user_index = max(
+            i for i, message in enumerate(message_history) if message["role"] == "user"
+        )
+        messages = [
+            *message_history[:last_user_index],
+            get_date_context_message(),
+            *message_history[last_user_index:],
+        ]
+        history_manager.record(messages)
+
+        return {
+            "model": os.environ.get("AZURE_OPENAI_MODEL", "gpt-4o-mini"),
+            "messages": messages,
+            "tools": self.tools,
+            **options,
+        }
+
+    def record_usage(self, usage) -> None:
+        """Record the prompt, cached and completion token counts of a response."""
+        if usage is None:
+            return
+        details = usage.prompt_tokens_details
+        cached_tokens = (details.cached_tokens or 0) if details else 0
+
+        self.calls += 1
+        self.cache_hits += cached_tokens > 0
+        self.prompt_tokens += usage.prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.completion_tokens += usage.completion_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_ratio": self.cached_tokens / self.prompt_tokens
+            if self.prompt_tokens
+            else 0.0,
+        }
+
+
+request_builder = ChatRequestBuilder([travel_search_function])
+
+
+class ResponseTimeMetrics:
+    """
+    Record how long users wait for a turn, in seconds since their message arrived:
+    until the extracted parameters are shown and until the first token of the reply.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.samples = {
+            "time_to_parameters": deque(maxlen=window),
+            "time_to_first_token": deque(maxlen=window),
+        }
+
+    def record(self, metric: str, seconds: float) -> None:
+        self.samples[metric].append(seconds)
+
+    def percentile(self, metric: str, percentile: float) -> float:
+        """Return the given percentile of the recorded times of a metric."""
+        if not self.samples[metric]:
+            return 0.0
+        times = sorted(self.samples[metric])
+        return times[min(len(times) - 1, int(len(times) * percentile / 100))]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            f"{metric}_p{percentile}": self.percentile(metric, percentile)
+            for metric in self.samples
+            for percentile in (50, 95)
+        }
+
+
+response_time_metrics = ResponseTimeMetrics()
+
+
+# Chat turns running at once, each holds a worker thread while it streams the reply
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", "16"))
+# Events waiting in the queue, more are turned away with "queue is full"
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", "100"))
+queue_monitor = QueueMonitor(QUEUE_MAX_SIZE, {"chat": CHAT_CONCURRENCY})
+
+
+NO_PARAMETERS_TEXT = "No search parameters have been specified yet."
+
+
+class TravelParameters:
+    """
+    The travel search parameters extracted so far. Newly extracted parameters are
+    merged in with `apply`, and the text and JSON shown in the interface are only
+    rendered again when a field changed.
+    """
+
+    FIELDS = ("destination", "departure_date", "duration", "trip_type")
+    PARTICIPANTS = ("adults", "children", "infants")
+
+    __slots__ = (*FIELDS, *PARTICIPANTS, "revision", "formatted", "json_text")
+
+    destination: List[str] | None
+    departure_date: str | None
+    duration: int | None
+    trip_type: str | None
+    adults: int | None
+    children: int | None
+    infants: int | None
+
+    def __init__(self):
+        for field in self.FIELDS + self.PARTICIPANTS:
+            setattr(self, field, None)
+        # Incremented on every change, so the interface can skip unchanged output
+        self.revision = 0
+        self.formatted = NO_PARAMETERS_TEXT
+        self.json_text = "{}"
+
+    def apply(self, delta: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Merge newly extracted parameters, skipping empty values, and return the
+        fields that changed with their new value. Participants are merged field by
+        field rather than replaced.
+        """
+        participants = delta.get("participants")
+        values = [(field, delta.get(field)) for field in self.FIELDS]
+        if isinstance(participants, dict):
+            values += [(field, participants.get(field)) for field in self.PARTICIPANTS]
+
+        changes = {}
+        for field, value in values:
+            if value is not None and value != getattr(self, field):
+                setattr(self, field, value)
+                changes[field] = value
+
+        if changes:
+            self.revision += 1
+            parameters = self.to_dict()
+            self.formatted = format_extracted_parameters(parameters)
+            self.json_text = json.dumps(parameters, indent=2)
+        return changes
+
+    @classmethod
+    def restore(cls, parameters: Dict[str, Any], revision: int) -> "TravelParameters":
+        """Return stored parameters at the revision they were stored with."""
+        restored = cls()
+        restored.apply(parameters)
+        restored.revision = revision
+        return restored
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the parameters that are set, in the shape of the extraction tool."""
+        parameters = {
+            field: getattr(self, field)
+            for field in self.FIELDS
+            if getattr(self, field) is not None
+        }
+        participants = {
+            field: getattr(self, field)
+            for field in self.PARTICIPANTS
+            if getattr(self, field) is not None
+        }
+        if participants:
+            parameters["participants"] = participants
+        return parameters
+
+
 # Store conversation history and extracted parameters
 class ConversationState:
+    # Slots keep the per-session overhead small with thousands of live sessions
+    __slots__ = (
+        "message_history",
+        "parameters",
+        "turn_changes",
+        "shown_revision",
+        "searched_parameters",
+        "search_outcomes",
+        "last_used",
+        "version",
+        "stored_messages",
+        "loaded_length",
+    )
+
     def __init__(self):
-        self.message_history = []
-        self.current_parameters = {}
-        self.formatted_parameters = "No search parameters have been specified yet."
-        self.json_parameters = "{}"
+        self.reset()
+        self.last_used = time.monotonic()
+        # Bookkeeping of persistent stores: the version the state was loaded with,
+        # the number of messages stored for the session and the length of the
+        # history when loaded, which counts the system message of a new session
+        self.version = 0
+        self.stored_messages = 0
+        self.loaded_length = 1
 
     def reset(self):
         self.message_history = []
-        self.current_parameters = {}
-        self.formatted_parameters = "No search parameters have been specified yet."
-        self.json_parameters = "{}"
+        self.parameters = TravelParameters()
+        # The fields changed in the current turn, and the revision of the
+        # parameters the interface shows
+        self.turn_changes = {}
+        self.shown_revision = 0
+        # The parameters of the last offer search, and the number of searches that
+        # were cached, refined or new
+        self.searched_parameters = None
+        self.search_outcomes = {"hit": 0, "refinement": 0, "search": 0}
 
+    def search_rates(self) -> Dict[str, float]:
+        """Return the share of the offer searches of the session that were cached or refined."""
+        searches = sum(self.search_outcomes.values())
+        return {
+            "hit_rate": self.search_outcomes["hit"] / searches if searches else 0.0,
+            "refinement_rate": (
+                self.search_outcomes["refinement"] / searches if searches else 0.0
+            ),
+        }
 
-conversation_state = ConversationState()
+    def merge_parameters(self, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        """Merge newly extracted parameters, and return the fields that changed."""
+        changes = self.parameters.apply(parameters)
+        self.turn_changes.update(changes)
+        return changes
 
 
-def chat_with_travel_assistant(user_message: str, history: List[List[str]]) -> tuple:
-    """Process the user message, update the chat history, and extract parameters."""
-    global conversation_state
+class ParameterEvents:
+    """
+    Publish the parameters that changed in a turn, so consumers like a search can
+    follow the conversation without reading the full state of every session.
+    Subscribers are called with the session id and the changed fields, on the
+    thread that handled the turn, and only for turns that changed something.
+    """
 
-    if not user_message.strip():
-        return (
-            "",
-            history,
-            conversation_state.formatted_parameters,
-            conversation_state.json_parameters,
+    def __init__(self):
+        self.subscribers = []
+
+    def subscribe(self, callback: Callable[[str, Dict[str, Any]], None]) -> None:
+        self.subscribers.append(callback)
+
+    def publish(self, session_id: str, changes: Dict[str, Any]) -> None:
+        for callback in self.subscribers:
+            try:
+                callback(session_id, changes)
+            except Exception:
+                logger.exception("A parameter change subscriber failed")
+
+
+parameter_events = ParameterEvents()
+
+
+def log_parameter_changes(session_id: str, changes: Dict[str, Any]) -> None:
+    logger.info(f"Parameters of session {session_id} changed: {json.dumps(changes)}")
+
+
+# The log follows the parameters of every conversation, turn by turn
+parameter_events.subscribe(log_parameter_changes)
+
+
+class OfferCatalog:
+    """
+    Load the offer catalog on first use, from OFFER_CATALOG or else a synthetic
+    catalog, or in the background at startup with prewarm.
+    """
+
+    def __init__(self, path: str | None, rows: int):
+        self.path = path
+        self.rows = rows
+        self.ready = threading.Event()
+        self._search = None
+        self._lock = threading.Lock()
+
+    def get(self) -> OfferSearch:
+        if self._search is None:
+            with self._lock:
+                if self._search is None:
+                    self._search = self._load()
+                    self.ready.set()
+        return self._search
+
+    def _load(self) -> OfferSearch:
+        start = time.perf_counter()
+        if self.path:
+            catalog = read_catalog(self.path)
+        else:
+            catalog = generate_catalog(self.rows)
+        search = OfferSearch(catalog)
+        logger.info(
+            f"Loaded {len(search)} offers in {time.perf_counter() - start:.1f}s,"
+            f" {search.nbytes() / 1024 / 1024:.0f} MB"
+        )
+        return search
+
+    def prewarm(self):
+        threading.Thread(target=self.get, daemon=True).start()
+
+
+offer_catalog = OfferCatalog(
+    os.getenv("OFFER_CATALOG"), int(os.getenv("OFFER_CATALOG_SIZE", "1000000"))
+)
+
+OFFER_COLUMNS = ["Hotel", "Destination", "Departure", "Days", "Rating", "Price p.p."]
+
+
+offer_cache = SearchCache(
+    int(os.getenv("OFFER_CACHE_SIZE", "10000")),
+    int(os.getenv("OFFER_CACHE_ROWS", "5000000")),
+)
+
+
+def search_offers(state: ConversationState) -> List[List[Any]]:
+    """
+    Return the best offers for the parameters of the session as rows of the offers
+    table. Searches go through the cache, and refine the previous search of the
+    session when the parameters only added to it.
+    """
+    parameters = state.parameters.to_dict()
+    offers, outcome = offer_cache.search(
+        offer_catalog.get(), parameters, state.searched_parameters
+    )
+    state.searched_parameters = parameters
+    state.search_outcomes[outcome] += 1
+    return [
+        [
+            offer["hotel"],
+            offer["destination"],
+            offer["departure_date"],
+            offer["duration"],
+            offer["rating"],
+            f"€{offer['price']:,.0f}",
+        ]
+        for offer in offers
+    ]
+
+
+def approximate_size(value) -> int:
+    """Return the approximate memory size in bytes of a value and its contents."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(k) + approximate_size(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(approximate_size(item) for item in value)
+    elif hasattr(type(value), "__slots__"):
+        size += sum(
+            approximate_size(getattr(value, name)) for name in type(value).__slots__
+        )
+    return size
+
+
+class SessionStore:
+    """
+    Keep the conversation state of every browser session, in least recently used
+    order. Sessions idle for longer than the TTL are evicted, and the least recently
+    used session is evicted once the store is full, so memory stays bounded no
+    matter how many users come and go.
+    """
+
+    def __init__(self, max_sessions: int, idle_ttl: float):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> ConversationState:
+        """Return the state of a session, starting a new one if there is none."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            state = self._sessions.pop(session_id, None) or ConversationState()
+            state.last_used = now
+            self._sessions[session_id] = state
+
+            if len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        return state
+
+    def _evict_idle(self, now: float) -> None:
+        # The least recently used sessions come first
+        while self._sessions:
+            state = next(iter(self._sessions.values()))
+            if now - state.last_used < self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.evictions += 1
+
+    def save(self, session_id: str, state: ConversationState) -> None:
+        # The state stays in memory, only its history is compacted
+        history_manager.compact(state.message_history, state.parameters.to_dict())
+
+    def remove(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def unload(self, session_id: str) -> None:
+        """Drop the copy of a session in memory, which is the only one."""
+        self.remove(session_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            states = list(self._sessions.values())
+        return {
+            "sessions": len(states),
+            "bytes": sum(approximate_size(state) for state in states),
+            "evictions": self.evictions,
+        }
+
+
+class ConcurrentUpdateError(Exception):
+    """Raised when a session was saved by another request since it was loaded."""
+
+
+class PersistentSessionStore:
+    """
+    Base of the stores that keep conversations outside the process, so any worker
+    can continue any session and conversations survive a restart.
+
+    Messages are only ever appended, a save writes the messages of the latest turn.
+    Compacting the history doesn't rewrite it either: the session records the first
+    message that is still loaded, and the summary of the dropped turns is rebuilt
+    from the stored parameters. Every save checks and increments the version the
+    state was loaded with, so concurrent turns of one session can't overwrite each
+    other. The parameters are stored with their revision and the last offer search
+    of the session, so a session continues on another worker as it left off.
+    """
+
+    # The fields of `_session`, in the order a SQLite row holds them
+    SESSION_FIELDS = (
+        "parameters",
+        "revision",
+        "searched_parameters",
+        "search_outcomes",
+    )
+
+    def unload(self, session_id: str) -> None:
+        """
+        Drop the copy of a session in memory. Stored sessions are loaded on every
+        turn, so there is none, and the stored session stays to be continued.
+        """
+
+    def _session(self, state: ConversationState) -> Dict[str, Any]:
+        """Return the fields of the session stored next to its messages."""
+        return {
+            "parameters": json.dumps(state.parameters.to_dict()),
+            "revision": state.parameters.revision,
+            "searched_parameters": json.dumps(state.searched_parameters),
+            "search_outcomes": json.dumps(state.search_outcomes),
+        }
+
+    def _restore(
+        self,
+        session: Dict[str, Any],
+        messages: List[Dict[str, Any]],
+        first_message: int,
+        version: int,
+        stored_messages: int,
+    ) -> ConversationState:
+        state = ConversationState()
+        state.version = version
+        state.stored_messages = stored_messages
+        if not messages:
+            return state
+
+        parameters = json.loads(session["parameters"])
+        state.message_history = [get_system_message()]
+        if first_message > 0 and parameters:
+            state.message_history.append(history_manager.summary_message(parameters))
+        state.message_history.extend(messages)
+        state.parameters = TravelParameters.restore(
+            parameters, int(session["revision"])
+        )
+        # The turn that stored the session showed its parameters
+        state.shown_revision = state.parameters.revision
+        state.searched_parameters = json.loads(session["searched_parameters"])
+        state.search_outcomes = json.loads(session["search_outcomes"])
+        state.loaded_length = len(state.message_history)
+        return state
+
+    def _prepare_save(self, state: ConversationState) -> tuple:
+        """Compact the history, and return the new messages and the first message to load."""
+        new_messages = state.message_history[state.loaded_length :]
+        history_manager.compact(state.message_history, state.parameters.to_dict())
+
+        # Everything after the system message and the summary is stored
+        loaded = len(state.message_history) - 1
+        if loaded and state.message_history[1]["role"] == "system":
+            loaded -= 1
+        stored_messages = state.stored_messages + len(new_messages)
+        return new_messages, stored_messages - loaded, stored_messages
+
+    def _saved(self, state: ConversationState, stored_messages: int) -> None:
+        state.version += 1
+        state.stored_messages = stored_messages
+        state.loaded_length = len(state.message_history)
+
+
+class SQLiteSessionStore(PersistentSessionStore):
+    """
+    Keep conversations in a SQLite database in WAL mode, shared by the worker
+    processes on one host.
+    """
+
+    def __init__(self, path: str, idle_ttl: float):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.evictions = 0
+        self.saves = 0
+        self._local = threading.local()
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY,"
+            " version INTEGER, parameters TEXT, revision INTEGER,"
+            " searched_parameters TEXT, search_outcomes TEXT, first_message INTEGER,"
+            " stored_messages INTEGER, updated_at REAL)"
         )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages (session_id TEXT, seq INTEGER,"
+            " message TEXT, PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections can't be shared between the threads that run the handlers
+        if (connection := getattr(self._local, "connection", None)) is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, session_id: str) -> ConversationState:
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT version, parameters, revision, searched_parameters,"
+            " search_outcomes, first_message, stored_messages, updated_at"
+            " FROM sessions WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        if row is None:
+            return ConversationState()
+
+        version, *session, first_message, stored_messages, updated_at = row
+        # An idle session starts a new conversation after its stored messages
+        if time.time() - updated_at > self.idle_ttl:
+            state = ConversationState()
+            state.version, state.stored_messages = version, stored_messages
+            return state
+
+        messages = [
+            json.loads(message)
+            for (message,) in connection.execute(
+                "SELECT message FROM messages WHERE session_id = ? AND seq >= ?"
+                " ORDER BY seq",
+                (session_id, first_message),
+            )
+        ]
+        return self._restore(
+            dict(zip(self.SESSION_FIELDS, session)),
+            messages,
+            first_message,
+            version,
+            stored_messages,
+        )
+
+    def save(self, session_id: str, state: ConversationState) -> None:
+        new_messages, first_message, stored_messages = self._prepare_save(state)
+        values = {
+            **self._session(state),
+            "first_message": first_message,
+            "stored_messages": stored_messages,
+            "updated_at": time.time(),
+        }
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if state.version == 0:
+                saved = connection.execute(
+                    "INSERT OR IGNORE INTO sessions VALUES (:session_id, 1, :parameters,"
+                    " :revision, :searched_parameters, :search_outcomes,"
+                    " :first_message, :stored_messages, :updated_at)",
+                    {"session_id": session_id, **values},
+                ).rowcount
+            else:
+                saved = connection.execute(
+                    "UPDATE sessions SET version = version + 1, parameters = :parameters,"
+                    " revision = :revision, searched_parameters = :searched_parameters,"
+                    " search_outcomes = :search_outcomes, first_message = :first_message,"
+                    " stored_messages = :stored_messages, updated_at = :updated_at"
+                    " WHERE session_id = :session_id AND version = :version",
+                    {"session_id": session_id, "version": state.version, **values},
+                ).rowcount
+            if not saved:
+                raise ConcurrentUpdateError(session_id)
+
+            connection.executemany(
+                "INSERT INTO messages VALUES (?, ?, ?)",
+                (
+                    (session_id, seq, json.dumps(message))
+                    for seq, message in enumerate(new_messages, state.stored_messages)
+                ),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._saved(state, stored_messages)
+
+        self.saves += 1
+        if self.saves % 1000 == 0:
+            self._evict_idle()
+
+    def _evict_idle(self) -> None:
+        connection = self._connection()
+        expired = time.time() - self.idle_ttl
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute(
+            "DELETE FROM messages WHERE session_id IN"
+            " (SELECT session_id FROM sessions WHERE updated_at < ?)",
+            (expired,),
+        )
+        self.evictions += connection.execute(
+            "DELETE FROM sessions WHERE updated_at < ?", (expired,)
+        ).rowcount
+        connection.execute("COMMIT")
+
+    def remove(self, session_id: str) -> None:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        connection.execute("COMMIT")
+
+    def stats(self) -> Dict[str, int]:
+        connection = self._connection()
+        (sessions,) = connection.execute(
+            "SELECT COUNT(*) FROM sessions WHERE updated_at >= ?",
+            (time.time() - self.idle_ttl,),
+        ).fetchone()
+        (page_count,) = connection.execute("PRAGMA page_count").fetchone()
+        (page_size,) = connection.execute("PRAGMA page_size").fetchone()
+        return {
+            "sessions": sessions,
+            "bytes": page_count * page_size,
+            "evictions": self.evictions,
+        }
+
 
-    # Initialize conversation with system message if this is the first message
-    if not conversation_state.message_history:
-        conversation_state.message_history.append(get_system_message())
+class RedisSessionStore(PersistentSessionStore):
+    """
+    Keep conversations in Redis, or a server compatible with it, shared by worker
+    processes on any host. Idle sessions expire through the key TTL.
+    """
 
-    # Add user message to history
-    conversation_state.message_history.append({"role": "user", "content": user_message})
+    def __init__(self, url: str, idle_ttl: float):
+        self.redis = redis.Redis.from_url(url)
+        self.idle_ttl = int(idle_ttl)
 
-    # Get response from OpenAI with function calling - Force function call by setting tool_choice
-    response = client.chat.completions.create(
-        model=os.environ.get("AZURE_OPENAI_MODEL", "gpt-4o-mini"),
-        messages=conversation_state.message_history,
-        tools=[travel_search_function],
+    def get(self, session_id: str) -> ConversationState:
+        session = self.redis.hgetall(f"conversation:{session_id}")
+        if not session:
+            return ConversationState()
+
+        first_message = int(session[b"first_message"])
+        messages = self.redis.lrange(
+            f"conversation:{session_id}:messages", first_message, -1
+        )
+        return self._restore(
+            {key.decode(): value for key, value in session.items()},
+            [json.loads(message) for message in messages],
+            first_message,
+            int(session[b"version"]),
+            int(session[b"stored_messages"]),
+        )
+
+    def save(self, session_id: str, state: ConversationState) -> None:
+        new_messages, first_message, stored_messages = self._prepare_save(state)
+        key = f"conversation:{session_id}"
+
+        with self.redis.pipeline() as pipeline:
+            try:
+                pipeline.watch(key)
+                if int(pipeline.hget(key, "version") or 0) != state.version:
+                    raise ConcurrentUpdateError(session_id)
+
+                pipeline.multi()
+                if new_messages:
+                    pipeline.rpush(
+                        f"{key}:messages", *(json.dumps(m) for m in new_messages)
+                    )
+                pipeline.hset(
+                    key,
+                    mapping={
+                        "version": state.version + 1,
+                        **self._session(state),
+                        "first_message": first_message,
+                        "stored_messages": stored_messages,
+                    },
+                )
+                pipeline.expire(key, self.idle_ttl)
+                pipeline.expire(f"{key}:messages", self.idle_ttl)
+                pipeline.execute()
+            except redis.WatchError as e:
+                raise ConcurrentUpdateError(session_id) from e
+        self._saved(state, stored_messages)
+
+    def remove(self, session_id: str) -> None:
+        self.redis.delete(
+            f"conversation:{session_id}", f"conversation:{session_id}:messages"
+        )
+
+    def stats(self) -> Dict[str, int]:
+        sessions = sum(
+            not key.endswith(b":messages")
+            for key in self.redis.scan_iter("conversation:*", count=1000)
+        )
+        info = self.redis.info()
+        return {
+            "sessions": sessions,
+            "bytes": info["used_memory"],
+            "evictions": info["expired_keys"] + info["evicted_keys"],
+        }
+
+
+def create_session_store():
+    """Create the store selected with SESSION_STORE: memory, sqlite:<path> or a Redis URL."""
+    store = os.getenv("SESSION_STORE", "memory")
+    idle_ttl = float(os.getenv("SESSION_IDLE_TTL", "3600"))
+    if store.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionStore(store, idle_ttl)
+    if store.startswith("sqlite:"):
+        return SQLiteSessionStore(store.removeprefix("sqlite:"), idle_ttl)
+    if store == "memory":
+        return SessionStore(int(os.getenv("SESSION_MAX", "10000")), idle_ttl)
+    raise ValueError(f"Unknown SESSION_STORE {store!r}")
+
+
+session_store = create_session_store()
+
+
+class SessionLocks:
+    """
+    Run the turns of a session one after the other within the process, so two
+    turns sent at once don't change its state at the same time. The lock of a
+    session is dropped once no turn holds or waits for it.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, session_id: str):
+        with self._lock:
+            lock, holders = self._locks.get(session_id, (threading.Lock(), 0))
+            self._locks[session_id] = (lock, holders + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._lock:
+                lock, holders = self._locks[session_id]
+                if holders > 1:
+                    self._locks[session_id] = (lock, holders - 1)
+                else:
+                    del self._locks[session_id]
+
+
+session_locks = SessionLocks()
+
+
+def session_id(request: gr.Request | None) -> str:
+    # Calls from outside the interface, without a request, share one session
+    return request.session_hash if request and request.session_hash else "default"
+
+
+# How a turn gets the parameters and the reply, selectable per deployment:
+#   two_call     a forced tool call, then a request for the reply
+#   single       one request with a structured response holding both
+#   speculative  both requests of two_call at the same time, the reply is written
+#                without seeing the extracted parameters
+TURN_MODE = os.getenv("TURN_MODE", "two_call")
+if TURN_MODE not in ("two_call", "single", "speculative"):
+    raise ValueError(f"Unknown TURN_MODE {TURN_MODE!r}")
+
+# The parameters come first, so they can be shown before the reply is streamed
+turn_response_format = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "travel_assistant_turn",
+        "schema": {
+            "type": "object",
+            "properties": {
+                "parameters": {
+                    **travel_search_function["function"]["parameters"],
+                    "description": "The travel search parameters in the latest user message",
+                },
+                "reply": {
+                    "type": "string",
+                    "description": "Your reply to the user",
+                },
+            },
+            "required": ["parameters", "reply"],
+        },
+    },
+}
+
+
+class TurnResponseParser:
+    """
+    Parse a streamed structured turn response as it comes in. The parameters are
+    available once their object is complete, the reply grows with every chunk.
+    """
+
+    REPLY_START = re.compile(r'\s*,\s*"reply"\s*:\s*"')
+
+    def __init__(self):
+        self.content = ""
+        self.parameters = None
+        self.reply = ""
+        self._reply_start = None
+        self._decoder = json.JSONDecoder()
+
+    def feed(self, content: str) -> None:
+        self.content += content
+
+        if self.parameters is None:
+            start = self.content.find("{", self.content.find('"parameters"'))
+            if start == -1:
+                return
+            try:
+                self.parameters, end = self._decoder.raw_decode(self.content, start)
+            except json.JSONDecodeError:
+                return  # The parameters aren't complete yet
+            if match := self.REPLY_START.match(self.content, end):
+                self._reply_start = match.end()
+
+        if self._reply_start is None:
+            if match := self.REPLY_START.search(self.content):
+                self._reply_start = match.end()
+            else:
+                return
+
+        # Decode the reply up to the last complete character, an escape sequence
+        # can be split over chunks
+        raw_reply = self.content[self._reply_start :]
+        end_quote = re.search(r'(?<!\\)(\\\\)*"', raw_reply)
+        if end_quote:
+            raw_reply = raw_reply[: end_quote.end() - 1]
+        for cut in range(min(6, len(raw_reply)) + 1):
+            try:
+                self.reply = json.loads(f'"{raw_reply[: len(raw_reply) - cut]}"')
+                return
+            except json.JSONDecodeError:
+                continue
+
+    def finish(self) -> None:
+        """Fall back to the complete response, or use it as the reply if it isn't JSON."""
+        try:
+            response = json.loads(self.content)
+            self.parameters = response.get("parameters") or {}
+            self.reply = response.get("reply", "")
+        except (json.JSONDecodeError, AttributeError):
+            if self.parameters is None:
+                self.parameters = {}
+                self.reply = self.content
+
+
+def extraction_request(message_history: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Force the function call by setting tool_choice
+    return request_builder.build(
+        message_history,
         tool_choice={
             "type": "function",
             "function": {"name": "extract_travel_search_parameters"},
@@ -212,114 +1389,284 @@ def chat_with_travel_assistant(user_message: str, history: List[List[str]]) -> t
         temperature=0.2,
     )
 
-    # Extract the response and function calls
-    message = response.choices[0].message
-
-    # Add assistant's response to history
-    conversation_state.message_history.append(message.model_dump())
-
-    # Extract parameters if function was called
-    if message.tool_calls:
-        # Find the tool call for parameter extraction
-        for tool_call in message.tool_calls:
-            if tool_call.function.name == "extract_travel_search_parameters":
-                # Extract parameters
-                parameters = json.loads(tool_call.function.arguments)
-
-                # Update current parameters, merging with existing ones
-                if (
-                    "participants" in parameters
-                    and "participants" in conversation_state.current_parameters
-                ):
-                    # Special handling for participants to merge rather than replace
-                    for key, value in parameters["participants"].items():
-                        if value is not None:
-                            conversation_state.current_parameters["participants"][
-                                key
-                            ] = value
-
-                    # Remove the participants from the new parameters to avoid double processing
-                    parameters_without_participants = {
-                        k: v for k, v in parameters.items() if k != "participants"
-                    }
-                    conversation_state.current_parameters.update(
-                        {
-                            k: v
-                            for k, v in parameters_without_participants.items()
-                            if v is not None
-                        }
-                    )
-                else:
-                    # For the first time or when completely replacing participants
-                    if "participants" in parameters:
-                        # If participants is in the new parameters but not current, initialize it
-                        if "participants" not in conversation_state.current_parameters:
-                            conversation_state.current_parameters["participants"] = {}
-                        # Update each participant value that is not None
-                        for key, value in parameters["participants"].items():
-                            if value is not None:
-                                conversation_state.current_parameters["participants"][
-                                    key
-                                ] = value
-                        # Remove participants from parameters to avoid double processing
-                        parameters = {
-                            k: v for k, v in parameters.items() if k != "participants"
-                        }
-
-                    # Update other parameters
-                    conversation_state.current_parameters.update(
-                        {k: v for k, v in parameters.items() if v is not None}
-                    )
 
-                # Format parameters for display
-                conversation_state.formatted_parameters = format_extracted_parameters(
-                    conversation_state.current_parameters
-                )
-                conversation_state.json_parameters = json.dumps(
-                    conversation_state.current_parameters, indent=2
-                )
+def reply_request(message_history: List[Dict[str, Any]], **options) -> Dict[str, Any]:
+    # The tools are sent again, but not used, to keep the prompt prefix of the first call
+    return request_builder.build(
+        message_history,
+        tool_choice="none",
+        temperature=0.2,
+        stream=True,
+        stream_options={"include_usage": True},
+        **options,
+    )
+
 
-                # Add tool response to history
-                conversation_state.message_history.append(
-                    {
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "name": tool_call.function.name,
-                        "content": conversation_state.formatted_parameters,
-                    }
+def apply_extraction(state: ConversationState, message) -> None:
+    """Add a tool call response to the history and merge its parameters."""
+    state.message_history.append(message.model_dump())
+
+    for tool_call in message.tool_calls or []:
+        if tool_call.function.name == "extract_travel_search_parameters":
+            parameters = json.loads(tool_call.function.arguments)
+            if "destination" in parameters:
+                parameters["destination"] = destination_index.normalize_destinations(
+                    parameters["destination"]
                 )
+            state.merge_parameters(parameters)
+
+            # Add tool response to history
+            state.message_history.append(
+                {
+                    "role": "tool",
+                    "tool_call_id": tool_call.id,
+                    "name": tool_call.function.name,
+                    "content": state.parameters.formatted,
+                }
+            )
 
-    # Get the final response after function call
-    final_response = client.chat.completions.create(
-        model=os.environ.get("AZURE_OPENAI_MODEL", "gpt-4o-mini"),
-        messages=conversation_state.message_history,
-        temperature=0.2,
-    )
 
-    assistant_message = final_response.choices[0].message.content
-    conversation_state.message_history.append(
+def apply_structured_parameters(
+    state: ConversationState, parameters: Dict[str, Any]
+) -> None:
+    """Add parameters of a structured response to the history as a tool call, so
+    the history has the same shape in every turn mode."""
+    if "destination" in parameters:
+        parameters["destination"] = destination_index.normalize_destinations(
+            parameters["destination"]
+        )
+    tool_call_id = f"call_{uuid.uuid4().hex[:24]}"
+    state.message_history.append(
         {
             "role": "assistant",
-            "content": assistant_message,
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": tool_call_id,
+                    "type": "function",
+                    "function": {
+                        "name": "extract_travel_search_parameters",
+                        "arguments": json.dumps(parameters),
+                    },
+                }
+            ],
+        }
+    )
+    state.merge_parameters(parameters)
+    state.message_history.append(
+        {
+            "role": "tool",
+            "tool_call_id": tool_call_id,
+            "name": "extract_travel_search_parameters",
+            "content": state.parameters.formatted,
         }
     )
 
-    # Update the chat history
-    history.append([user_message, assistant_message])
 
+def interface_update(state: ConversationState, history: List[List[str]]) -> tuple:
+    # Only send the parameters to the browser when they changed since last shown
+    if state.parameters.revision == state.shown_revision:
+        return "", history, gr.skip(), gr.skip(), gr.skip()
+    state.shown_revision = state.parameters.revision
     return (
         "",
         history,
-        conversation_state.formatted_parameters,
-        conversation_state.json_parameters,
+        state.parameters.formatted,
+        state.parameters.json_text,
+        search_offers(state),
+    )
+
+
+def stream_reply(
+    state: ConversationState, stream, history: List[List[str]], start: float
+):
+    """Stream the reply into the last message of the chat history."""
+    for chunk in stream:
+        # The usage is sent in a last chunk without choices
+        if chunk.usage:
+            request_builder.record_usage(chunk.usage)
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+
+        if not history[-1][1]:
+            response_time_metrics.record(
+                "time_to_first_token", time.perf_counter() - start
+            )
+        history[-1][1] += chunk.choices[0].delta.content
+        yield interface_update(state, history)
+
+
+def two_call_turn(state: ConversationState, history: List[List[str]], start: float):
+    response = create_completion(extraction_request(state.message_history))
+    request_builder.record_usage(response.usage)
+    apply_extraction(state, response.choices[0].message)
+
+    # Show the extracted parameters right away, with an empty reply to stream into
+    response_time_metrics.record("time_to_parameters", time.perf_counter() - start)
+    yield interface_update(state, history)
+
+    stream = create_completion(reply_request(state.message_history))
+    yield from stream_reply(state, stream, history, start)
+
+
+def speculative_turn(state: ConversationState, history: List[List[str]], start: float):
+    # Both requests are built before the history changes
+    requests = (
+        extraction_request(state.message_history),
+        reply_request(state.message_history),
     )
 
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # The executor threads don't see the priority of this context
+        priority = request_priority.get()
+        extraction, reply = (
+            executor.submit(create_completion, request, priority)
+            for request in requests
+        )
+
+        def apply_extraction_once():
+            nonlocal extraction
+            if extraction is not None:
+                response = extraction.result()
+                request_builder.record_usage(response.usage)
+                apply_extraction(state, response.choices[0].message)
+                extraction = None
+                response_time_metrics.record(
+                    "time_to_parameters", time.perf_counter() - start
+                )
+                return True
+            return False
+
+        wait([extraction, reply], return_when=FIRST_COMPLETED)
+        if extraction.done():
+            apply_extraction_once()
+        yield interface_update(state, history)
+
+        for update in stream_reply(state, reply.result(), history, start):
+            if extraction is not None and extraction.done():
+                apply_extraction_once()
+                update = interface_update(state, history)
+            yield update
+
+        # The tool call and its result go before the reply in the history
+        if apply_extraction_once():
+            yield interface_update(state, history)
+
+
+def single_call_turn(state: ConversationState, history: List[List[str]], start: float):
+    stream = create_completion(
+        reply_request(state.message_history, response_format=turn_response_format)
+    )
+    yield interface_update(state, history)
+
+    parser = TurnResponseParser()
+    applied = False
+    for chunk in stream:
+        if chunk.usage:
+            request_builder.record_usage(chunk.usage)
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            continue
+
+        parser.feed(chunk.choices[0].delta.content)
+        if parser.parameters is not None and not applied:
+            apply_structured_parameters(state, parser.parameters)
+            applied = True
+            response_time_metrics.record(
+                "time_to_parameters", time.perf_counter() - start
+            )
+            yield interface_update(state, history)
+        if parser.reply != history[-1][1]:
+            if not history[-1][1]:
+                response_time_metrics.record(
+                    "time_to_first_token", time.perf_counter() - start
+                )
+            history[-1][1] = parser.reply
+            yield interface_update(state, history)
+
+    if not applied or not parser.reply:
+        parser.finish()
+        if not applied:
+            apply_structured_parameters(state, parser.parameters)
+        history[-1][1] = parser.reply
+        yield interface_update(state, history)
 
-def clear_conversation():
-    """Reset the conversation state and clear the interface."""
-    global conversation_state
-    conversation_state.reset()
-    return [], "No search parameters have been specified yet.", "{}"
+
+def chat_with_travel_assistant(
+    user_message: str, history: List[List[str]], request: gr.Request = None
+):
+    """
+    Process the user message, update the chat history, and extract parameters.
+    Yields the interface updates: the parameters as soon as they are extracted,
+    then the reply while it streams in.
+    """
+    with (
+        queue_monitor.track("chat", request),
+        session_locks.hold(session_id(request)),
+    ):
+        start = time.perf_counter()
+        state = session_store.get(session_id(request))
+
+        if not user_message.strip():
+            yield interface_update(state, history)
+            return
+
+        # Initialize conversation with system message if this is the first message
+        if not state.message_history:
+            state.message_history.append(get_system_message())
+
+        # Add user message to history, and an empty reply to stream into
+        turn_start = len(state.message_history)
+        state.message_history.append({"role": "user", "content": user_message})
+        history.append([user_message, ""])
+        state.turn_changes = {}
+
+        try:
+            if TURN_MODE == "single":
+                yield from single_call_turn(state, history, start)
+            elif TURN_MODE == "speculative":
+                yield from speculative_turn(state, history, start)
+            else:
+                yield from two_call_turn(state, history, start)
+        except SchedulerBusy as e:
+            # Drop the unanswered turn, so sending the message again doesn't repeat it
+            del state.message_history[turn_start:]
+            raise gr.Error(
+                "The travel assistant is very busy right now, please send your message"
+                " again in a moment."
+            ) from e
+
+        state.message_history.append(
+            {
+                "role": "assistant",
+                "content": history[-1][1],
+            }
+        )
+
+        try:
+            session_store.save(session_id(request), state)
+        except ConcurrentUpdateError as e:
+            raise gr.Error(
+                "This conversation was changed by another request, please send your"
+                " message again."
+            ) from e
+
+        if state.turn_changes:
+            parameter_events.publish(session_id(request), state.turn_changes)
+
+
+def clear_conversation(request: gr.Request = None):
+    """Reset the conversation state of the session and clear the interface."""
+    with session_locks.hold(session_id(request)):
+        session_store.remove(session_id(request))
+    return [], NO_PARAMETERS_TEXT, "{}", []
+
+
+def end_session(request: gr.Request):
+    """
+    Drop the conversation state in memory when the browser tab is closed. A stored
+    conversation stays until it's idle for SESSION_IDLE_TTL seconds.
+    """
+    session_store.unload(session_id(request))
 
 
 # Example prompts for the user to start with
@@ -383,35 +1730,69 @@ with gr.Blocks(title="Travel Assistant") as demo:
             extracted_params_output = gr.Textbox(
                 label="",
                 lines=10,
-                value="No search parameters have been specified yet.",
+                value=NO_PARAMETERS_TEXT,
                 interactive=False,
             )
 
             gr.Markdown("### Parameters (JSON)")
             json_output = gr.JSON(value="{}")
 
+            gr.Markdown("### Offers")
+            offers_output = gr.Dataframe(
+                headers=OFFER_COLUMNS,
+                value=[],
+                interactive=False,
+                wrap=True,
+            )
+
     # Set up event handlers
     submit_button.click(
         fn=chat_with_travel_assistant,
         inputs=[user_input, chatbot],
-        outputs=[user_input, chatbot, extracted_params_output, json_output],
-        queue=True,
+        outputs=[
+            user_input,
+            chatbot,
+            extracted_params_output,
+            json_output,
+            offers_output,
+        ],
+        concurrency_limit=CHAT_CONCURRENCY,
+        concurrency_id="chat",
     )
 
     user_input.submit(
         fn=chat_with_travel_assistant,
         inputs=[user_input, chatbot],
-        outputs=[user_input, chatbot, extracted_params_output, json_output],
-        queue=True,
+        outputs=[
+            user_input,
+            chatbot,
+            extracted_params_output,
+            json_output,
+            offers_output,
+        ],
+        concurrency_limit=CHAT_CONCURRENCY,
+        concurrency_id="chat",
     )
 
     clear_button.click(
         fn=clear_conversation,
         inputs=[],
-        outputs=[chatbot, extracted_params_output, json_output],
+        outputs=[chatbot, extracted_params_output, json_output, offers_output],
         queue=False,
     )
 
+    demo.unload(end_session)
+
+demo.queue(max_size=QUEUE_MAX_SIZE or None)
+
 # Launch the app
 if __name__ == "__main__":
-    demo.launch()
+    if os.getenv("CLIENT_PREWARM", "true").lower() == "true":
+        client_factory.prewarm()
+    offer_catalog.prewarm()
+    if interval := float(os.getenv("QUEUE_METRICS_INTERVAL", "0")):
+        queue_monitor.report(interval)
+    # Gradio runs at most `max_threads` events at once, 40 by default
+    demo.launch(
+        max_threads=max(40, CHAT_CONCURRENCY), app_kwargs=queue_monitor.app_kwargs()
+    )
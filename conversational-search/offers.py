@@ -0,0 +1,652 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "numpy",
+#     "pandas",
+#     "pyarrow",
+# ]
+# ///
+
+"""
+Search a catalog of travel offers with the parameters extracted from the
+conversation. The catalog is held in memory as numpy columns, sorted by departure
+date, with an index of row ids per destination, trip type, duration and party size.
+
+  generate  Write a synthetic catalog to a CSV or Parquet file.
+  bench     Load a catalog, or generate one in memory, and time random searches,
+            and conversations through the search cache.
+
+Usage: uv run offers.py generate offers.parquet [--rows 2000000] [--seed 42]
+       uv run offers.py bench [offers.parquet] [--rows 2000000] [--queries 2000]
+                                 [--conversations 500]
+"""
+
+import argparse
+import random
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+TRIP_TYPES = ["sun", "wintersport", "cruise"]
+
+# Offers departing this many days around the requested date are included, and
+# offers this many days shorter or longer than the requested duration
+DATE_FLEX_DAYS = 3
+DURATION_FLEX_DAYS = 1
+
+# Searches without a date that match more offers than this scan the offers from
+# the best rated and cheapest down, in chunks of this size, instead of ranking all
+SCAN_THRESHOLD = 50_000
+SCAN_CHUNK = 4096
+
+# Searches that match up to this many offers keep their matches in the cache, to
+# refine them when a parameter is added
+MATCHES_MAX_ROWS = 50_000
+
+# Destinations of the synthetic catalog per trip type, most popular first
+DESTINATIONS = {
+    "sun": "ES GR TR IT PT EG CY HR FR MT MA TN AE TH MX CW AW BG CV ID".split(),
+    "wintersport": "AT FR CH IT AD DE NO SE SI PL CA US".split(),
+    "cruise": "IT GR ES HR NO NL DE MT US BS".split(),
+}
+DURATIONS = [3, 4, 5, 7, 8, 10, 11, 14, 21]
+DURATION_WEIGHTS = [4, 5, 6, 30, 14, 10, 6, 20, 5]
+HOTEL_PREFIXES = "Hotel Resort Apartments Villa Residence Lodge Chalet Club".split()
+HOTEL_NAMES = """Azul Bella Vista Sol Mar Alpina Panorama Royal Paradiso Olympia
+    Aurora Costa Marina Edelweiss Horizon Laguna Bellevue Atlantis Serena""".split()
+
+COLUMNS = {
+    "offer_id": np.int64,
+    "hotel": "category",
+    "destination": "category",
+    "trip_type": "category",
+    "departure_date": str,
+    "duration": np.int16,
+    "max_persons": np.int8,
+    "price": np.float32,
+    "rating": np.float32,
+}
+
+
+def generate_catalog(rows: int, seed: int = 42, start: date | None = None):
+    """
+    Generate a catalog of offers departing in the year after `start`: hotels with
+    a destination, trip type, price level and rating, each with offers on many
+    departure dates and durations.
+    """
+    rng = np.random.default_rng(seed)
+    start = start or date.today()
+    hotels = max(rows // 200, 1)
+
+    # Hotels, spread over the trip types and their most popular destinations first
+    hotel_trip_type = rng.choice(3, size=hotels, p=[0.6, 0.25, 0.15])
+    hotel_destination = np.empty(hotels, dtype=object)
+    for code, trip_type in enumerate(TRIP_TYPES):
+        destinations = DESTINATIONS[trip_type]
+        weights = 1 / np.arange(1, len(destinations) + 1)
+        selected = hotel_trip_type == code
+        hotel_destination[selected] = rng.choice(
+            destinations, size=selected.sum(), p=weights / weights.sum()
+        )
+    hotel_names = np.array(
+        [
+            f"{random.Random(seed + i).choice(HOTEL_PREFIXES)}"
+            f" {random.Random(seed - i).choice(HOTEL_NAMES)} {i}"
+            for i in range(hotels)
+        ],
+        dtype=object,
+    )
+    hotel_price = rng.uniform(40, 180, size=hotels).astype(np.float32)
+    hotel_rating = np.round(rng.uniform(6.0, 9.8, size=hotels), 1).astype(np.float32)
+    hotel_persons = rng.choice([2, 3, 4, 4, 5, 6, 8], size=hotels)
+
+    # Offers, with ski trips in the winter months only
+    hotel = rng.integers(0, hotels, size=rows)
+    day = rng.integers(0, 365, size=rows)
+    departure = np.datetime64(start) + day
+    month = departure.astype("datetime64[M]").astype(int) % 12 + 1
+    off_season = (hotel_trip_type[hotel] == 1) & (month > 3) & (month < 12)
+    departure[off_season] -= ((month[off_season] - 1) * 30).astype("timedelta64[D]")
+    duration = rng.choice(DURATIONS, size=rows, p=np.divide(DURATION_WEIGHTS, 100))
+    season = np.where(np.isin(month, [7, 8, 12]), 1.3, 1.0)
+
+    return pd.DataFrame(
+        {
+            "offer_id": np.arange(1, rows + 1),
+            "hotel": pd.Categorical.from_codes(hotel, hotel_names),
+            "destination": hotel_destination[hotel],
+            "trip_type": pd.Categorical.from_codes(hotel_trip_type[hotel], TRIP_TYPES),
+            "departure_date": departure,
+            "duration": duration.astype(np.int16),
+            "max_persons": hotel_persons[hotel].astype(np.int8),
+            "price": np.round(hotel_price[hotel] * duration * season),
+            "rating": hotel_rating[hotel],
+        }
+    )
+
+
+def read_catalog(path: str):
+    """Read a catalog from a CSV or Parquet file with the columns of COLUMNS."""
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path, dtype=COLUMNS)
+
+
+class PostingIndex:
+    """
+    Row ids per value of a column. The rows are sorted by departure date, so every
+    list of row ids is sorted by departure date too, and a date range of a list is
+    found with a binary search instead of a scan.
+    """
+
+    def __init__(self, codes: np.ndarray, values: int):
+        self.rows = np.argsort(codes, kind="stable").astype(np.int32)
+        self.offsets = np.searchsorted(codes[self.rows], np.arange(values + 1))
+
+    def ranges(self, codes, first_row: int, last_row: int) -> List[np.ndarray]:
+        """Return the row ids of the given values within a range of rows."""
+        # Keys of the same type as the row ids, searching with a Python int would
+        # copy the whole list to int64 first
+        first_row, last_row = np.int32(first_row), np.int32(last_row)
+        ranges = []
+        for code in codes:
+            rows = self.rows[self.offsets[code] : self.offsets[code + 1]]
+            ranges.append(
+                rows[np.searchsorted(rows, first_row) : np.searchsorted(rows, last_row)]
+            )
+        return ranges
+
+
+class OfferSearch:
+    """
+    Find and rank the offers that match the extracted travel parameters. A search
+    starts from the smallest list of row ids among the given parameters, within
+    the rows of the departure date range, and filters those on the other
+    parameters. Matches are ranked by how close they are to the requested date
+    and duration, by rating and by price.
+    """
+
+    def __init__(self, catalog):
+        catalog = catalog.sort_values("departure_date", kind="stable")
+        categories = {}
+        for column in ("hotel", "destination", "trip_type"):
+            values = pd.Categorical(catalog[column])
+            categories[column] = values
+        self.hotels = categories["hotel"].categories.to_numpy()
+        self.destinations = categories["destination"].categories.to_numpy()
+        self.trip_types = categories["trip_type"].categories.to_numpy()
+
+        self.offer_id = catalog["offer_id"].to_numpy(np.int64)
+        self.hotel = categories["hotel"].codes.astype(np.int32)
+        self.destination = categories["destination"].codes.astype(np.int16)
+        self.trip_type = categories["trip_type"].codes.astype(np.int8)
+        self.departure = (
+            pd.to_datetime(catalog["departure_date"])
+            .to_numpy()
+            .astype("datetime64[D]")
+            .astype(np.int32)
+        )
+        self.duration = catalog["duration"].to_numpy(np.int16)
+        self.max_persons = catalog["max_persons"].to_numpy(np.int8)
+        self.price = catalog["price"].to_numpy(np.float32)
+        self.rating = catalog["rating"].to_numpy(np.float32)
+        # The part of the ranking that doesn't depend on the search
+        self.quality = self.rating / 10 - self.price / 10000
+        self.by_quality = np.argsort(-self.quality, kind="stable").astype(np.int32)
+
+        self.destination_index = PostingIndex(self.destination, len(self.destinations))
+        self.trip_type_index = PostingIndex(self.trip_type, len(self.trip_types))
+        self.duration_index = PostingIndex(self.duration, int(self.duration.max()) + 1)
+        self.persons_index = PostingIndex(
+            self.max_persons, int(self.max_persons.max()) + 1
+        )
+
+    def __len__(self) -> int:
+        return len(self.offer_id)
+
+    def nbytes(self) -> int:
+        """Return the memory size of the columns and indexes in bytes."""
+        arrays = [
+            value for value in vars(self).values() if isinstance(value, np.ndarray)
+        ]
+        for index in vars(self).values():
+            if isinstance(index, PostingIndex):
+                arrays += [index.rows, index.offsets]
+        return sum(array.nbytes for array in arrays)
+
+    def _filter(self, rows: np.ndarray, filters: list) -> np.ndarray:
+        if not filters or not len(rows):
+            return rows
+        matches = np.ones(len(rows), dtype=bool)
+        for _, column, allowed in filters:
+            matches &= allowed[column[rows]]
+        return rows[matches]
+
+    def _score(self, rows: np.ndarray, target_day: int | None, duration: int | None):
+        score = self.quality[rows]
+        if target_day is not None:
+            score = score - np.abs(self.departure[rows] - target_day) * 0.1
+        if duration:
+            score = score - np.abs(self.duration[rows] - duration) * 0.1
+        return score
+
+    def _rank(
+        self,
+        rows: np.ndarray,
+        target_day: int | None,
+        duration: int | None,
+        limit: int,
+    ) -> np.ndarray:
+        """Return the best `limit` rows, closest date and duration, then quality first."""
+        score = self._score(rows, target_day, duration)
+        if len(rows) > limit:
+            best = -score <= np.partition(-score, limit - 1)[limit - 1]
+            rows, score = rows[best], score[best]
+        # Ties go to the earliest departure, whatever order the rows came in
+        return rows[np.lexsort((rows, -score))[:limit]]
+
+    def _scan_by_quality(
+        self,
+        filters: list,
+        first_row: int,
+        last_row: int,
+        duration: int | None,
+        limit: int,
+        budget: int,
+    ) -> np.ndarray | None:
+        """
+        Rank a search that matches many offers by scanning the offers from the best
+        quality down. A score is never above the quality of its offer, so the scan
+        stops as soon as the best matches so far beat every offer left. Returns None
+        when the parameters match so few offers that the scan would read more than
+        `budget` offers, ranking the rows of the index is faster then.
+        """
+        found = []
+        for start in range(0, len(self), SCAN_CHUNK):
+            if start > budget:
+                return None
+            rows = self.by_quality[start : start + SCAN_CHUNK]
+            rows = self._filter(rows[(rows >= first_row) & (rows < last_row)], filters)
+            found.append(rows)
+            if sum(len(rows) for rows in found) < limit:
+                continue
+
+            best = self._rank(np.concatenate(found), None, duration, limit)
+            found = [best]
+            remaining = self.by_quality[start + SCAN_CHUNK : start + SCAN_CHUNK + 1]
+            if not len(remaining) or (
+                self._score(best[-1:], None, duration)[0] > self.quality[remaining[0]]
+            ):
+                return best
+        return self._rank(np.concatenate(found), None, duration, limit)
+
+    def search(self, parameters: Dict[str, Any], limit: int = 10) -> List[Dict]:
+        """Return the best offers for the parameters of the extraction tool."""
+        rows, _ = self.find(parameters, limit)
+        return self.offers(rows, parameters)
+
+    def find(
+        self,
+        parameters: Dict[str, Any],
+        limit: int = 10,
+        within: np.ndarray | None = None,
+    ) -> tuple:
+        """
+        Return the row ids of the best offers, and the row ids of all the offers
+        that match, or None when more than MATCHES_MAX_ROWS match. With `within`,
+        only those rows are searched, the matches of a search that had all but one
+        of the parameters, which refines that search instead of starting over.
+        """
+        nothing = np.empty(0, dtype=np.int32)
+        if not parameters:
+            return nothing, nothing
+
+        # Departure date range, from today onwards when no date was given
+        today = int(np.datetime64(date.today(), "D").astype(np.int32))
+        target_day = None
+        first_day, last_day = today, int(self.departure[-1]) + 1 if len(self) else today
+        if parameters.get("departure_date"):
+            try:
+                target_day = (
+                    date.fromisoformat(parameters["departure_date"]) - date(1970, 1, 1)
+                ).days
+                first_day = max(target_day - DATE_FLEX_DAYS, today)
+                last_day = target_day + DATE_FLEX_DAYS + 1
+            except ValueError:
+                pass
+        first_row, last_row = np.searchsorted(
+            self.departure, np.array([first_day, last_day], dtype=np.int32)
+        )
+        if first_row >= last_row:
+            return nothing, nothing
+
+        # Allowed codes of every given parameter
+        filters = []
+        destinations = parameters.get("destination") or []
+        if isinstance(destinations, str):
+            destinations = [destinations]
+        if destinations:
+            allowed = np.isin(self.destinations, destinations)
+            filters.append((self.destination_index, self.destination, allowed))
+        trip_type = parameters.get("trip_type")
+        if trip_type:
+            allowed = self.trip_types == trip_type
+            filters.append((self.trip_type_index, self.trip_type, allowed))
+        duration = parameters.get("duration")
+        if duration:
+            durations = np.arange(len(self.duration_index.offsets) - 1)
+            allowed = np.abs(durations - duration) <= DURATION_FLEX_DAYS
+            filters.append((self.duration_index, self.duration, allowed))
+        persons = party_size(parameters)
+        if persons:
+            allowed = np.arange(len(self.persons_index.offsets) - 1) >= persons
+            filters.append((self.persons_index, self.max_persons, allowed))
+
+        if within is not None:
+            rows = within[(within >= first_row) & (within < last_row)]
+            matches = self._filter(rows, filters)
+            return self._rank(matches, target_day, duration, limit), matches
+
+        # Start from the rows of the most selective parameter within the date
+        # range, and filter those on the others with a lookup of their codes
+        ranges = [
+            index.ranges(np.flatnonzero(allowed), first_row, last_row)
+            for index, _, allowed in filters
+        ]
+        if filters:
+            smallest = min(
+                range(len(filters)), key=lambda i: sum(len(r) for r in ranges[i])
+            )
+            count = sum(len(r) for r in ranges[smallest])
+        else:
+            count = last_row - first_row
+        if target_day is None and count > SCAN_THRESHOLD:
+            rows = self._scan_by_quality(
+                filters, first_row, last_row, duration, limit, count
+            )
+            if rows is not None:
+                return rows, None
+
+        if filters:
+            rows = np.concatenate(ranges[smallest])
+            del filters[smallest]
+        else:
+            rows = np.arange(first_row, last_row, dtype=np.int32)
+        matches = self._filter(rows, filters)
+        ranked = self._rank(matches, target_day, duration, limit)
+        return ranked, matches if len(matches) <= MATCHES_MAX_ROWS else None
+
+    def offers(self, rows: np.ndarray, parameters: Dict[str, Any]) -> List[Dict]:
+        """Return the offers of the given row ids."""
+        persons = party_size(parameters)
+        return [
+            {
+                "offer_id": int(self.offer_id[row]),
+                "hotel": str(self.hotels[self.hotel[row]]),
+                "destination": str(self.destinations[self.destination[row]]),
+                "trip_type": str(self.trip_types[self.trip_type[row]]),
+                "departure_date": str(np.datetime64(int(self.departure[row]), "D")),
+                "duration": int(self.duration[row]),
+                "max_persons": int(self.max_persons[row]),
+                "price": float(self.price[row]),
+                "total_price": float(self.price[row]) * max(persons, 1),
+                "rating": round(float(self.rating[row]), 1),
+            }
+            for row in rows
+        ]
+
+
+def party_size(parameters: Dict[str, Any]) -> int:
+    participants = parameters.get("participants") or {}
+    return sum(value or 0 for value in participants.values())
+
+
+def fingerprint(parameters: Dict[str, Any]) -> tuple:
+    """
+    Return a key of the parameters that is equal for parameters that search the
+    same: destinations in any order, and participants without empty counts.
+    """
+    destinations = parameters.get("destination") or None
+    if isinstance(destinations, str):
+        destinations = [destinations]
+    participants = parameters.get("participants") or {}
+    return (
+        tuple(sorted(set(destinations))) if destinations else None,
+        parameters.get("departure_date") or None,
+        parameters.get("duration") or None,
+        tuple(sorted((k, v) for k, v in participants.items() if v)) or None,
+        parameters.get("trip_type") or None,
+    )
+
+
+def narrows(previous: tuple, current: tuple) -> bool:
+    """
+    Return whether the parameters of `current` only differ from `previous` in one
+    parameter that was added, or in more participants, so every match of current
+    is a match of previous.
+    """
+    changed = [i for i in range(len(current)) if previous[i] != current[i]]
+    if len(changed) != 1:
+        return False
+    i = changed[0]
+    if previous[i] is None:
+        return True
+    if current[i] is None:
+        # A dropped parameter widens the search
+        return False
+    # More participants need offers for a larger party
+    return i == 3 and sum(v for _, v in current[i]) >= sum(v for _, v in previous[i])
+
+
+class SearchCache:
+    """
+    Keep the results of recent searches by the fingerprint of their parameters, in
+    least recently used order, up to `max_entries` searches. The matches of a
+    search are kept as well, up to `max_rows` row ids in total, so a search that
+    adds one parameter to a cached one only filters its matches.
+    """
+
+    def __init__(self, max_entries: int, max_rows: int):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.rows = 0
+        self.hits = 0
+        self.refinements = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def search(
+        self,
+        engine: OfferSearch,
+        parameters: Dict[str, Any],
+        previous: Dict[str, Any] | None = None,
+        limit: int = 10,
+    ) -> tuple:
+        """
+        Return the best offers for the parameters, and whether they were a cached
+        "hit", a "refinement" of the cached search of the `previous` parameters or
+        a new "search".
+        """
+        # Searches start from today, so yesterday's results are not reused
+        key = (date.today(), limit, fingerprint(parameters))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], "hit"
+            base = None
+            if previous is not None:
+                previous_key = (key[0], limit, fingerprint(previous))
+                base = self._entries.get(previous_key)
+                if base is not None and (
+                    base[1] is None or not narrows(previous_key[2], key[2])
+                ):
+                    base = None
+
+        if base is not None:
+            rows, matches = engine.find(parameters, limit, within=base[1])
+            outcome = "refinement"
+        else:
+            rows, matches = engine.find(parameters, limit)
+            outcome = "search"
+        offers = engine.offers(rows, parameters)
+
+        with self._lock:
+            if outcome == "refinement":
+                self.refinements += 1
+            else:
+                self.misses += 1
+            if key not in self._entries:
+                self._entries[key] = (offers, matches)
+                self.rows += len(matches) if matches is not None else 0
+                self._evict()
+        return offers, outcome
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries or self.rows > self.max_rows:
+            _, (_, matches) = self._entries.popitem(last=False)
+            self.rows -= len(matches) if matches is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            searches = self.hits + self.refinements + self.misses
+            return {
+                "entries": len(self._entries),
+                "rows": self.rows,
+                "hit_rate": self.hits / searches if searches else 0.0,
+                "refinement_rate": self.refinements / searches if searches else 0.0,
+            }
+
+
+def random_query(rng: random.Random) -> Dict[str, Any]:
+    """Return parameters like a conversation extracts them, some left out."""
+    trip_type = rng.choice(TRIP_TYPES)
+    parameters = {}
+    if rng.random() < 0.8:
+        parameters["destination"] = rng.sample(
+            DESTINATIONS[trip_type], rng.choice([1, 1, 1, 2])
+        )
+    if rng.random() < 0.6:
+        departure = date.today() + timedelta(days=rng.randrange(7, 330))
+        parameters["departure_date"] = departure.isoformat()
+    if rng.random() < 0.7:
+        parameters["duration"] = rng.choice(DURATIONS)
+    if rng.random() < 0.7:
+        parameters["participants"] = {
+            "adults": rng.choice([1, 2, 2, 2, 4]),
+            "children": rng.choice([0, 0, 1, 2]),
+        }
+    if rng.random() < 0.5 or not parameters:
+        parameters["trip_type"] = trip_type
+    return parameters
+
+
+def bench(args):
+    start = time.perf_counter()
+    if args.catalog:
+        catalog = read_catalog(args.catalog)
+    else:
+        catalog = generate_catalog(args.rows, args.seed)
+    read_s = time.perf_counter() - start
+    engine = OfferSearch(catalog)
+    del catalog
+    index_s = time.perf_counter() - start - read_s
+    print(
+        f"Loaded {len(engine):,} offers in {read_s:.1f}s, indexed in {index_s:.1f}s,"
+        f" {engine.nbytes() / 1024 / 1024:.0f} MB"
+    )
+
+    rng = random.Random(args.seed)
+    latencies, results = [], []
+    for _ in range(args.queries):
+        parameters = random_query(rng)
+        start = time.perf_counter()
+        results.append(len(engine.search(parameters)))
+        latencies.append(time.perf_counter() - start)
+
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{args.queries} searches: p50 {quantiles[49] * 1000:.2f} ms,"
+        f" p95 {quantiles[94] * 1000:.2f} ms, p99 {quantiles[98] * 1000:.2f} ms,"
+        f" max {max(latencies) * 1000:.2f} ms,"
+        f" {sum(results) / len(results):.1f} results per search"
+    )
+
+    # Conversations that add a parameter per turn, some of them popular searches
+    # that other conversations made before
+    cache = SearchCache(max_entries=1000, max_rows=2_000_000)
+    popular = [random_query(rng) for _ in range(20)]
+    timings = {"search": [], "hit": [], "refinement": []}
+    direct, different = [], 0
+    for _ in range(args.conversations):
+        query = rng.choice(popular) if rng.random() < 0.3 else random_query(rng)
+        order = list(query)
+        rng.shuffle(order)
+        previous = None
+        for turn in range(1, len(order) + 1):
+            parameters = {key: query[key] for key in order[:turn]}
+            start = time.perf_counter()
+            offers, outcome = cache.search(engine, parameters, previous)
+            timings[outcome].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            expected = engine.search(parameters)
+            direct.append(time.perf_counter() - start)
+            different += [o["offer_id"] for o in offers] != [
+                o["offer_id"] for o in expected
+            ]
+            previous = parameters
+
+    cached = [t for outcome in timings.values() for t in outcome]
+    print(
+        f"{len(cached)} conversation turns: p50 {statistics.median(cached) * 1000:.2f} ms"
+        f" with the cache, {statistics.median(direct) * 1000:.2f} ms without,"
+        f" hit rate {cache.stats()['hit_rate']:.0%},"
+        f" refinement rate {cache.stats()['refinement_rate']:.0%},"
+        f" {different} different results"
+    )
+    for outcome, latencies in timings.items():
+        if len(latencies) > 1:
+            print(
+                f"  {outcome:<10} p50 {statistics.median(latencies) * 1000:.2f} ms,"
+                f" mean {statistics.mean(latencies) * 1000:.2f} ms"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate = commands.add_parser("generate", help="write a synthetic catalog")
+    generate.add_argument("output", help="CSV or Parquet file")
+    generate.add_argument("--rows", type=int, default=2_000_000)
+    generate.add_argument("--seed", type=int, default=42)
+
+    benchmark = commands.add_parser("bench", help="time random searches")
+    benchmark.add_argument("catalog", nargs="?", help="CSV or Parquet file")
+    benchmark.add_argument("--rows", type=int, default=2_000_000)
+    benchmark.add_argument("--seed", type=int, default=42)
+    benchmark.add_argument("--queries", type=int, default=2000)
+    benchmark.add_argument("--conversations", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        catalog = generate_catalog(args.rows, args.seed)
+        if args.output.endswith(".parquet"):
+            catalog.to_parquet(args.output, index=False)
+        else:
+            catalog.to_csv(args.output, index=False)
+        print(f"Wrote {len(catalog):,} offers to {args.output}")
+    else:
+        bench(args)
+
+
+if __name__ == "__main__":
+    main()
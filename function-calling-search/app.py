@@ -3,50 +3,254 @@
 # dependencies = [
 #     "gradio",
 #     "azure-identity",
+#     "httpx",
 #     "openai",
 #     "python-dotenv",
 #     "requests",
+#     "tiktoken",
 # ]
 # ///
 
+import asyncio
+import hashlib
 import json
+import logging
 import os
-from datetime import datetime
-from typing import Any, Dict
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import Any, Dict, List
 
 import gradio as gr
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+import httpx
+import tiktoken
+from azure.identity import DefaultAzureCredential
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import APIConnectionError, AsyncAzureOpenAI, DefaultAsyncHttpxClient
 
+# The modules shared by the demos are in the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.destinations import destination_index  # noqa: E402
+from shared.queueing import QueueMonitor  # noqa: E402
+from shared.scheduling import (  # noqa: E402
+    AsyncRequestScheduler,
+    Deployment,
+    SchedulerBusy,
+)
+
+logger = logging.getLogger(__name__)
 load_dotenv(override=True)
 
-token_provider = get_bearer_token_provider(
-    DefaultAzureCredential(), "https://cognitiveservices.azure.com/.default"
+TOKEN_SCOPE = "https://cognitiveservices.azure.com/.default"
+# Seconds before expiry at which the background refresh fetches a new token. A
+# request only waits for a token when less than half of this margin is left.
+TOKEN_REFRESH_MARGIN = 600
+
+
+class ClientFactory:
+    """
+    Build the Azure OpenAI clients and credential on first use instead of at import,
+    one client per deployment endpoint. With prewarm, a background thread builds
+    them at startup, fetches the Entra token and refreshes it before it expires, so
+    the first request doesn't wait for any of it. The connections of the async
+    clients belong to the event loop of the app, so the lifespan of the app opens
+    them once the server starts.
+    """
+
+    def __init__(self, keepalive_expiry: float, deployments: List["Deployment"]):
+        self.keepalive_expiry = keepalive_expiry
+        self.deployments = deployments
+        self.ready = threading.Event()
+        self._clients = {}
+        self._credential = None
+        self._access_token = None
+        self._client_lock = threading.Lock()
+        self._token_lock = threading.Lock()
+
+    @property
+    def uses_identity(self) -> bool:
+        return any(not deployment.api_key for deployment in self.deployments)
+
+    def get(self, deployment: "Deployment | None" = None) -> AsyncAzureOpenAI:
+        deployment = deployment or self.deployments[0]
+        key = (deployment.endpoint, deployment.api_key)
+        if (client := self._clients.get(key)) is None:
+            with self._client_lock:
+                if (client := self._clients.get(key)) is None:
+                    client = self._clients[key] = self._build(deployment)
+        return client
+
+    def _build(self, deployment: "Deployment") -> AsyncAzureOpenAI:
+        options = {
+            "api_version": "2025-02-01-preview",
+            "azure_endpoint": deployment.endpoint,
+            # The scheduler retries rate limited requests
+            "max_retries": 0,
+            # Keep idle connections open longer than the 5 seconds default of httpx,
+            # so the connection opened on page load is still there for the first search
+            "http_client": DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=1000,
+                    max_keepalive_connections=100,
+                    keepalive_expiry=self.keepalive_expiry,
+                )
+            ),
+        }
+
+        # Initialize Azure OpenAI client with key or identity based auth
+        if not deployment.api_key:
+            return AsyncAzureOpenAI(azure_ad_token_provider=self.token, **options)
+        return AsyncAzureOpenAI(api_key=deployment.api_key, **options)
+
+    def _token_expires_within(self, seconds: float) -> bool:
+        return (
+            self._access_token is None
+            or self._access_token.expires_on - time.time() < seconds
+        )
+
+    def _fetch_token(self):
+        if self._credential is None:
+            self._credential = DefaultAzureCredential()
+        self._access_token = self._credential.get_token(TOKEN_SCOPE)
+
+    def _refresh_token(self):
+        with self._token_lock:
+            if self._token_expires_within(TOKEN_REFRESH_MARGIN / 2):
+                self._fetch_token()
+
+    async def token(self) -> str:
+        """Return the cached Entra token, fetched again when it's about to expire."""
+        if self._token_expires_within(TOKEN_REFRESH_MARGIN / 2):
+            # The credential blocks on its requests, so it runs off the event loop
+            await asyncio.to_thread(self._refresh_token)
+        return self._access_token.token
+
+    def prewarm(self):
+        threading.Thread(target=self._keep_warm, daemon=True).start()
+
+    def _keep_warm(self):
+        try:
+            for deployment in self.deployments:
+                self.get(deployment)
+            if self.uses_identity:
+                self._refresh_token()
+        except Exception as e:
+            logger.warning(f"Prewarming the Azure OpenAI client failed: {e}")
+        self.ready.set()
+
+        while self.uses_identity:
+            delay = 60.0
+            if not self._token_expires_within(TOKEN_REFRESH_MARGIN + delay):
+                delay = (
+                    self._access_token.expires_on - time.time() - TOKEN_REFRESH_MARGIN
+                )
+            time.sleep(delay)
+            try:
+                with self._token_lock:
+                    self._fetch_token()
+            except Exception as e:
+                logger.warning(f"Refreshing the Entra token failed: {e}")
+
+    @asynccontextmanager
+    async def lifespan(self, app):
+        # Opened in the background, the server doesn't wait for the connections
+        task = asyncio.create_task(self.connect())
+        yield
+        task.cancel()
+
+    async def connect(self):
+        # Any request opens the connection, the response itself isn't needed
+        for deployment in self.deployments:
+            try:
+                await self.get(deployment).models.list()
+            except Exception as e:
+                logger.warning(f"Opening a connection to {deployment} failed: {e}")
+
+
+# Completion tokens counted against the tokens per minute before the response is in
+EXPECTED_COMPLETION_TOKENS = 200
+
+
+def env_list(name: str, default: str = "") -> List[str]:
+    """Split a comma separated environment variable."""
+    return [value.strip() for value in os.getenv(name, default).split(",")]
+
+
+def read_deployments() -> List[Deployment]:
+    """
+    Read the deployments of the pool from comma separated environment variables.
+    A variable with a single value applies to every deployment, so several
+    deployments on one endpoint, or one deployment name in several regions, only
+    need the values that differ.
+    """
+    values = {
+        "AZURE_OPENAI_ENDPOINT": env_list("AZURE_OPENAI_ENDPOINT"),
+        "AZURE_OPENAI_API_KEY": env_list("AZURE_OPENAI_API_KEY"),
+        "AZURE_OPENAI_DEPLOYMENT": env_list(
+            "AZURE_OPENAI_DEPLOYMENT", os.getenv("AZURE_OPENAI_MODEL", "gpt-4o-mini")
+        ),
+        "AZURE_OPENAI_RPM": env_list("AZURE_OPENAI_RPM", "0"),
+        "AZURE_OPENAI_TPM": env_list("AZURE_OPENAI_TPM", "0"),
+    }
+    count = max(len(value) for value in values.values())
+    for name, value in values.items():
+        if len(value) not in (1, count):
+            raise ValueError(f"{name} has {len(value)} values, expected 1 or {count}")
+        values[name] = value * count if len(value) == 1 else value
+
+    cooldown = float(os.getenv("DEPLOYMENT_COOLDOWN", "30"))
+    return [
+        Deployment(endpoint, api_key or None, name, int(rpm), int(tpm), cooldown)
+        for endpoint, api_key, name, rpm, tpm in zip(*values.values())
+    ]
+
+
+deployments = read_deployments()
+client_factory = ClientFactory(
+    float(os.getenv("CLIENT_KEEPALIVE_EXPIRY", "120")), deployments
 )
+CLIENT_PREWARM = os.getenv("CLIENT_PREWARM", "true").lower() == "true"
 
-# Initialize Azure OpenAI client with key or identity based auth
-if api_key := os.getenv("AZURE_OPENAI_API_KEY"):
-    client = AzureOpenAI(
-        azure_ad_token_provider=token_provider,
-        api_version="2025-02-01-preview",
-        api_key=api_key,
-    )
-else:
-    client = AzureOpenAI(
-        azure_ad_token_provider=token_provider,
-        api_version="2025-02-01-preview",
-        azure_endpoint=os.environ.get("AZURE_OPENAI_ENDPOINT"),
+scheduler = AsyncRequestScheduler(
+    deployments,
+    max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", "64")),
+    max_wait=float(os.getenv("SCHEDULER_MAX_WAIT", "20")),
+    max_retries=int(os.getenv("SCHEDULER_MAX_RETRIES", "4")),
+    transport_errors=(APIConnectionError,),
+)
+
+
+async def create_completion(request: Dict[str, Any], priority: int | None = None):
+    """
+    Create a chat completion on a deployment of the pool. The tokens per minute are
+    charged an estimate up front, corrected to the usage of the response.
+    """
+    tokens = len(json.dumps(request["messages"])) // 4 + request.get(
+        "max_tokens", EXPECTED_COMPLETION_TOKENS
     )
 
+    async def call(deployment: Deployment):
+        response = await client_factory.get(deployment).chat.completions.create(
+            **{**request, "model": deployment.name}
+        )
+        if response.usage:
+            await scheduler.settle(deployment, tokens, response.usage.total_tokens)
+        return response
+
+    return await scheduler.run(call, tokens, priority)
 
-# Define system message with instructions and current date/time
+
+# Define system message with instructions. It holds no volatile context, so every
+# request starts with the same prefix and can hit the provider's prompt cache
 def get_system_message():
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     return {
         "role": "system",
-        "content": f"""You are a helpful travel assistant for a travel agency, a travel booking service.
-            Current date and time: {current_time}
+        "content": """You are a helpful travel assistant for a travel agency, a travel booking service.
 
             INSTRUCTIONS:
             - Help users find travel options based on their requirements
@@ -60,6 +264,14 @@ def get_system_message():
     }
 
 
+# Define the current date context, added late in the prompt
+def get_date_context_message():
+    return {
+        "role": "system",
+        "content": f"Current date: {datetime.now().strftime('%A %Y-%m-%d')}",
+    }
+
+
 # Define the travel search parameters extraction function
 travel_search_function = {
     "type": "function",
@@ -111,9 +323,6 @@ travel_search_function = {
     },
 }
 
-# Message history to maintain conversation context
-message_history = []
-
 
 def format_extracted_parameters(parameters: Dict[str, Any]) -> str:
     """Format the extracted parameters into a readable string."""
@@ -160,9 +369,523 @@ def format_extracted_parameters(parameters: Dict[str, Any]) -> str:
     return "\n".join(parts)
 
 
-def process_search_query(query: str) -> tuple:
-    """Process the search query using Azure OpenAI function calling."""
-    global message_history
+# Keep the history sent to the model within a token budget
+class HistoryManager:
+    """
+    Compact the message history of a conversation to a token budget.
+
+    The system message is always kept. Older turns are dropped once the budget is
+    exceeded and replaced by one synthetic system message carrying the latest merged
+    search parameters, so the model keeps the extracted context without the full
+    transcript. Token counts of every prompt are recorded for monitoring.
+
+    The encoding is loaded on first use, tiktoken downloads it the first time. When
+    it can't be loaded, tokens are estimated from the number of characters.
+    """
+
+    def __init__(self, token_budget: int, encoding: str = "o200k_base"):
+        self.token_budget = token_budget
+        self.encoding_name = encoding
+        self.prompt_tokens = deque(maxlen=1000)
+        self._encoding = None
+        self._encoding_loaded = False
+        self._encoding_lock = threading.Lock()
+
+    def count_text_tokens(self, text: str) -> int:
+        if not self._encoding_loaded:
+            with self._encoding_lock:
+                if not self._encoding_loaded:
+                    try:
+                        self._encoding = tiktoken.get_encoding(self.encoding_name)
+                    except Exception as e:
+                        logger.warning(
+                            f"Loading the {self.encoding_name} encoding failed,"
+                            f" estimating tokens instead: {e}"
+                        )
+                    self._encoding_loaded = True
+        if self._encoding is None:
+            # About four characters per token in English text
+            return -(-len(text) // 4)
+        return len(self._encoding.encode(text))
+
+    def count_message_tokens(self, message: Dict[str, Any]) -> int:
+        """Count the tokens of a single message, including tool call arguments."""
+        tokens = 3  # Every message is wrapped in role and separator tokens
+        if message.get("content"):
+            tokens += self.count_text_tokens(message["content"])
+        for tool_call in message.get("tool_calls") or []:
+            tokens += self.count_text_tokens(tool_call["function"]["name"])
+            tokens += self.count_text_tokens(tool_call["function"]["arguments"])
+        return tokens
+
+    def count_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """Count the prompt tokens of a list of messages."""
+        # Every reply is primed with the assistant role
+        return 3 + sum(self.count_message_tokens(message) for message in messages)
+
+    def record(self, messages: List[Dict[str, Any]]) -> int:
+        """Count and record the prompt tokens of a request about to be sent."""
+        tokens = self.count_tokens(messages)
+        self.prompt_tokens.append(tokens)
+        return tokens
+
+    def percentile(self, percentile: float) -> int:
+        """Return the given percentile of the recorded prompt token counts."""
+        if not self.prompt_tokens:
+            return 0
+        counts = sorted(self.prompt_tokens)
+        return counts[min(len(counts) - 1, int(len(counts) * percentile / 100))]
+
+    def compact(
+        self, message_history: List[Dict[str, Any]], parameters: Dict[str, Any]
+    ) -> None:
+        """Drop the oldest turns from the history in place until it fits the budget."""
+        system_message = message_history[0]
+
+        # A turn starts with a user message and holds the assistant and tool replies
+        turns = []
+        for message in message_history[1:]:
+            if message["role"] == "user":
+                turns.append([message])
+            elif turns:
+                turns[-1].append(message)
+
+        summary_message = {
+            "role": "system",
+            "content": "Search parameters extracted earlier in this conversation: "
+            + json.dumps(parameters),
+        }
+        summary_tokens = self.count_message_tokens(summary_message) if parameters else 0
+        tokens = self.count_tokens([system_message]) + summary_tokens
+
+        # Keep the most recent turns that fit, always keeping the latest one
+        kept_turns = []
+        for turn in reversed(turns):
+            turn_tokens = sum(self.count_message_tokens(message) for message in turn)
+            if kept_turns and tokens + turn_tokens > self.token_budget:
+                break
+            kept_turns.insert(0, turn)
+            tokens += turn_tokens
+
+        # Nothing to do while every turn fits and no summary has been added yet
+        has_summary = len(message_history) > 1 and message_history[1]["role"] != "user"
+        if len(kept_turns) == len(turns) and not has_summary:
+            return
+
+        message_history[:] = [system_message]
+        if parameters:
+            message_history.append(summary_message)
+        for turn in kept_turns:
+            message_history.extend(turn)
+
+
+history_manager = HistoryManager(int(os.getenv("HISTORY_TOKEN_BUDGET", "2000")))
+
+
+# Build chat completion requests that share the longest possible prompt prefix
+class ChatRequestBuilder:
+    """
+    Build chat completion requests for provider-side prompt caching.
+
+    Prompt caching only hits on an identical prompt prefix, so the static system
+    instructions and the tool schema come first on every call, followed by the
+    conversation. Volatile context, the current date, is only added right before
+    the latest user message. Cached token counts of every response are recorded.
+    """
+
+    def __init__(self, tools: List[Dict[str, Any]]):
+        self.tools = tools
+        self.calls = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def build(self, message_history: List[Dict[str, Any]], **options) -> Dict[str, Any]:
+        """Return the keyword arguments for client.chat.completions.create."""
+        last_user_index = max(
+            i for i, message in enumerate(message_history) if message["role"] == "user"
+        )
+        messages = [
+            *message_history[:last_user_index],
+            get_date_context_message(),
+            *message_history[last_user_index:],
+        ]
+        history_manager.record(messages)
+
+        return {
+            "model": os.environ.get("AZURE_OPENAI_MODEL", "gpt-4o-mini"),
+            "messages": messages,
+            "tools": self.tools,
+            **options,
+        }
+
+    def record_usage(self, usage) -> None:
+        """Record the prompt, cached and completion token counts of a response."""
+        if usage is None:
+            return
+        details = usage.prompt_tokens_details
+        cached_tokens = (details.cached_tokens or 0) if details else 0
+
+        self.calls += 1
+        self.cache_hits += cached_tokens > 0
+        self.prompt_tokens += usage.prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.completion_tokens += usage.completion_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "cache_hits": self.cache_hits,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cache_hit_ratio": self.cached_tokens / self.prompt_tokens
+            if self.prompt_tokens
+            else 0.0,
+        }
+
+
+request_builder = ChatRequestBuilder([travel_search_function])
+
+
+# Cache extracted parameters of repeated search queries
+class ExtractionCache:
+    """
+    Exact-match cache of extraction results, keyed on the normalized query, the
+    model, the date and a hash of the tool schema.
+
+    Entries live in memory with LRU eviction and a TTL. When a path is given they
+    are also written to a SQLite database, so the cache survives restarts. The
+    database is read and written in a worker thread, one call at a time, so it
+    doesn't block the event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, path: str | None = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.schema_hash = hashlib.sha256(
+            json.dumps(travel_search_function, sort_keys=True).encode()
+        ).hexdigest()
+
+        self.db = None
+        self._db_lock = threading.Lock()
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS extractions"
+                " (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+            self.db.execute(
+                "DELETE FROM extractions WHERE expires_at < ?", (time.time(),)
+            )
+            self.db.commit()
+
+    def key(self, query: str, model: str) -> str:
+        # Relative dates ("this December") depend on the current date in the prompt
+        normalized_query = " ".join(query.lower().split()).rstrip(".!?")
+        today = datetime.now().strftime("%Y-%m-%d")
+        return hashlib.sha256(
+            json.dumps([normalized_query, model, today, self.schema_hash]).encode()
+        ).hexdigest()
+
+    async def get(self, key: str) -> Dict[str, Any] | None:
+        entry = self.entries.get(key)
+        if entry is None and self.db:
+            row = await asyncio.to_thread(self._read, key)
+            if row:
+                entry = (json.loads(row[0]), row[1])
+                self._store(key, entry)
+
+        if entry is None or entry[1] < time.time():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    async def set(self, key: str, value: Dict[str, Any]) -> None:
+        expires_at = time.time() + self.ttl
+        self._store(key, (value, expires_at))
+        if self.db:
+            await asyncio.to_thread(self._write, key, json.dumps(value), expires_at)
+
+    def _read(self, key: str) -> tuple | None:
+        with self._db_lock:
+            return self.db.execute(
+                "SELECT value, expires_at FROM extractions WHERE key = ?", (key,)
+            ).fetchone()
+
+    def _write(self, key: str, value: str, expires_at: float) -> None:
+        with self._db_lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO extractions VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            self.db.commit()
+
+    def _store(self, key: str, entry: tuple) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+extraction_cache = ExtractionCache(
+    max_entries=int(os.getenv("EXTRACTION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("EXTRACTION_CACHE_TTL", "3600")),
+    path=os.getenv("EXTRACTION_CACHE_PATH"),
+)
+
+
+# Local rule-based extraction for plain, simple queries
+# fmt: off
+# "kind" is Dutch for child, counted with Dutch numbers only
+DUTCH_NUMBER_WORDS = {
+    "een": 1, "één": 1, "twee": 2, "drie": 3, "vier": 4, "vijf": 5,
+    "zes": 6, "zeven": 7, "acht": 8, "negen": 9, "tien": 10,
+}
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    **DUTCH_NUMBER_WORDS,
+}
+
+MONTHS = {
+    "january": 1, "february": 2, "march": 3, "april": 4, "may": 5, "june": 6,
+    "july": 7, "august": 8, "september": 9, "october": 10, "november": 11,
+    "december": 12, "januari": 1, "februari": 2, "maart": 3, "mei": 5, "juni": 6,
+    "juli": 7, "augustus": 8, "oktober": 10,
+}
+
+# fmt: on
+
+TRIP_TYPE_KEYWORDS = {
+    "sun": ["sun", "beach", "zon", "zonvakantie", "strand", "strandvakantie"],
+    "wintersport": ["wintersport", "ski", "skiing", "snowboard", "snowboarding"],
+    "cruise": ["cruise", "cruises"],
+}
+
+_number = r"\b(\d+|" + "|".join(NUMBER_WORDS) + r")"
+_dutch_number = r"\b(\d+|" + "|".join(DUTCH_NUMBER_WORDS) + r")"
+_month = "(" + "|".join(MONTHS) + ")"
+PARTICIPANT_PATTERNS = {
+    "adults": re.compile(_number + r"\s+(?:adults?|volwassenen?)\b"),
+    "children": re.compile(
+        _number
+        + r"\s+(?:child(?:ren)?|kids?|kinderen)\b|"
+        + _dutch_number
+        + r"\s+kind\b"
+    ),
+    "infants": re.compile(_number + r"\s+(?:infants?|bab(?:y|ies|y's))\b"),
+}
+# Words that hint at travellers the patterns above can't count
+UNCOUNTED_PARTICIPANTS_PATTERN = re.compile(
+    r"\b(family|familie|gezin|friends|vrienden|wife|husband|partner|teenagers?|tieners?)\b"
+)
+DURATION_PATTERN = re.compile(
+    _number + r"\s+(days?|dagen|dag|nights?|nachten|weeks?|weken)\b"
+)
+ISO_DATE_PATTERN = re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")
+MONTH_DAY_PATTERN = re.compile(
+    r"\b" + _month + r"\s+(\d{1,2})(?:st|nd|rd|th)?\b(?:,?\s*(\d{4}))?"
+)
+DAY_MONTH_PATTERN = re.compile(
+    r"\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?" + _month + r"\b(?:\s+(\d{4}))?"
+)
+MONTH_PATTERN = re.compile(r"\b" + _month + r"\b")
+TRIP_TYPE_PATTERN = re.compile(
+    r"\b("
+    + "|".join(
+        keyword for keywords in TRIP_TYPE_KEYWORDS.values() for keyword in keywords
+    )
+    + r")\b"
+)
+KNOWN_CAPITALIZED_WORDS = set(MONTHS) | {"i", "i'm", "i'd", "i'll", "ik"}
+
+
+def _parse_number(value: str) -> int:
+    return int(value) if value.isdigit() else NUMBER_WORDS[value]
+
+
+def _next_date(today: date, month: int, day: int, year: str | None) -> date | None:
+    """Return the given month and day, in the given year or the first one not in the past."""
+    try:
+        if year:
+            return date(int(year), month, day)
+        candidate = date(today.year, month, day)
+        return candidate if candidate >= today else date(today.year + 1, month, day)
+    except ValueError:
+        return None
+
+
+def _unknown_names(query: str, matches: list) -> list:
+    """Return capitalized words that are not sentence starts, destinations or months."""
+    for _, start, end in matches:
+        query = query[:start] + " " * (end - start) + query[end:]
+    names = []
+    for sentence in re.split(r"[.!?]\s+", query):
+        names += [
+            word
+            for word in re.findall(r"(?<=\s)[A-Z][\w'-]*", sentence.strip())
+            if word.lower() not in KNOWN_CAPITALIZED_WORDS
+        ]
+    return names
+
+
+def extract_parameters_locally(query: str, today: date | None = None) -> tuple:
+    """
+    Extract travel search parameters from plain, simple queries without calling the model.
+
+    Returns the parameters in the same shape as the extract_travel_search_parameters
+    tool call, and a confidence score between 0 and 1 for every field. Fields that
+    were not found, or were found more than once with different values, score 0.
+    """
+    today = today or date.today()
+    text = query.lower()
+    parameters = {}
+    confidence = dict.fromkeys(
+        ["destination", "departure_date", "duration", "participants", "trip_type"], 0.0
+    )
+
+    matches = destination_index.find(query)
+    if matches:
+        parameters["destination"] = list(
+            dict.fromkeys(code for codes, _, _ in matches for code in codes)
+        )
+        # Which countries of a region or sea the model picks is up to the model
+        if _unknown_names(query, matches) or any(
+            len(codes) > 1 for codes, _, _ in matches
+        ):
+            confidence["destination"] = 0.5
+        else:
+            confidence["destination"] = 0.95
+
+    dates = {date(*map(int, m)) for m in ISO_DATE_PATTERN.findall(text)}
+    dates |= {
+        _next_date(today, MONTHS[m], int(d), y)
+        for m, d, y in MONTH_DAY_PATTERN.findall(text)
+    }
+    dates |= {
+        _next_date(today, MONTHS[m], int(d), y)
+        for d, m, y in DAY_MONTH_PATTERN.findall(text)
+    }
+    dates.discard(None)
+    if len(dates) == 1:
+        parameters["departure_date"] = dates.pop().isoformat()
+        confidence["departure_date"] = 0.95
+    elif not dates and (
+        months := {MONTHS[m] for m in MONTH_PATTERN.findall(text) if m != "may"}
+    ):
+        # A month without a day could be any date in that month, leave it to the model
+        parameters["departure_date"] = _next_date(
+            today, months.pop(), 1, None
+        ).isoformat()
+        confidence["departure_date"] = 0.5
+
+    durations = set()
+    for number, unit in DURATION_PATTERN.findall(text):
+        days = _parse_number(number) * (7 if unit.startswith("we") else 1)
+        durations.add((days, unit.startswith(("night", "nacht"))))
+    if len(durations) == 1:
+        days, nights = durations.pop()
+        parameters["duration"] = days
+        confidence["duration"] = 0.6 if nights else 0.95
+
+    participants = {}
+    participant_confidence = 0.95
+    if UNCOUNTED_PARTICIPANTS_PATTERN.search(text):
+        participant_confidence = 0.5
+    for key, pattern in PARTICIPANT_PATTERNS.items():
+        counts = {
+            _parse_number(number)
+            for match in pattern.finditer(text)
+            for number in match.groups()
+            if number
+        }
+        if len(counts) == 1:
+            participants[key] = counts.pop()
+        elif counts:
+            participant_confidence = 0.0  # Conflicting counts
+    if "adults" in participants:
+        parameters["participants"] = participants
+        confidence["participants"] = participant_confidence
+
+    trip_types = {
+        trip_type
+        for keyword in TRIP_TYPE_PATTERN.findall(text)
+        for trip_type, keywords in TRIP_TYPE_KEYWORDS.items()
+        if keyword in keywords
+    }
+    if len(trip_types) == 1:
+        parameters["trip_type"] = trip_types.pop()
+        confidence["trip_type"] = 0.9
+
+    return parameters, confidence
+
+
+FAST_PATH_CONFIDENCE = float(os.getenv("FAST_PATH_CONFIDENCE", "0.9"))
+
+
+def add_local_extraction(
+    message_history: List[dict],
+    tool_call_id: str,
+    parameters: Dict[str, Any],
+    formatted_parameters: str,
+) -> None:
+    """Add an extraction made without the model to history, as if it had called the tool."""
+    message_history.append(
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": tool_call_id,
+                    "type": "function",
+                    "function": {
+                        "name": "extract_travel_search_parameters",
+                        "arguments": json.dumps(parameters),
+                    },
+                }
+            ],
+        }
+    )
+    message_history.append(
+        {
+            "role": "tool",
+            "tool_call_id": tool_call_id,
+            "name": "extract_travel_search_parameters",
+            "content": formatted_parameters,
+        }
+    )
+
+
+async def process_search_query(query: str, message_history: List[dict]) -> tuple:
+    """Process the search query using Azure OpenAI function calling.
+
+    The message history is owned by the caller (one list per Gradio session), so
+    concurrent sessions never share conversation context.
+    """
+    model = os.environ.get("AZURE_OPENAI_MODEL", "gpt-4o-mini")
+
+    # Only the first query of a session can be answered from the cache, later
+    # queries depend on the conversation before them
+    cache_key = None if message_history else extraction_cache.key(query, model)
 
     # Initialize conversation with system message if this is the first message
     if not message_history:
@@ -171,17 +894,40 @@ def process_search_query(query: str) -> tuple:
     # Add user message to history
     message_history.append({"role": "user", "content": query})
 
+    if cache_key and (cached := await extraction_cache.get(cache_key)):
+        add_local_extraction(
+            message_history,
+            f"call_{cache_key[:24]}",
+            cached["parameters"],
+            cached["formatted_parameters"],
+        )
+        return cached["formatted_parameters"], cached["json_parameters"]
+
+    # Plain, simple first queries are extracted locally when every field is confident
+    if cache_key:
+        parameters, confidence = extract_parameters_locally(query)
+        if min(confidence.values()) >= FAST_PATH_CONFIDENCE:
+            formatted_parameters = format_extracted_parameters(parameters)
+            add_local_extraction(
+                message_history,
+                f"call_local_{len(message_history)}",
+                parameters,
+                formatted_parameters,
+            )
+            return formatted_parameters, json.dumps(parameters, indent=2)
+
     # Get response from OpenAI with function calling
-    response = client.chat.completions.create(
-        model=os.environ.get("AZURE_OPENAI_MODEL", "gpt-4o-mini"),
-        messages=message_history,
-        tools=[travel_search_function],
-        tool_choice={
-            "type": "function",
-            "function": {"name": "extract_travel_search_parameters"},
-        },
-        temperature=0,
+    response = await create_completion(
+        request_builder.build(
+            message_history,
+            tool_choice={
+                "type": "function",
+                "function": {"name": "extract_travel_search_parameters"},
+            },
+            temperature=0,
+        )
     )
+    request_builder.record_usage(response.usage)
 
     # Extract the function call and parameters
     message = response.choices[0].message
@@ -191,7 +937,9 @@ def process_search_query(query: str) -> tuple:
         {
             "role": "assistant",
             "content": message.content or None,
-            "tool_calls": message.tool_calls,
+            "tool_calls": [tool_call.model_dump() for tool_call in message.tool_calls]
+            if message.tool_calls
+            else None,
         }
     )
 
@@ -200,6 +948,10 @@ def process_search_query(query: str) -> tuple:
         function_call = message.tool_calls[0].function
         tool_call_id = message.tool_calls[0].id
         parameters = json.loads(function_call.arguments)
+        if "destination" in parameters:
+            parameters["destination"] = destination_index.normalize_destinations(
+                parameters["destination"]
+            )
 
         # Format the parameters for display
         formatted_parameters = format_extracted_parameters(parameters)
@@ -217,19 +969,51 @@ def process_search_query(query: str) -> tuple:
             }
         )
 
+        if cache_key:
+            await extraction_cache.set(
+                cache_key,
+                {
+                    "parameters": parameters,
+                    "formatted_parameters": formatted_parameters,
+                    "json_parameters": json_parameters,
+                },
+            )
+
+        # The latest extraction holds the merged parameters of the conversation so far
+        history_manager.compact(message_history, parameters)
+
         return formatted_parameters, json_parameters
 
     else:
         return ("No parameters could be extracted from your query.", "{}")
 
 
-def search_interface(query):
-    if not query.strip():
-        return "", "{}"
+# Searches running at once, 0 for no limit. The handler is async and doesn't hold
+# a worker thread, but Gradio still runs at most `max_threads` events at once.
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "64"))
+# Events waiting in the queue, more are turned away with "queue is full"
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", "100"))
+queue_monitor = QueueMonitor(QUEUE_MAX_SIZE, {"search": SEARCH_CONCURRENCY})
+
+
+async def search_interface(query, message_history, request: gr.Request = None):
+    with queue_monitor.track("search", request):
+        if not query.strip():
+            return "", "{}", message_history
 
-    extracted_params, json_params = process_search_query(query)
+        turn_start = len(message_history)
+        try:
+            extracted_params, json_params = await process_search_query(
+                query, message_history
+            )
+        except SchedulerBusy as e:
+            # Drop the unanswered query, so searching again doesn't repeat it
+            del message_history[turn_start:]
+            raise gr.Error(
+                "The search is very busy right now, please try again in a moment."
+            ) from e
 
-    return extracted_params, json_params
+        return extracted_params, json_params, message_history
 
 
 # Example search queries
@@ -247,6 +1031,9 @@ def set_example_3():
 
 # Create the Gradio interface
 with gr.Blocks(title="Travel Search") as demo:
+    # Message history to maintain conversation context, kept per browser session
+    message_history = gr.State([])
+
     gr.Markdown("""
     # Travel Search
     Enter your travel requirements in natural language. The system will generate a search query for you.
@@ -282,18 +1069,23 @@ with gr.Blocks(title="Travel Search") as demo:
             gr.Markdown("### Parameters (JSON)")
             json_output = gr.JSON()
 
-    # Set up click handlers for the search button and input
+    # Set up click handlers for the search button and input. The handler is async
+    # and does not hold a worker thread, so many searches can run at once.
     search_button.click(
         fn=search_interface,
-        inputs=search_input,
-        outputs=[extracted_params_output, json_output],
+        inputs=[search_input, message_history],
+        outputs=[extracted_params_output, json_output, message_history],
+        concurrency_limit=SEARCH_CONCURRENCY or None,
+        concurrency_id="search",
     )
 
     # Allow Enter key to submit
     search_input.submit(
         fn=search_interface,
-        inputs=search_input,
-        outputs=[extracted_params_output, json_output],
+        inputs=[search_input, message_history],
+        outputs=[extracted_params_output, json_output, message_history],
+        concurrency_limit=SEARCH_CONCURRENCY or None,
+        concurrency_id="search",
     )
 
     # Set up click handlers for example buttons
@@ -301,6 +1093,21 @@ with gr.Blocks(title="Travel Search") as demo:
     example_2_button.click(fn=set_example_2, outputs=search_input)
     example_3_button.click(fn=set_example_3, outputs=search_input)
 
+demo.queue(max_size=QUEUE_MAX_SIZE or None)
+
 # Launch the app
 if __name__ == "__main__":
-    demo.launch()
+    if CLIENT_PREWARM:
+        client_factory.prewarm()
+    if interval := float(os.getenv("QUEUE_METRICS_INTERVAL", "0")):
+        queue_monitor.report(
+            interval,
+            scheduler=scheduler.stats,
+            extraction_cache=extraction_cache.stats,
+        )
+    # Gradio runs at most `max_threads` events at once, 40 by default
+    app_kwargs = {"lifespan": client_factory.lifespan} if CLIENT_PREWARM else {}
+    demo.launch(
+        max_threads=max(40, SEARCH_CONCURRENCY),
+        app_kwargs=queue_monitor.app_kwargs(**app_kwargs),
+    )
@@ -0,0 +1,243 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "gradio",
+#     "azure-identity",
+#     "openai",
+#     "python-dotenv",
+#     "requests",
+#     "tiktoken",
+#     "pillow",
+# ]
+# ///
+
+"""
+Extract travel search parameters for a JSONL file of queries, one {"query": ...}
+object per line with an optional "id". Every query is extracted as the first query
+of its own session.
+
+  extract  Run the extraction concurrently, with a bounded number of queries in
+           flight, and stream the results to a JSONL file. Progress is checkpointed,
+           an interrupted run continues where it stopped when started again.
+  prepare  Write an Azure OpenAI Batch API request file for the queries.
+  ingest   Read the output file of an Azure OpenAI batch job into the same result
+           format as extract.
+
+Usage: uv run batch.py extract queries.jsonl results.jsonl [--concurrency 32] [--mock [LATENCY]]
+       uv run batch.py prepare queries.jsonl batch_requests.jsonl
+       uv run batch.py ingest batch_output.jsonl results.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+
+def peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes on Linux
+    return peak_rss / 1024 / 1024 if sys.platform == "darwin" else peak_rss / 1024
+
+
+def read_queries(file, offset: int = 0, line_number: int = 0):
+    """Yield (id, query, end offset, line number) for every line of a binary JSONL file."""
+    file.seek(offset)
+    while line := file.readline():
+        line_number += 1
+        offset += len(line)
+        if line.strip():
+            record = json.loads(line)
+            yield record.get("id", line_number), record["query"], offset, line_number
+
+
+def load_checkpoint(output_path: str) -> dict:
+    try:
+        with open(output_path + ".checkpoint") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"input_offset": 0, "input_line": 0, "output_offset": 0, "records": 0}
+
+
+def save_checkpoint(output_path: str, checkpoint: dict) -> None:
+    with open(output_path + ".checkpoint.tmp", "w") as file:
+        json.dump(checkpoint, file)
+    os.replace(output_path + ".checkpoint.tmp", output_path + ".checkpoint")
+
+
+async def extract_query(app, query_id: str, query: str) -> dict:
+    try:
+        _, json_parameters = await app.process_search_query(query, [])
+        return {
+            "id": query_id,
+            "query": query,
+            "parameters": json.loads(json_parameters),
+        }
+    except Exception as e:
+        return {"id": query_id, "query": query, "error": str(e)}
+
+
+async def extract(app, input_path: str, output_path: str, concurrency: int, every: int):
+    checkpoint = load_checkpoint(output_path)
+    if checkpoint["records"]:
+        print(f"Resuming after {checkpoint['records']} records", file=sys.stderr)
+
+    # On the path of the app, which adds the root of the repository
+    from shared.scheduling import BACKGROUND, request_priority
+
+    # Interactive searches sharing the deployment go first
+    request_priority.set(BACKGROUND)
+
+    # Results are written in input order, the queue bounds the queries in flight
+    in_flight = asyncio.Queue(maxsize=concurrency)
+
+    async def produce():
+        with open(input_path, "rb") as input_file:
+            for query_id, query, offset, line_number in read_queries(
+                input_file, checkpoint["input_offset"], checkpoint["input_line"]
+            ):
+                task = asyncio.create_task(extract_query(app, query_id, query))
+                await in_flight.put((task, offset, line_number))
+        await in_flight.put(None)
+
+    producer = asyncio.create_task(produce())
+    start = time.perf_counter()
+    records = 0
+
+    def report(label: str):
+        elapsed = time.perf_counter() - start
+        print(
+            f"{label}: {checkpoint['records']} records, {records / elapsed:.1f}"
+            f" queries/sec, peak RSS {peak_rss_mb():.0f} MB",
+            file=sys.stderr,
+        )
+
+    with open(output_path, "a+b") as output_file:
+        output_file.truncate(checkpoint["output_offset"])
+
+        while item := await in_flight.get():
+            task, offset, line_number = item
+            output_file.write(json.dumps(await task).encode() + b"\n")
+            records += 1
+            checkpoint.update(
+                input_offset=offset,
+                input_line=line_number,
+                records=checkpoint["records"] + 1,
+            )
+
+            if records % every == 0:
+                output_file.flush()
+                save_checkpoint(
+                    output_path, {**checkpoint, "output_offset": output_file.tell()}
+                )
+                report("Progress")
+
+        output_file.flush()
+        save_checkpoint(
+            output_path, {**checkpoint, "output_offset": output_file.tell()}
+        )
+
+    await producer
+    if records:
+        report("Done")
+
+
+def prepare(app, input_path: str, output_path: str):
+    """Write one Batch API request per query, with the same request as the app."""
+    with open(input_path, "rb") as input_file, open(output_path, "w") as output_file:
+        for query_id, query, _, _ in read_queries(input_file):
+            body = app.request_builder.build(
+                [app.get_system_message(), {"role": "user", "content": query}],
+                tool_choice={
+                    "type": "function",
+                    "function": {"name": "extract_travel_search_parameters"},
+                },
+                temperature=0,
+            )
+            request = {
+                "custom_id": str(query_id),
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": body,
+            }
+            output_file.write(json.dumps(request) + "\n")
+
+
+def ingest(app, input_path: str, output_path: str):
+    """Convert a Batch API output file to extraction results."""
+    with open(input_path) as input_file, open(output_path, "w") as output_file:
+        for line in filter(str.strip, input_file):
+            record = json.loads(line)
+            result = {"id": record["custom_id"]}
+
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                result["error"] = record.get("error") or response.get("body")
+            else:
+                message = response["body"]["choices"][0]["message"]
+                tool_calls = message.get("tool_calls") or []
+                parameters = (
+                    json.loads(tool_calls[0]["function"]["arguments"])
+                    if tool_calls
+                    else {}
+                )
+                if "destination" in parameters:
+                    parameters["destination"] = (
+                        app.destination_index.normalize_destinations(
+                            parameters["destination"]
+                        )
+                    )
+                result["parameters"] = parameters
+
+            output_file.write(json.dumps(result) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["extract", "prepare", "ingest"])
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--checkpoint-every", type=int, default=100)
+    parser.add_argument(
+        "--mock",
+        type=float,
+        nargs="?",
+        const=0.5,
+        metavar="LATENCY",
+        help="extract against a local mock endpoint with the given latency",
+    )
+    args = parser.parse_args()
+
+    if args.mock is not None:
+        # Importing the load test puts the benchmarks folder with the mock server on the path
+        import loadtest
+        import mock_server
+
+        port = loadtest.free_port()
+        multiprocessing.Process(
+            target=mock_server.serve, args=(port, args.mock, 0.0), daemon=True
+        ).start()
+        os.environ["AZURE_OPENAI_ENDPOINT"] = f"http://127.0.0.1:{port}"
+        os.environ["AZURE_OPENAI_API_KEY"] = "mock-key"
+
+    import app
+
+    if args.command == "extract":
+        asyncio.run(
+            extract(
+                app, args.input, args.output, args.concurrency, args.checkpoint_every
+            )
+        )
+    elif args.command == "prepare":
+        prepare(app, args.input, args.output)
+    else:
+        ingest(app, args.input, args.output)
+
+
+if __name__ == "__main__":
+    main()
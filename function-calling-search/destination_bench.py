@@ -0,0 +1,77 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = []
+# ///
+
+"""
+Benchmark the destination resolver index, for names that match exactly, names
+with a typo and names that are unknown.
+
+Usage: uv run destination_bench.py [--rounds 20]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+# The modules shared by the demos are in the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.destinations import (  # noqa: E402
+    COUNTRY_NAMES,
+    ISO_COUNTRY_CODES,
+    REGION_NAMES,
+    destination_index,
+)
+
+
+def benchmark(label: str, names: list, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for name in names:
+            destination_index.resolve(name)
+    elapsed = time.perf_counter() - start
+
+    lookups = len(names) * rounds
+    print(f"{label:<10} {lookups:>9} {lookups / elapsed:>14,.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(42)
+    names = [
+        name
+        for names in (*COUNTRY_NAMES.values(), *REGION_NAMES.values())
+        for name in names
+    ]
+    exact = [random.choice([name, name.title(), name.upper()]) for name in names]
+    exact += sorted(ISO_COUNTRY_CODES)
+
+    # Replace, drop or duplicate one character of every name long enough to match
+    typos = []
+    for name in names:
+        if len(name) >= 5:
+            i = random.randrange(1, len(name) - 1)
+            typos.append(
+                random.choice(
+                    [
+                        name[:i] + "x" + name[i + 1 :],
+                        name[:i] + name[i + 1 :],
+                        name[:i] + name[i] + name[i:],
+                    ]
+                )
+            )
+    unknown = [f"unknown place {i}" for i in range(len(names))]
+
+    print(f"{'names':<10} {'lookups':>9} {'lookups/sec':>14}")
+    benchmark("exact", exact, args.rounds)
+    benchmark("typo", typos, args.rounds)
+    benchmark("unknown", unknown, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "gradio",
+#     "azure-identity",
+#     "openai",
+#     "python-dotenv",
+#     "requests",
+#     "tiktoken",
+# ]
+# ///
+
+"""
+Compare the local rule-based extractor with recorded LLM extractions, for accuracy
+and latency. Every line of the recordings file holds a query, the date it was
+extracted on, the parameters the model returned and optionally its latency. The
+recordings in the repository hold no latencies, so with them the comparison is
+for accuracy only; record your own with --record to compare the latency too.
+
+Usage: uv run fastpath_eval.py [--recordings recorded_extractions.jsonl]
+       uv run fastpath_eval.py --record queries.txt --recordings new_recordings.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import date, datetime
+
+import app
+
+
+async def record(queries_path: str, recordings_path: str):
+    """Extract every query in a text file with the model and record the results."""
+    with open(queries_path) as queries, open(recordings_path, "a") as recordings:
+        for query in filter(None, (line.strip() for line in queries)):
+            start = time.perf_counter()
+            response = await app.create_completion(
+                app.request_builder.build(
+                    [app.get_system_message(), {"role": "user", "content": query}],
+                    tool_choice={
+                        "type": "function",
+                        "function": {"name": "extract_travel_search_parameters"},
+                    },
+                    temperature=0,
+                )
+            )
+            latency_ms = (time.perf_counter() - start) * 1000
+
+            tool_calls = response.choices[0].message.tool_calls or []
+            parameters = (
+                json.loads(tool_calls[0].function.arguments) if tool_calls else {}
+            )
+            record = {
+                "query": query,
+                "date": datetime.now().strftime("%Y-%m-%d"),
+                "parameters": parameters,
+                "latency_ms": round(latency_ms, 1),
+            }
+            recordings.write(json.dumps(record) + "\n")
+            print(f"{latency_ms:>8.1f} ms  {query}")
+
+
+def evaluate(recordings_path: str, repeat: int):
+    with open(recordings_path) as recordings:
+        records = [json.loads(line) for line in recordings if line.strip()]
+
+    accepted = correct = 0
+    field_matches = {}
+    local_latencies = []
+    for record in records:
+        today = date.fromisoformat(record["date"])
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            parameters, confidence = app.extract_parameters_locally(
+                record["query"], today
+            )
+        local_latencies.append((time.perf_counter() - start) / repeat * 1000)
+
+        for field, score in confidence.items():
+            if score >= app.FAST_PATH_CONFIDENCE:
+                matches = parameters.get(field) == record["parameters"].get(field)
+                field_matches.setdefault(field, []).append(matches)
+
+        if min(confidence.values()) >= app.FAST_PATH_CONFIDENCE:
+            accepted += 1
+            correct += parameters == record["parameters"]
+            if parameters != record["parameters"]:
+                print(f"Mismatch: {record['query']}\n  local: {parameters}")
+
+    print(f"Recorded queries:        {len(records)}")
+    print(
+        f"Answered locally:        {accepted} ({accepted / len(records):.0%}),"
+        f" threshold {app.FAST_PATH_CONFIDENCE}"
+    )
+    if accepted:
+        print(f"Exact match when local:  {correct / accepted:.0%}")
+    for field, matches in field_matches.items():
+        print(
+            f"  {field + ':':<22} {sum(matches) / len(matches):.0%} of {len(matches)}"
+            " confident extractions match"
+        )
+
+    print(f"Local latency (mean):    {statistics.mean(local_latencies):.3f} ms")
+    if llm_latencies := [r["latency_ms"] for r in records if "latency_ms" in r]:
+        print(f"LLM latency (mean):      {statistics.mean(llm_latencies):.1f} ms")
+    else:
+        print("LLM latency:             not recorded, accuracy only")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--recordings", default="recorded_extractions.jsonl")
+    parser.add_argument(
+        "--record", metavar="QUERIES", help="text file, one query per line"
+    )
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.record:
+        asyncio.run(record(args.record, args.recordings))
+    else:
+        evaluate(args.recordings, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
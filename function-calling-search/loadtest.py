@@ -0,0 +1,106 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "gradio",
+#     "azure-identity",
+#     "openai",
+#     "python-dotenv",
+#     "requests",
+#     "pillow",
+# ]
+# ///
+
+"""
+Load test for the function calling search, against the mock of the Azure OpenAI chat
+completions endpoint in benchmarks/mock_server.py. Every simulated session keeps its
+own message history and sends a few queries in sequence, while all sessions run
+concurrently in one process.
+
+The 95th percentile of the prompt size shows whether the history stays within its
+token budget, run with `--turns 50` to check it stays flat for long sessions.
+
+Usage: uv run loadtest.py [--sessions 1 50 200] [--turns 3] [--latency 0.5]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"
+    ),
+)
+import mock_server  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_session(app, session_id: int, turns: int) -> list:
+    """Send `turns` queries in one session and check the history only holds its own."""
+    message_history = []
+    for turn in range(turns):
+        await app.process_search_query(
+            f"Session {session_id}, turn {turn}: sun vacation to Spain for 2 adults",
+            message_history,
+        )
+
+    # Older turns may have been compacted away, the ones left must all be our own
+    user_messages = [m["content"] for m in message_history if m["role"] == "user"]
+    assert user_messages[-1].startswith(f"Session {session_id}, turn {turns - 1}:")
+    assert all(m.startswith(f"Session {session_id},") for m in user_messages)
+    return message_history
+
+
+async def run_load(app, session_counts: list, turns: int):
+    print(
+        f"{'sessions':>8} {'requests':>9} {'seconds':>8} {'req/s':>8} {'p95 tokens':>11}"
+    )
+    for sessions in session_counts:
+        app.history_manager.prompt_tokens.clear()
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(app, i, turns) for i in range(sessions)))
+        elapsed = time.perf_counter() - start
+
+        requests = sessions * turns
+        print(
+            f"{sessions:>8} {requests:>9} {elapsed:>8.2f} {requests / elapsed:>8.1f}"
+            f" {app.history_manager.percentile(95):>11}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 50, 200])
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    port = free_port()
+    mock = multiprocessing.Process(
+        target=mock_server.serve, args=(port, args.latency, 0.0), daemon=True
+    )
+    mock.start()
+
+    # Point the app at the mock before importing it, which loads the .env file
+    os.environ["AZURE_OPENAI_ENDPOINT"] = f"http://127.0.0.1:{port}"
+    os.environ["AZURE_OPENAI_API_KEY"] = "mock-key"
+    import app
+
+    print(f"Mock latency: {args.latency:.2f}s, turns per session: {args.turns}")
+    asyncio.run(run_load(app, args.sessions, args.turns))
+
+    mock.terminate()
+
+
+if __name__ == "__main__":
+    main()
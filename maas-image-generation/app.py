@@ -3,23 +3,43 @@
 # dependencies = [
 #     "gradio",
 #     "pillow",
+#     "httpx[http2]",
 #     "python-dotenv",
-#     "requests",
 # ]
 # ///
 
 from __future__ import annotations
 
 import base64
+import hashlib
+import importlib.util
 import json
 import logging
 import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from io import BytesIO
 
 import gradio as gr
-import requests
+import httpx
 from dotenv import load_dotenv
-from PIL import Image
+from gradio.utils import get_upload_folder
+from PIL import Image, ImageOps
+
+# The modules shared by the demos are in the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from shared.queueing import QueueMonitor  # noqa: E402
+from shared.scheduling import (  # noqa: E402
+    Deployment,
+    RequestScheduler,
+    SchedulerBusy,
+)
 
 logger = logging.getLogger(__name__)
 load_dotenv(override=True)
@@ -32,6 +52,10 @@ if os.getenv("STABLE_DIFFUSION_35_ENDPOINT") and os.getenv("STABLE_DIFFUSION_35_
     MODEL_CONFIGS["Stable Diffusion 3.5"] = {
         "endpoint": os.getenv("STABLE_DIFFUSION_35_ENDPOINT"),
         "key": os.getenv("STABLE_DIFFUSION_35_KEY"),
+        # Requests per minute of the deployment, 0 for no limit
+        "rpm": os.getenv("STABLE_DIFFUSION_35_RPM", "0"),
+        # Images generated at once, every model has its own Gradio concurrency group
+        "concurrency": int(os.getenv("STABLE_DIFFUSION_35_CONCURRENCY", "4")),
         "provider": "Stability AI",
     }
 
@@ -40,6 +64,10 @@ if os.getenv("STABLE_IMAGE_CORE_ENDPOINT") and os.getenv("STABLE_IMAGE_CORE_KEY"
     MODEL_CONFIGS["Stable Image Core"] = {
         "endpoint": os.getenv("STABLE_IMAGE_CORE_ENDPOINT"),
         "key": os.getenv("STABLE_IMAGE_CORE_KEY"),
+        # Requests per minute of the deployment, 0 for no limit
+        "rpm": os.getenv("STABLE_IMAGE_CORE_RPM", "0"),
+        # Images generated at once, every model has its own Gradio concurrency group
+        "concurrency": int(os.getenv("STABLE_IMAGE_CORE_CONCURRENCY", "4")),
         "provider": "Stability AI",
     }
 
@@ -48,6 +76,10 @@ if os.getenv("STABLE_IMAGE_ULTRA_ENDPOINT") and os.getenv("STABLE_IMAGE_ULTRA_KE
     MODEL_CONFIGS["Stable Image Ultra"] = {
         "endpoint": os.getenv("STABLE_IMAGE_ULTRA_ENDPOINT"),
         "key": os.getenv("STABLE_IMAGE_ULTRA_KEY"),
+        # Requests per minute of the deployment, 0 for no limit
+        "rpm": os.getenv("STABLE_IMAGE_ULTRA_RPM", "0"),
+        # Images generated at once, every model has its own Gradio concurrency group
+        "concurrency": int(os.getenv("STABLE_IMAGE_ULTRA_CONCURRENCY", "4")),
         "provider": "Stability AI",
     }
 
@@ -56,9 +88,436 @@ if os.getenv("BRIA_23_FAST_ENDPOINT") and os.getenv("BRIA_23_FAST_KEY"):
     MODEL_CONFIGS["Bria 2.3 Fast"] = {
         "endpoint": os.getenv("BRIA_23_FAST_ENDPOINT"),
         "key": os.getenv("BRIA_23_FAST_KEY"),
+        # Requests per minute of the deployment, 0 for no limit
+        "rpm": os.getenv("BRIA_23_FAST_RPM", "0"),
+        # Images generated at once, every model has its own Gradio concurrency group
+        "concurrency": int(os.getenv("BRIA_23_FAST_CONCURRENCY", "4")),
         "provider": "Bria",
     }
 
+
+class ClientFactory:
+    """
+    Keep one HTTP client per host of the model endpoints, created on first use, so
+    requests reuse open connections instead of starting with a new TLS handshake,
+    also across models deployed on the same host. With HTTP/2 the requests to a host
+    share one connection. Every request has a connect and read timeout, so a hung
+    endpoint fails over instead of holding a worker. With prewarm, a background
+    thread opens the connections at startup.
+    """
+
+    def __init__(self, pool_size: int, timeout: httpx.Timeout):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.ready = threading.Event()
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint: str) -> httpx.Client:
+        url = httpx.URL(endpoint)
+        host = (url.scheme, url.host, url.port)
+        if (client := self._clients.get(host)) is None:
+            with self._lock:
+                if (client := self._clients.get(host)) is None:
+                    client = httpx.Client(
+                        # HTTP/2 needs the h2 package, else the client uses HTTP/1.1
+                        http2=importlib.util.find_spec("h2") is not None,
+                        limits=httpx.Limits(
+                            max_connections=self.pool_size,
+                            max_keepalive_connections=self.pool_size,
+                        ),
+                        timeout=self.timeout,
+                    )
+                    self._clients[host] = client
+        return client
+
+    def prewarm(self):
+        threading.Thread(target=self._open_connections, daemon=True).start()
+
+    def _open_connections(self):
+        for model_choice, model_config in MODEL_CONFIGS.items():
+            for deployment in model_config["deployments"]:
+                # Any request opens the connection, the model info itself isn't needed
+                try:
+                    self.get(deployment.endpoint).get(
+                        deployment.endpoint + "/info",
+                        headers={"Authorization": f"{deployment.api_key}"},
+                    )
+                except httpx.HTTPError as e:
+                    logger.warning(
+                        f"Opening a connection for {model_choice} failed: {e}"
+                    )
+        self.ready.set()
+
+
+client_factory = ClientFactory(
+    int(os.getenv("HTTP_POOL_SIZE", "32")),
+    # Waiting for a free connection of the pool isn't a failure of the endpoint
+    httpx.Timeout(
+        float(os.getenv("HTTP_READ_TIMEOUT", "120")),
+        connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+        pool=None,
+    ),
+)
+
+
+def read_deployments(model_choice: str, model_config: dict) -> list[Deployment]:
+    """
+    Read the deployments of a model from its comma separated endpoints, keys and
+    requests per minute. A single value applies to every deployment.
+    """
+    values = {
+        name: [value.strip() for value in model_config[name].split(",")]
+        for name in ("endpoint", "key", "rpm")
+    }
+    count = max(len(value) for value in values.values())
+    for name, value in values.items():
+        if len(value) not in (1, count):
+            raise ValueError(f"{name} has {len(value)} values, expected 1 or {count}")
+        values[name] = value * count if len(value) == 1 else value
+
+    cooldown = float(os.getenv("DEPLOYMENT_COOLDOWN", "30"))
+    return [
+        Deployment(endpoint, key, model_choice, int(rpm), 0, cooldown)
+        for endpoint, key, rpm in zip(*values.values())
+    ]
+
+
+# A model can have several deployments, each with its own key and rate limit
+for model_choice, model_config in MODEL_CONFIGS.items():
+    model_config["deployments"] = read_deployments(model_choice, model_config)
+
+schedulers = {
+    model_choice: RequestScheduler(
+        model_config["deployments"],
+        max_queue=int(os.getenv("SCHEDULER_MAX_QUEUE", "64")),
+        max_wait=float(os.getenv("SCHEDULER_MAX_WAIT", "20")),
+        max_retries=int(os.getenv("SCHEDULER_MAX_RETRIES", "4")),
+        # Timeouts and connection errors are transport errors
+        transport_errors=(httpx.TransportError,),
+    )
+    for model_choice, model_config in MODEL_CONFIGS.items()
+}
+
+
+# Bytes of a response read at once, while its image is decoded
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+# Format of an image by the first bytes of its file
+IMAGE_SIGNATURES = {b"\x89PNG": "png", b"\xff\xd8\xff": "jpeg", b"RIFF": "webp"}
+
+
+def image_format(path: str) -> str:
+    """Return the format of an image file, as its extension."""
+    with open(path, "rb") as file:
+        header = file.read(4)
+    return next(
+        (
+            extension
+            for signature, extension in IMAGE_SIGNATURES.items()
+            if header.startswith(signature)
+        ),
+        "png",
+    )
+
+
+class Base64FieldDecoder:
+    """
+    Decode a base64 string field of a JSON document while the document streams in,
+    and write the decoded bytes to `file`. The response text, the base64 string and
+    the decoded image are never held in memory, only the current chunk. The first
+    field named `field` is decoded, the rest of the document is skipped.
+    """
+
+    def __init__(self, field: str, file):
+        self.file = file
+        self.pattern = re.compile(b'"' + re.escape(field.encode()) + rb'"\s*:\s*"')
+        # The text searched for the field, or the base64 carried to the next chunk
+        self.buffer = b""
+        self.decoding = False
+        self.done = False
+
+    def feed(self, chunk: bytes) -> None:
+        if self.done:
+            return
+        if not self.decoding:
+            self.buffer += chunk
+            match = self.pattern.search(self.buffer)
+            if match is None:
+                # Keep the end, in case the field name is split over two chunks
+                self.buffer = self.buffer[-256:]
+                return
+            self.decoding = True
+            chunk, self.buffer = self.buffer[match.end() :], b""
+
+        # Base64 has no quotes, so the first one ends the string
+        if (end := chunk.find(b'"')) != -1:
+            chunk = chunk[:end]
+            self.done = True
+        data = self.buffer + chunk if self.buffer else chunk
+        carried = b""
+        # JSON may escape the slashes of the base64 string, or break its lines
+        if b"\\" in data:
+            if data.endswith(b"\\") and not self.done:
+                data, carried = data[:-1], b"\\"
+            data = data.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+        # Decode whole groups of 4 characters, the rest waits for the next chunk
+        end = len(data) if self.done else len(data) // 4 * 4
+        self.file.write(base64.b64decode(memoryview(data)[:end]))
+        self.buffer = data[end:] + carried
+
+
+def receive_image(response: httpx.Response, field: str, directory: str) -> str:
+    """
+    Stream the base64 image in `field` of a JSON response to a temporary file in
+    `directory`, and return the path of the file.
+    """
+    fd, path = tempfile.mkstemp(dir=directory, prefix=".")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            decoder = Base64FieldDecoder(field, file)
+            # The whole response is read, so the connection can be used again
+            for chunk in response.iter_bytes(IMAGE_CHUNK_SIZE):
+                decoder.feed(chunk)
+        if not decoder.done:
+            raise ValueError(f"No {field} in the response")
+    except ValueError as e:
+        os.unlink(path)
+        raise httpx.DecodingError(str(e), request=response.request) from e
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+class ImageCache:
+    """
+    Content-addressed cache of generated images on disk, keyed on a hash of the
+    model and every parameter of the request, so an image with a seed is generated
+    once. An index in memory keeps the size and the order of use of the files, and
+    the least recently used files are removed beyond `max_bytes`. Files are written
+    to a temporary file and renamed, so worker processes sharing the directory never
+    read a partly written image. The index is read from the directory again every
+    `rescan_interval` seconds, so the budget holds for the images of all workers
+    together. The directory is created and read on first use.
+
+    Images are served from a link to the cached file in the Gradio cache, so an
+    image removed from the cache by another request can still be served.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, rescan_interval: float = 60):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.rescan_interval = rescan_interval
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self._scanned = None
+        self._lock = threading.Lock()
+
+    def key(self, model: str, params: dict) -> str:
+        return hashlib.sha256(
+            json.dumps([model, params], sort_keys=True).encode()
+        ).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """Return the path of a link to the cached image, or None."""
+        with self._lock:
+            self._load()
+            entry = self.entries.get(key) or self._find(key)
+            if entry is not None:
+                path = os.path.join(self.directory, entry[0])
+                try:
+                    # The modification time shares the order of use with other workers
+                    os.utime(path)
+                    served = save_image(path, link=True)
+                except FileNotFoundError:
+                    # Removed by another worker
+                    self._remove(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += entry[1]
+            return served
+
+    def set(self, key: str, path: str) -> str:
+        """
+        Move an image file, written in the cache directory, into the cache and
+        return the path of a link to it. Renaming is atomic, so other workers never
+        read a partly written image.
+        """
+        name = f"{key}.{image_format(path)}"
+        cached_path = os.path.join(self.directory, name)
+        os.replace(path, cached_path)
+        served = save_image(cached_path, link=True)
+        with self._lock:
+            self._load()
+            if key in self.entries:
+                self.bytes -= self.entries[key][1]
+            # The image just stored is the most recently used
+            self.entries[key] = (name, os.path.getsize(served))
+            self.entries.move_to_end(key)
+            self.bytes += self.entries[key][1]
+            self._evict()
+        return served
+
+    def _load(self) -> None:
+        """Create the directory on first use, and index it again at the interval."""
+        now = time.monotonic()
+        if self._scanned is not None and now - self._scanned < self.rescan_interval:
+            return
+        if self._scanned is None:
+            os.makedirs(self.directory, exist_ok=True)
+        self._scanned = now
+        # Other workers add images as well, the directory holds them all
+        self._scan()
+        self._evict()
+
+    def _scan(self) -> None:
+        """Index the images in the directory, least recently used first."""
+        # The modification time is the last use, by this or another worker
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        self.entries = OrderedDict(
+            (name.split(".")[0], (name, size)) for _, name, size in sorted(files)
+        )
+        self.bytes = sum(size for _, _, size in files)
+
+    def _find(self, key: str) -> tuple | None:
+        """Return an image stored by another worker."""
+        for extension in IMAGE_SIGNATURES.values():
+            name = f"{key}.{extension}"
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            self.entries[key] = (name, size)
+            self.bytes += size
+            return self.entries[key]
+        return None
+
+    def _remove(self, key: str) -> None:
+        name, size = self.entries.pop(key)
+        self.bytes -= size
+        try:
+            os.unlink(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        # The latest image stays, even when it's larger than the budget on its own
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "bytes_saved": self.bytes_saved,
+            }
+
+
+# Images with a seed are cached, 0 MB turns the cache off
+IMAGE_CACHE_MB = int(os.getenv("IMAGE_CACHE_MB", "1024"))
+image_cache = None
+if IMAGE_CACHE_MB:
+    image_cache = ImageCache(
+        os.getenv("IMAGE_CACHE_DIR")
+        or os.path.join(tempfile.gettempdir(), "maas_image_cache"),
+        IMAGE_CACHE_MB * 1024 * 1024,
+    )
+
+
+def encode_image_prompt(path: str, size: str, quality: int) -> str:
+    """
+    Return the initial image as base64, scaled down to fit the generated image, as
+    the model doesn't use more detail than that. An image without transparency is
+    sent as JPEG, a fraction of the size of a PNG of a photo.
+    """
+    width, height = map(int, size.split("x"))
+    image = Image.open(path)
+    # A JPEG is decoded at a lower resolution right away, when it's large enough
+    image.draft("RGB", (width, height))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((width, height), Image.Resampling.LANCZOS)
+
+    buffered = BytesIO()
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image.save(buffered, format="PNG")
+    else:
+        image.convert("RGB").save(buffered, format="JPEG", quality=quality)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+class ImagePromptCache:
+    """
+    Keep the encoded initial images of Stable Diffusion 3.5 by a hash of the
+    uploaded file and the image size, so generating again from the same initial
+    image skips scaling and encoding it. The least recently used are evicted.
+    """
+
+    def __init__(self, max_entries: int, quality: int):
+        self.max_entries = max_entries
+        self.quality = quality
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, path: str, size: str) -> str:
+        with open(path, "rb") as file:
+            key = (hashlib.file_digest(file, "sha256").hexdigest(), size)
+        with self._lock:
+            if (encoded := self.entries.get(key)) is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return encoded
+            self.misses += 1
+
+        encoded = encode_image_prompt(path, size, self.quality)
+        with self._lock:
+            self.entries[key] = encoded
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return encoded
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": sum(len(encoded) for encoded in self.entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+image_prompt_cache = ImagePromptCache(
+    max_entries=int(os.getenv("IMAGE_PROMPT_CACHE_SIZE", "16")),
+    quality=int(os.getenv("IMAGE_PROMPT_QUALITY", "90")),
+)
+
+# Events waiting in the queue, more are turned away with "queue is full"
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", "100"))
+
 SAMPLES = {
     "serene": {
         "prompt": "A serene mountain landscape during sunset with a clear sky and vibrant colors",
@@ -86,9 +545,76 @@ def generate_image(
     guidance_scale: float | None = None,
     image_prompt: str | None = None,
     image_strength: float | None = None,
-) -> Image.Image:
+    request: gr.Request = None,
+) -> str:
+    """Generate an image for an event of the queue, see `create_image`."""
+    with queue_monitor.track(f"generate {model_choice}", request):
+        return create_image(
+            model_choice,
+            prompt,
+            output_format,
+            negative_prompt,
+            size,
+            seed,
+            diffusion_steps,
+            guidance_scale,
+            image_prompt,
+            image_strength,
+        )
+
+
+def model_handler(model_choice: str):
     """
-    Generate an image based on the provided configuration and prompt parameters.
+    Return the handler of the generate button of `model_choice`, which generates
+    its images with that model only, so its concurrency group limits the model it
+    runs. A `functools.partial` would hide the `gr.Request` argument from Gradio.
+    """
+
+    def generate(
+        prompt: str,
+        output_format: str,
+        negative_prompt: str,
+        size: str,
+        seed: int | None = None,
+        diffusion_steps: int | None = None,
+        guidance_scale: float | None = None,
+        image_prompt: str | None = None,
+        image_strength: float | None = None,
+        request: gr.Request = None,
+    ) -> str:
+        return generate_image(
+            model_choice,
+            prompt,
+            output_format,
+            negative_prompt,
+            size,
+            seed,
+            diffusion_steps,
+            guidance_scale,
+            image_prompt,
+            image_strength,
+            request,
+        )
+
+    return generate
+
+
+def create_image(
+    model_choice: str,
+    prompt: str,
+    output_format: str,
+    negative_prompt: str,
+    size: str,
+    seed: int | None = None,
+    diffusion_steps: int | None = None,
+    guidance_scale: float | None = None,
+    image_prompt: str | None = None,
+    image_strength: float | None = None,
+) -> str:
+    """
+    Generate an image based on the provided configuration and prompt parameters,
+    and return the path of the image file as the endpoint returned it. An image
+    with a seed that was generated before is returned from the image cache.
     """
     # Get configuration for selected model
     model_config = MODEL_CONFIGS[model_choice]
@@ -113,9 +639,7 @@ def generate_image(
 
     # Only add image_prompt for Stable Diffusion 3.5
     if model_choice == "Stable Diffusion 3.5" and image_prompt is not None:
-        buffered = BytesIO()
-        image_prompt.save(buffered, format="PNG")
-        encoded_string = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        encoded_string = image_prompt_cache.get(image_prompt, size)
 
         if image_strength:
             params["image_prompt"] = {
@@ -125,38 +649,203 @@ def generate_image(
         else:
             params["image_prompt"] = {"image": encoded_string}
 
+    # Without a seed the model picks a random one, so only seeded images repeat
+    cache_key = None
+    if image_cache and "seed" in params:
+        cache_key = image_cache.key(model_choice, params)
+        if cached_path := image_cache.get(cache_key):
+            logger.info(f"Using cached image for model: {model_choice}")
+            return cached_path
+
     logger.info(f"Using model: {model_choice}")
     logger.info(
         f"Sending request with params: {json.dumps({**params, 'image_prompt': '<image data>' if 'image_prompt' in params else params.get('image_prompt', None)}, indent=2)}"
     )
 
-    headers = {
-        "Authorization": f"{model_config['key']}",
-        "Accept": "application/json",
-        "extra-parameters": "pass-through",
-    }
+    # The image is written where it's served from, to move it there in one rename
+    directory = image_cache.directory if cache_key else get_upload_folder()
+    os.makedirs(directory, exist_ok=True)
+    field = "b64_json" if model_config["provider"] == "Bria" else "image"
 
-    response = requests.post(
-        model_config["endpoint"] + "/images/generations", headers=headers, json=params
-    )
+    def post(deployment: Deployment) -> str:
+        headers = {
+            "Authorization": f"{deployment.api_key}",
+            "Accept": "application/json",
+            "extra-parameters": "pass-through",
+        }
+        with client_factory.get(deployment.endpoint).stream(
+            "POST",
+            deployment.endpoint + "/images/generations",
+            headers=headers,
+            json=params,
+        ) as response:
+            if response.is_error:
+                # Read the error message, it's shown to the user
+                response.read()
+                response.raise_for_status()
+            return receive_image(response, field, directory)
 
     try:
-        response.raise_for_status()
-    except requests.exceptions.HTTPError as e:
+        path = schedulers[model_choice].run(post)
+    except SchedulerBusy as e:
+        raise gr.Error(
+            f"{model_choice} is very busy right now, please try again in a moment."
+        ) from e
+    except httpx.HTTPStatusError as e:
         logger.error(f"HTTPError: {e}")
-        logger.error(f"Response content: {response.content}")
+        logger.error(f"Response content: {e.response.content}")
 
-        raise gr.Error(f"Error: {str(e)}\n{response.content.decode()}") from e
+        raise gr.Error(f"Error: {str(e)}\n{e.response.content.decode()}") from e
+    except httpx.TransportError as e:
+        logger.error(f"{type(e).__name__}: {e}")
+        raise gr.Error(
+            f"{model_choice} isn't responding right now, please try again in a moment."
+        ) from e
+    except httpx.DecodingError as e:
+        logger.error(f"DecodingError: {e}")
+        raise gr.Error(f"{model_choice} returned no image, please try again.") from e
+
+    if model_config["provider"] != "Bria":
+        convert_image(path, output_format)
+    if cache_key:
+        return image_cache.set(cache_key, path)
+    return save_image(path)
 
-    # Decode response based on the provider
-    response_json = response.json()
-    if model_config["provider"] == "Bria":
-        image_data = base64.b64decode(response_json["data"][0]["b64_json"])
-    else:
-        image_data = base64.b64decode(response_json["image"])
 
-    output_image = Image.open(BytesIO(image_data))
-    return output_image
+def convert_image(path: str, output_format: str) -> None:
+    """
+    Convert the image file to `output_format`, only decoding it when the endpoint
+    returned another format.
+    """
+    if image_format(path) == output_format:
+        return
+    image = Image.open(path)
+    image.load()
+    if output_format == "jpeg":
+        image = image.convert("RGB")
+    image.save(path, format=output_format.upper())
+
+
+def save_image(path: str, link: bool = False) -> str:
+    """
+    Move the image file to its own directory in the Gradio cache and return its new
+    path. Gradio serves files in its cache as they are, while a PIL image would be
+    encoded again for the browser. With `link` the file stays where it is, and is
+    linked instead, or copied where it can't be linked.
+    """
+    directory = tempfile.mkdtemp(dir=get_upload_folder())
+    new_path = os.path.join(directory, f"image.{image_format(path)}")
+    if not link:
+        os.replace(path, new_path)
+        return new_path
+    try:
+        os.link(path, new_path)
+    except OSError:
+        # Another file system, or one without hard links
+        shutil.copyfile(path, new_path)
+    return new_path
+
+
+# Images in a grid, larger grids are refused
+GRID_MAX_IMAGES = int(os.getenv("GRID_MAX_IMAGES", "64"))
+# Grids generated at once, the others wait in the queue
+GRID_CONCURRENCY = int(os.getenv("GRID_CONCURRENCY", "2"))
+# Images of a model generated at once for grids, shared by all grids
+grid_slots = {
+    model_choice: threading.BoundedSemaphore(model_config["concurrency"])
+    for model_choice, model_config in MODEL_CONFIGS.items()
+}
+
+queue_monitor = QueueMonitor(
+    QUEUE_MAX_SIZE,
+    {
+        **{
+            f"generate {model_choice}": model_config["concurrency"]
+            for model_choice, model_config in MODEL_CONFIGS.items()
+        },
+        "grid": GRID_CONCURRENCY,
+    },
+)
+
+
+def generate_grid(
+    prompts: str,
+    seeds: str,
+    models: list[str],
+    output_format: str,
+    negative_prompt: str,
+    size: str,
+    diffusion_steps: int | None = None,
+    guidance_scale: float | None = None,
+    image_prompt: str | None = None,
+    image_strength: float | None = None,
+    request: gr.Request = None,
+):
+    """
+    Generate an image for every prompt, seed and model at once, and yield the
+    gallery of the finished images in grid order every time one finishes. At most
+    `<MODEL>_CONCURRENCY` images of a model are generated at once.
+    """
+    with queue_monitor.track("grid", request):
+        prompt_list = [line.strip() for line in prompts.splitlines() if line.strip()]
+        try:
+            seed_list = [
+                int(seed) for seed in re.split(r"[,\s]+", seeds.strip()) if seed
+            ]
+        except ValueError as e:
+            raise gr.Error("Seeds should be whole numbers, separated by commas.") from e
+        cells = [
+            (prompt, seed, model_choice)
+            for prompt in prompt_list
+            for seed in seed_list or [None]
+            for model_choice in models
+        ]
+        if not cells:
+            raise gr.Error("Enter at least one prompt and select at least one model.")
+        if len(cells) > GRID_MAX_IMAGES:
+            raise gr.Error(
+                f"A grid has at most {GRID_MAX_IMAGES} images, not {len(cells)}."
+            )
+
+        def generate(prompt: str, seed: int | None, model_choice: str) -> str:
+            with grid_slots[model_choice]:
+                return create_image(
+                    model_choice,
+                    prompt,
+                    output_format,
+                    negative_prompt,
+                    size,
+                    seed,
+                    diffusion_steps,
+                    guidance_scale,
+                    image_prompt,
+                    image_strength,
+                )
+
+        # The slots of every model limit the requests, the threads only wait for them
+        executor = ThreadPoolExecutor(len(cells))
+        futures = {executor.submit(generate, *cell): i for i, cell in enumerate(cells)}
+        finished = {}
+        failed = 0
+        try:
+            for future in as_completed(futures):
+                try:
+                    finished[futures[future]] = future.result()
+                except Exception as e:
+                    logger.error(f"Generating a grid image failed: {e}")
+                    failed += 1
+                    continue
+                yield [(finished[i], caption(*cells[i])) for i in sorted(finished)]
+        finally:
+            # The user may leave before the grid is done
+            executor.shutdown(wait=False, cancel_futures=True)
+        if failed:
+            gr.Warning(f"{failed} of {len(cells)} images failed.")
+
+
+def caption(prompt: str, seed: int | None, model_choice: str) -> str:
+    seed_text = f", seed {seed}" if seed is not None else ""
+    return f"{model_choice}{seed_text}: {prompt}"
 
 
 def fill_sample(sample_type: str) -> tuple[str, str]:
@@ -184,9 +873,12 @@ with gr.Blocks(title="Image Generation - Azure AI Foundry") as demo:
             )
 
             # (visible only for Stable Diffusion 3.5)
+            # The uploaded file is passed as it is, and only decoded to encode
+            # it for the request the first time it's used
             image_prompt = gr.Image(
                 label="Initial image (optional)",
-                type="pil",
+                type="filepath",
+                image_mode=None,
                 height=200,
             )
 
@@ -249,7 +941,16 @@ with gr.Blocks(title="Image Generation - Azure AI Foundry") as demo:
                     value=lambda: None,
                 )
 
-            generate_btn = gr.Button("Generate Image", variant="primary")
+            # A button per model, so every model has its own concurrency group and
+            # a slow model doesn't hold up the others. Only the selected one is shown.
+            generate_buttons = {
+                model: gr.Button(
+                    "Generate Image",
+                    variant="primary",
+                    visible=model == list(MODEL_CONFIGS.keys())[0],
+                )
+                for model in MODEL_CONFIGS
+            }
 
             with gr.Row():
                 sample_btn_1 = gr.Button("Sample: Serene Mountain")
@@ -258,8 +959,28 @@ with gr.Blocks(title="Image Generation - Azure AI Foundry") as demo:
         with gr.Column():
             output_image = gr.Image(label="Generated Image")
 
+    # A grid of images for every prompt, seed and model, with the options above
+    with gr.Accordion("Grid", open=False):
+        with gr.Row():
+            with gr.Column():
+                grid_prompts = gr.Textbox(label="Prompts, one per line", lines=4)
+                grid_seeds = gr.Textbox(
+                    label="Seeds (optional)", placeholder="Comma separated, 1, 2, 3"
+                )
+                grid_models = gr.CheckboxGroup(
+                    choices=list(MODEL_CONFIGS.keys()),
+                    label="Models",
+                    value=list(MODEL_CONFIGS.keys())[:1],
+                )
+                grid_btn = gr.Button("Generate Grid", variant="primary")
+            with gr.Column():
+                grid_gallery = gr.Gallery(label="Generated Grid", columns=4)
+
     # Update the visibility of fields based on model provider and model choice
     def update_inputs(selected_model: str):
+        buttons = tuple(
+            gr.update(visible=model == selected_model) for model in generate_buttons
+        )
         if MODEL_CONFIGS[selected_model]["provider"] == "Bria":
             return (
                 gr.update(visible=False),  # output_format hidden for Bria
@@ -267,7 +988,7 @@ with gr.Blocks(title="Image Generation - Azure AI Foundry") as demo:
                 gr.update(visible=True),  # guidance_scale shown for Bria
                 gr.update(visible=False),  # image_prompt hidden for Bria
                 gr.update(visible=False),  # image_strength hidden for Bria
-            )
+            ) + buttons
         else:
             # Only show image_prompt and image_strength for Stable Diffusion 3.5
             visible = True if selected_model == "Stable Diffusion 3.5" else False
@@ -277,7 +998,7 @@ with gr.Blocks(title="Image Generation - Azure AI Foundry") as demo:
                 gr.update(visible=False),  # guidance_scale hidden for non-Bria
                 gr.update(visible=visible),  # image_prompt visible only for SD 3.5
                 gr.update(visible=visible),  # image_strength visible only for SD 3.5
-            )
+            ) + buttons
 
     model_choice.change(
         fn=update_inputs,
@@ -288,24 +1009,47 @@ with gr.Blocks(title="Image Generation - Azure AI Foundry") as demo:
             guidance_scale,
             image_prompt,
             image_strength,
+            *generate_buttons.values(),
         ],
     )
 
-    generate_btn.click(
-        fn=generate_image,
+    for model, generate_btn in generate_buttons.items():
+        generate_btn.click(
+            fn=model_handler(model),
+            inputs=[
+                prompt,
+                output_format,
+                negative_prompt,
+                size,
+                seed,
+                diffusion_steps,
+                guidance_scale,
+                image_prompt,
+                image_strength,
+            ],
+            outputs=output_image,
+            api_name="generate_" + re.sub(r"\W+", "_", model.lower()),
+            concurrency_limit=MODEL_CONFIGS[model]["concurrency"],
+            concurrency_id=f"generate {model}",
+        )
+
+    grid_btn.click(
+        fn=generate_grid,
         inputs=[
-            model_choice,
-            prompt,
+            grid_prompts,
+            grid_seeds,
+            grid_models,
             output_format,
             negative_prompt,
             size,
-            seed,
             diffusion_steps,
             guidance_scale,
             image_prompt,
             image_strength,
         ],
-        outputs=output_image,
+        outputs=grid_gallery,
+        concurrency_limit=GRID_CONCURRENCY,
+        concurrency_id="grid",
     )
 
     sample_btn_1.click(
@@ -326,5 +1070,16 @@ with gr.Blocks(title="Image Generation - Azure AI Foundry") as demo:
         outputs=[prompt, negative_prompt],
     )
 
+demo.queue(max_size=QUEUE_MAX_SIZE or None)
+
 if __name__ == "__main__":
-    demo.launch()
+    if os.getenv("CLIENT_PREWARM", "true").lower() == "true":
+        client_factory.prewarm()
+    if interval := float(os.getenv("QUEUE_METRICS_INTERVAL", "0")):
+        queue_monitor.report(interval)
+    # Gradio runs at most `max_threads` events at once, 40 by default
+    concurrency = sum(config["concurrency"] for config in MODEL_CONFIGS.values())
+    demo.launch(
+        max_threads=max(40, concurrency),
+        app_kwargs=queue_monitor.app_kwargs(),
+    )
@@ -0,0 +1 @@
+"""Modules shared by the demos, imported from the root of the repository."""
@@ -0,0 +1,287 @@
+"""
+Resolve destination names in English and Dutch, with aliases, regions and seas,
+to ISO 3166-1 alpha-2 codes, with an in-memory index shared by the search demos.
+"""
+
+import re
+import unicodedata
+from typing import Dict, List
+
+# Every ISO 3166-1 alpha-2 code, which resolves to itself
+ISO_COUNTRY_CODES = set(
+    """AD AE AF AG AI AL AM AO AQ AR AS AT AU AW AX AZ BA BB BD BE BF BG BH BI BJ BL BM
+    BN BO BQ BR BS BT BV BW BY BZ CA CC CD CF CG CH CI CK CL CM CN CO CR CU CV CW CX CY
+    CZ DE DJ DK DM DO DZ EC EE EG EH ER ES ET FI FJ FK FM FO FR GA GB GD GE GF GG GH GI
+    GL GM GN GP GQ GR GS GT GU GW GY HK HM HN HR HT HU ID IE IL IM IN IO IQ IR IS IT JE
+    JM JO JP KE KG KH KI KM KN KP KR KW KY KZ LA LB LC LI LK LR LS LT LU LV LY MA MC MD
+    ME MF MG MH MK ML MM MN MO MP MQ MR MS MT MU MV MW MX MY MZ NA NC NE NF NG NI NL NO
+    NP NR NU NZ OM PA PE PF PG PH PK PL PM PN PR PS PT PW PY QA RE RO RS RU RW SA SB SC
+    SD SE SG SH SI SJ SK SL SM SN SO SR SS ST SV SX SY SZ TC TD TF TG TH TJ TK TL TM TN
+    TO TR TT TV TW TZ UA UG UM US UY UZ VA VC VE VG VI VN VU WF WS YE YT ZA ZM ZW""".split()
+)
+
+# Country names and aliases in English and Dutch
+# fmt: off
+COUNTRY_NAMES = {
+    "AD": ["andorra"],
+    "AE": ["united arab emirates", "uae", "verenigde arabische emiraten", "dubai", "abu dhabi"],
+    "AL": ["albania", "albanië"],
+    "AR": ["argentina", "argentinië"],
+    "AT": ["austria", "oostenrijk", "tyrol", "tirol", "austrian alps", "oostenrijkse alpen"],
+    "AU": ["australia", "australië"],
+    "AW": ["aruba"],
+    "BA": ["bosnia and herzegovina", "bosnia", "bosnië en herzegovina", "bosnië"],
+    "BB": ["barbados"],
+    "BE": ["belgium", "belgië", "ardennes", "ardennen"],
+    "BG": ["bulgaria", "bulgarije"],
+    "BQ": ["bonaire"],
+    "BR": ["brazil", "brazilië"],
+    "BS": ["bahamas"],
+    "BW": ["botswana"],
+    "CA": ["canada"],
+    "CH": ["switzerland", "zwitserland", "swiss alps", "zwitserse alpen"],
+    "CL": ["chile", "chili"],
+    "CN": ["china"],
+    "CO": ["colombia"],
+    "CR": ["costa rica"],
+    "CU": ["cuba"],
+    "CV": ["cape verde", "kaapverdië"],
+    "CW": ["curaçao", "curacao"],
+    "CY": ["cyprus"],
+    "CZ": ["czech republic", "czechia", "tsjechië"],
+    "DE": ["germany", "duitsland", "bavaria", "beieren", "black forest", "zwarte woud"],
+    "DK": ["denmark", "denemarken"],
+    "DO": ["dominican republic", "dominicaanse republiek"],
+    "EC": ["ecuador", "galapagos"],
+    "EE": ["estonia", "estland"],
+    "EG": ["egypt", "egypte", "hurghada", "sharm el sheikh", "marsa alam"],
+    "ES": [
+        "spain", "spanje", "canary islands", "canaries", "canarische eilanden",
+        "tenerife", "gran canaria", "lanzarote", "fuerteventura", "balearic islands",
+        "balearen", "mallorca", "majorca", "ibiza", "menorca", "costa del sol",
+        "costa brava", "costa blanca", "andalusia", "andalusië", "barcelona", "madrid",
+    ],
+    "FI": ["finland", "lapland"],
+    "FJ": ["fiji"],
+    "FR": [
+        "france", "frankrijk", "corsica", "provence", "french riviera", "côte d'azur",
+        "franse rivièra", "french alps", "franse alpen", "paris", "parijs",
+    ],
+    "GB": [
+        "united kingdom", "uk", "great britain", "england", "scotland", "wales",
+        "verenigd koninkrijk", "groot-brittannië", "engeland", "schotland", "london", "londen",
+    ],
+    "GE": ["georgia", "georgië"],
+    "GM": ["gambia"],
+    "GR": [
+        "greece", "griekenland", "crete", "kreta", "rhodes", "rhodos", "corfu", "kos",
+        "santorini", "zakynthos", "greek islands", "griekse eilanden", "athens", "athene",
+    ],
+    "HR": ["croatia", "kroatië", "dalmatia", "dalmatië", "istria", "istrië"],
+    "HU": ["hungary", "hongarije"],
+    "ID": ["indonesia", "indonesië", "bali"],
+    "IE": ["ireland", "ierland"],
+    "IL": ["israel", "israël"],
+    "IN": ["india"],
+    "IS": ["iceland", "ijsland"],
+    "IT": [
+        "italy", "italië", "sicily", "sicilië", "sardinia", "sardinië", "tuscany",
+        "toscane", "lake garda", "gardameer", "dolomites", "dolomieten",
+        "amalfi coast", "amalfikust", "italian alps", "italiaanse alpen", "rome",
+    ],
+    "JM": ["jamaica"],
+    "JO": ["jordan", "jordanië"],
+    "JP": ["japan"],
+    "KE": ["kenya", "kenia"],
+    "KH": ["cambodia", "cambodja"],
+    "KR": ["south korea", "zuid-korea"],
+    "LA": ["laos"],
+    "LK": ["sri lanka"],
+    "LT": ["lithuania", "litouwen"],
+    "LU": ["luxembourg", "luxemburg"],
+    "LV": ["latvia", "letland"],
+    "MA": ["morocco", "marokko", "marrakech", "marrakesh"],
+    "MC": ["monaco"],
+    "ME": ["montenegro"],
+    "MG": ["madagascar", "madagaskar"],
+    "MK": ["north macedonia", "noord-macedonië"],
+    "MT": ["malta", "gozo"],
+    "MU": ["mauritius"],
+    "MV": ["maldives", "malediven"],
+    "MX": ["mexico", "cancun", "cancún"],
+    "MY": ["malaysia", "maleisië"],
+    "NA": ["namibia", "namibië"],
+    "NL": ["netherlands", "holland", "nederland", "wadden islands", "waddeneilanden"],
+    "NO": ["norway", "noorwegen", "norwegian fjords", "noorse fjorden"],
+    "NP": ["nepal"],
+    "NZ": ["new zealand", "nieuw-zeeland"],
+    "OM": ["oman"],
+    "PA": ["panama"],
+    "PE": ["peru"],
+    "PF": ["french polynesia", "frans-polynesië", "tahiti", "bora bora"],
+    "PH": ["philippines", "filipijnen"],
+    "PL": ["poland", "polen"],
+    "PT": ["portugal", "algarve", "madeira", "azores", "azoren", "lisbon", "lissabon"],
+    "QA": ["qatar"],
+    "RO": ["romania", "roemenië"],
+    "RS": ["serbia", "servië"],
+    "SC": ["seychelles", "seychellen"],
+    "SE": ["sweden", "zweden"],
+    "SG": ["singapore"],
+    "SI": ["slovenia", "slovenië"],
+    "SK": ["slovakia", "slowakije"],
+    "SR": ["suriname"],
+    "SX": ["sint maarten", "saint martin"],
+    "TH": ["thailand", "phuket", "koh samui"],
+    "TN": ["tunisia", "tunesië", "djerba"],
+    "TR": ["turkey", "türkiye", "turkije", "antalya", "turkish riviera", "turkse rivièra"],
+    "TZ": ["tanzania", "zanzibar"],
+    "US": [
+        "united states", "usa", "america", "verenigde staten", "amerika", "florida",
+        "california", "californië", "new york", "hawaii",
+    ],
+    "VN": ["vietnam"],
+    "ZA": ["south africa", "zuid-afrika"],
+}
+
+# Regions and seas that span several countries
+REGION_NAMES = {
+    ("AT", "CH", "FR", "IT", "DE"): ["alps", "alpen"],
+    ("ES", "FR", "IT", "GR", "HR", "TR", "CY", "MT"): [
+        "mediterranean", "mediterranean sea", "middellandse zee",
+    ],
+    ("CU", "DO", "JM", "AW", "CW", "BQ", "BS", "BB"): [
+        "caribbean", "caribbean sea", "caraïben", "caribisch gebied", "caribische zee",
+    ],
+    ("NO", "SE", "DK"): ["scandinavia", "scandinavië"],
+    ("NO", "SE", "FI", "DK", "IS"): ["nordics", "noord-europa"],
+    ("DE", "DK", "SE", "FI", "EE", "LV", "LT", "PL"): ["baltic sea", "oostzee", "baltic"],
+    ("HR", "IT", "ME", "SI", "AL"): ["adriatic", "adriatic sea", "adriatische zee"],
+    ("GR", "TR"): ["aegean sea", "aegean", "egeïsche zee"],
+    ("NL", "BE", "DE", "DK", "NO", "GB"): ["north sea", "noordzee"],
+    ("BE", "NL", "LU"): ["benelux"],
+    ("TH", "VN", "KH", "LA", "MY", "ID", "PH", "SG"): ["southeast asia", "zuidoost-azië"],
+}
+# fmt: on
+
+
+class DestinationIndex:
+    """
+    In-memory index of destination names and aliases to ISO 3166-1 alpha-2 codes.
+
+    Names are normalized (case, accents, punctuation, leading articles) and looked
+    up in a hash table. Names that are not found are matched with a precomputed
+    index of single-character deletions, which finds any name within one typo.
+    A name within one typo of another keeps its first three or its last two
+    characters, so names that share neither with any known name are unknown
+    without generating their deletions.
+    """
+
+    ARTICLES = ("the ", "de ", "het ")
+
+    def __init__(
+        self, country_names: Dict[str, List[str]], region_names: Dict[tuple, List[str]]
+    ):
+        self.names = {}
+        for code, names in country_names.items():
+            for name in names:
+                self._add(name, (code,))
+        for codes, names in region_names.items():
+            for name in names:
+                self._add(name, codes)
+
+        # Every name with one character deleted, for matching typos, and every name
+        # itself, so a name with one character inserted is found the same way
+        self.deletions = {}
+        for name in self.names:
+            self.deletions.setdefault(name, set()).add(name)
+            if len(name) >= 5:
+                for deletion in self._deletions(name):
+                    self.deletions.setdefault(deletion, set()).add(name)
+        self.prefixes = {name[:3] for name in self.names}
+        self.suffixes = {name[-2:] for name in self.names}
+
+        self.max_words = max(len(name.split()) for name in self.names)
+
+    @classmethod
+    def normalize(cls, name: str) -> str:
+        name = name.casefold()
+        if not name.isascii():
+            name = "".join(
+                c
+                for c in unicodedata.normalize("NFKD", name)
+                if not unicodedata.combining(c)
+            )
+        name = re.sub(r"[\W_]+", " ", name).strip()
+        for article in cls.ARTICLES:
+            name = name.removeprefix(article)
+        return name
+
+    @staticmethod
+    def _deletions(name: str) -> set:
+        return {name[:i] + name[i + 1 :] for i in range(len(name))}
+
+    def _add(self, name: str, codes: tuple) -> None:
+        name = self.normalize(name)
+        self.names[name] = tuple(dict.fromkeys(self.names.get(name, ()) + codes))
+
+    def resolve(self, name: str) -> tuple:
+        """Return the ISO codes for a destination name, or an empty tuple if unknown."""
+        if name.upper() in ISO_COUNTRY_CODES:
+            return (name.upper(),)
+        if codes := self.names.get(name.casefold()):
+            return codes
+
+        name = self.normalize(name)
+        if codes := self.names.get(name):
+            return codes
+        if len(name) < 5:
+            return ()
+        if name[:3] not in self.prefixes and name[-2:] not in self.suffixes:
+            return ()
+
+        # A name with one character inserted, removed or substituted
+        lookup = self.deletions.get
+        candidates = set(lookup(name, ()))
+        for i in range(len(name)):
+            if names := lookup(name[:i] + name[i + 1 :]):
+                candidates |= names
+
+        codes = {self.names[candidate] for candidate in candidates}
+        return codes.pop() if len(codes) == 1 else ()
+
+    def find(self, text: str) -> list:
+        """
+        Find the destination names mentioned in a text, longest names first.
+
+        Returns a list of (codes, start, end) tuples with the character span of
+        every match. Only exact (normalized) names are matched.
+        """
+        words = [
+            (self.normalize(m.group()), m.start(), m.end())
+            for m in re.finditer(r"[\w'-]+", text)
+        ]
+        matches = []
+        i = 0
+        while i < len(words):
+            for length in range(min(self.max_words, len(words) - i), 0, -1):
+                phrase = " ".join(word for word, _, _ in words[i : i + length])
+                if codes := self.names.get(phrase):
+                    matches.append((codes, words[i][1], words[i + length - 1][2]))
+                    i += length
+                    break
+            else:
+                i += 1
+        return matches
+
+    def normalize_destinations(self, destinations: List[str] | str) -> List[str]:
+        """Replace destination names by ISO codes, keeping values that can't be resolved."""
+        if isinstance(destinations, str):
+            destinations = [destinations]
+        normalized = []
+        for destination in destinations:
+            normalized.extend(self.resolve(destination) or [destination])
+        return list(dict.fromkeys(normalized))
+
+
+destination_index = DestinationIndex(COUNTRY_NAMES, REGION_NAMES)
@@ -0,0 +1,131 @@
+"""
+Measure the Gradio queue in front of the handlers of a demo with the public
+interfaces of Gradio only: the HTTP requests that join the queue, and the
+`gr.Request` a handler gets.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+from starlette.middleware import Middleware
+
+logger = logging.getLogger(__name__)
+
+
+class QueueArrivals:
+    """
+    ASGI middleware that stamps every request joining the queue with its arrival
+    time, and counts the events the queue took and the ones it turned away with a
+    503 because it was full.
+    """
+
+    def __init__(self, app, monitor: "QueueMonitor"):
+        self.app = app
+        self.monitor = monitor
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].endswith("/queue/join"):
+            await self.app(scope, receive, send)
+            return
+        # The handler reads it from the request of the event, as request.state
+        scope.setdefault("state", {})["queued_at"] = time.monotonic()
+
+        async def send_and_count(message):
+            if message["type"] == "http.response.start":
+                self.monitor.joined(message["status"])
+            await send(message)
+
+        await self.app(scope, receive, send_and_count)
+
+
+class QueueMonitor:
+    """
+    Measure how many events joined the Gradio queue and how many were turned away
+    because it held `max_size` events, and per concurrency group how many run,
+    against their `limits`, and how long they waited before their handler started.
+
+    Pass `app_kwargs()` to `demo.launch`, and run every handler in `track()` with
+    the `gr.Request` of its event.
+    """
+
+    def __init__(self, max_size: int, limits: Dict[str, int], window: int = 1000):
+        self.max_size = max_size
+        self.limits = limits
+        self.window = window
+        self.queued = 0
+        self.rejected = 0
+        self.running = {}
+        self.started = {}
+        self.waits = {}
+        self._lock = threading.Lock()
+
+    def app_kwargs(self, **kwargs) -> Dict[str, Any]:
+        """Return the `app_kwargs` of `demo.launch`, with the middleware added."""
+        middleware = [
+            *kwargs.pop("middleware", []),
+            Middleware(QueueArrivals, monitor=self),
+        ]
+        return {**kwargs, "middleware": middleware}
+
+    def joined(self, status: int) -> None:
+        with self._lock:
+            if status == 200:
+                self.queued += 1
+            elif status == 503:
+                self.rejected += 1
+
+    @contextmanager
+    def track(self, group: str, request=None):
+        """Count the handler of an event as running while in the block."""
+        queued_at = getattr(getattr(request, "state", None), "queued_at", None)
+        with self._lock:
+            self.running[group] = self.running.get(group, 0) + 1
+            self.started[group] = self.started.get(group, 0) + 1
+            # Without the stamp, the event didn't come through the queue
+            if queued_at is not None:
+                waits = self.waits.setdefault(group, deque(maxlen=self.window))
+                waits.append(time.monotonic() - queued_at)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.running[group] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            groups = {}
+            for group in {**self.limits, **self.started}:
+                waits = sorted(self.waits.get(group, ()))
+                groups[group] = {
+                    "running": self.running.get(group, 0),
+                    "started": self.started.get(group, 0),
+                    "limit": self.limits.get(group),
+                    "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                    "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                }
+            return {
+                "queued": self.queued,
+                "rejected": self.rejected,
+                "max_size": self.max_size,
+                "groups": groups,
+            }
+
+    def report(self, interval: float, **sources: Callable[[], Dict[str, Any]]) -> None:
+        """
+        Log the stats, and the stats of `sources` by name, such as a scheduler or a
+        cache, every `interval` seconds from a background thread.
+        """
+
+        def log_stats():
+            while True:
+                time.sleep(interval)
+                logger.info(f"Queue: {json.dumps(self.stats())}")
+                for name, stats in sources.items():
+                    logger.info(f"{name}: {json.dumps(stats())}")
+
+        threading.Thread(target=log_stats, daemon=True).start()
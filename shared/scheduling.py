@@ -0,0 +1,461 @@
+"""
+Send requests to a pool of model deployments within their rate limits, in order of
+priority, to the deployment with the lowest expected latency, with a circuit
+breaker per deployment. `RequestScheduler` serves apps that call the models from
+worker threads, `AsyncRequestScheduler` apps that await them on an event loop.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, BACKGROUND = 0, 1
+# Priority of the requests made in the current context, batch jobs lower it
+request_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+
+# Failures in a row after which a deployment is taken out of the pool
+BREAKER_FAILURES = 3
+# Weight of the latest response in the average latency of a deployment
+LATENCY_WEIGHT = 0.2
+
+
+class SchedulerBusy(Exception):
+    """Raised when a request is turned away because too many requests are waiting."""
+
+
+class TokenBucket:
+    """
+    Hand out a budget per minute. Azure OpenAI checks its limits over periods of
+    as little as 10 seconds, so the bucket only holds a second of the budget:
+    spending it all at once still stays within the budget of any 10 seconds.
+    Larger amounts wait for a full bucket and are paid off before the next.
+    """
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Return the seconds until `amount` is available."""
+        self.level = min(
+            self.capacity, self.level + (now - self.updated) * self.per_minute / 60
+        )
+        self.updated = now
+        # A request larger than the bucket only waits for a full bucket
+        missing = min(amount, self.capacity) - self.level
+        return max(missing * 60 / self.per_minute, 0.0)
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+    def give(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+class Deployment:
+    """
+    A deployment of a model, with its own rate limits, its average latency and a
+    circuit breaker. After `BREAKER_FAILURES` failed requests in a row the breaker
+    opens and the deployment gets no requests for `cooldown` seconds, after which a
+    single trial request decides whether it's back. Without `tpm`, requests are
+    only limited per minute and their tokens aren't counted.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        api_key: str | None,
+        name: str,
+        rpm: int,
+        tpm: int,
+        cooldown: float,
+    ):
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.name = name
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.cooldown = cooldown
+        self.paused_until = 0.0
+        # Unknown until the first response, so every deployment gets tried
+        self.latency = 0.0
+        self.in_flight = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial = False
+        self.sent = 0
+        self.failed = 0
+
+    def __str__(self) -> str:
+        return f"{self.name} at {self.endpoint}"
+
+    def delay(self, tokens: int, now: float) -> float:
+        """Return the seconds until the deployment can take the request."""
+        if self.trial:
+            return float("inf")
+        delay = max(self.paused_until, self.open_until) - now
+        if self.requests:
+            delay = max(delay, self.requests.wait_time(1, now))
+        if self.tokens:
+            delay = max(delay, self.tokens.wait_time(tokens, now))
+        return max(delay, 0.0)
+
+    def cost(self) -> float:
+        """
+        Return the expected latency of one more request: the average latency for
+        every request in flight, and higher as the rate limit budget runs out.
+        """
+        cost = self.latency * (self.in_flight + 1)
+        for bucket in (self.requests, self.tokens):
+            if bucket:
+                cost /= max(bucket.level / bucket.capacity, 0.05)
+        return cost
+
+    def take(self, tokens: int) -> None:
+        if self.requests:
+            self.requests.take(1)
+        if self.tokens:
+            self.tokens.take(tokens)
+        # With an open breaker this is the trial request
+        self.trial = self.failures >= BREAKER_FAILURES
+        self.in_flight += 1
+        self.sent += 1
+
+    def settle(self, estimated: int, used: int) -> None:
+        """Charge the tokens a request used beyond its estimate, or refund the rest."""
+        if not self.tokens:
+            return
+        if used > estimated:
+            self.tokens.take(used - estimated)
+        else:
+            self.tokens.give(estimated - used)
+
+    def succeed(self, latency: float | None) -> None:
+        if latency is not None and self.latency:
+            self.latency += LATENCY_WEIGHT * (latency - self.latency)
+        elif latency is not None:
+            self.latency = latency
+        self.in_flight -= 1
+        self.failures = 0
+        self.trial = False
+
+    def release(self) -> None:
+        """Give up a request without an outcome, like a cancelled one."""
+        self.in_flight -= 1
+        # A cancelled trial request leaves the decision to the next one
+        self.trial = False
+
+    def fail(self, now: float) -> None:
+        self.in_flight -= 1
+        self.failures += 1
+        self.failed += 1
+        self.trial = False
+        if self.failures >= BREAKER_FAILURES:
+            self.open_until = now + self.cooldown
+            logger.warning(f"Taking {self} out of the pool for {self.cooldown}s")
+
+    def throttle(self, retry_after: float, now: float) -> None:
+        self.in_flight -= 1
+        self.trial = False
+        # Spread the retries, so they don't all hit the deployment at once
+        self.paused_until = max(
+            self.paused_until, now + retry_after * random.uniform(1.0, 1.5)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "deployment": str(self),
+            "latency_ms": self.latency * 1000,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "open": self.failures >= BREAKER_FAILURES,
+        }
+
+
+def parse_retry_after(headers, attempt: int) -> float:
+    """Return the seconds to wait from the headers of a 429, or else back off."""
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers["retry-after"])
+    except (KeyError, ValueError):
+        return min(2**attempt, 30)
+
+
+class BaseScheduler:
+    """
+    The bookkeeping shared by the schedulers. Waiting requests go in order of
+    priority, and every request goes to the available deployment with the lowest
+    expected latency. When more than `max_queue` requests of the same or higher
+    priority are waiting, or an interactive request waited `max_wait` seconds, it
+    is rejected right away instead of piling up.
+
+    A 429 response pauses the deployment for its `retry-after`, and a 5xx response
+    or one of the `transport_errors` of the client, such as a timeout or a
+    connection error, counts as a failure of the deployment. Either way the request
+    is sent again, to another deployment when there is one. Only requests that
+    failed before returning anything are sent again, a stream that breaks off
+    halfway is not.
+    """
+
+    def __init__(
+        self,
+        deployments: List[Deployment],
+        max_queue: int,
+        max_wait: float,
+        max_retries: int,
+        transport_errors: tuple = (),
+    ):
+        self.deployments = deployments
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.transport_errors = transport_errors
+        self.sent = 0
+        self.throttled = 0
+        self.failed_over = 0
+        self.rejected = 0
+        self.estimated_tokens = 0
+        self.used_tokens = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+
+    def _choose(self, tokens: int, now: float, excluded: set) -> tuple:
+        """Return the delay until a deployment is available, and that deployment."""
+        candidates = [d for d in self.deployments if d not in excluded]
+        delays = [(d.delay(tokens, now), d) for d in candidates or self.deployments]
+        available = [deployment for delay, deployment in delays if delay == 0]
+        if available:
+            return 0.0, min(available, key=lambda d: (d.cost(), d.in_flight))
+        return min(delay for delay, _ in delays), None
+
+    def _enqueue(self, entry: tuple) -> None:
+        if sum(waiting[0] <= entry[0] for waiting in self._waiting) >= self.max_queue:
+            self.rejected += 1
+            raise SchedulerBusy("Too many requests are waiting")
+        heapq.heappush(self._waiting, entry)
+
+    def _dequeue(self, entry: tuple) -> None:
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+
+    def _poll(self, tokens: int, entry: tuple, excluded: set, deadline: float) -> tuple:
+        """
+        Return a deployment that takes the request, or else None and the seconds
+        to wait before polling again, None to wait until the line moves.
+        """
+        priority = entry[0]
+        now = time.monotonic()
+        delay, deployment = None, None
+        if self._waiting[0] == entry:
+            delay, deployment = self._choose(tokens, now, excluded)
+        if deployment:
+            deployment.take(tokens)
+            self.sent += 1
+            return deployment, None
+        if priority == INTERACTIVE and now >= deadline:
+            self.rejected += 1
+            raise SchedulerBusy("Waited too long for a deployment")
+        # Not first in line: wait until the line moves. A deployment waiting for
+        # its trial request is available once it returns.
+        timeout = None if delay == float("inf") else delay
+        if priority == INTERACTIVE:
+            timeout = min(deadline - now, timeout or deadline - now)
+        return None, timeout
+
+    def _record_error(
+        self, error: Exception, deployment: Deployment, attempt: int, excluded: set
+    ) -> bool:
+        """Record a failed request, and return whether to send it again."""
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None) or 0
+        if status == 429:
+            retry_after = parse_retry_after(response.headers, attempt)
+            deployment.throttle(retry_after, time.monotonic())
+            self.throttled += 1
+            return True
+        if status >= 500 or isinstance(error, self.transport_errors):
+            deployment.fail(time.monotonic())
+            excluded.add(deployment)
+            self.failed_over += 1
+            return True
+        # The deployment answered, the request itself is wrong
+        deployment.succeed(None)
+        return False
+
+    def _give_up(self, error: Exception, attempt: int) -> None:
+        """Raise the error of the last attempt when there are no retries left."""
+        if attempt < self.max_retries:
+            return
+        if getattr(getattr(error, "response", None), "status_code", None) == 429:
+            raise SchedulerBusy("Still rate limited after retrying") from error
+        raise error
+
+    def _settle(self, deployment: Deployment, estimated: int, used: int) -> None:
+        deployment.settle(estimated, used)
+        self.estimated_tokens += estimated
+        self.used_tokens += used
+
+    def _stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "throttled": self.throttled,
+            "failed_over": self.failed_over,
+            "rejected": self.rejected,
+            "waiting": len(self._waiting),
+            "estimated_tokens": self.estimated_tokens,
+            "used_tokens": self.used_tokens,
+            "deployments": [deployment.stats() for deployment in self.deployments],
+        }
+
+
+class RequestScheduler(BaseScheduler):
+    """Schedule the requests of worker threads, see `BaseScheduler`."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    def _admit(self, tokens: int, entry: tuple, excluded: set) -> Deployment:
+        """Wait until the request is first in line and a deployment is available."""
+        deadline = time.monotonic() + self.max_wait
+        with self._condition:
+            self._enqueue(entry)
+            try:
+                while True:
+                    deployment, timeout = self._poll(tokens, entry, excluded, deadline)
+                    if deployment:
+                        return deployment
+                    self._condition.wait(timeout)
+            finally:
+                self._dequeue(entry)
+                self._condition.notify_all()
+
+    def run(self, call: Callable, tokens: int = 0, priority: int | None = None):
+        """
+        Call `call(deployment)` when a deployment is available, and send it again
+        on 429 responses and failures.
+        """
+        if priority is None:
+            priority = request_priority.get()
+        # A retried request keeps its place in line
+        entry = (priority, next(self._sequence))
+        excluded = set()
+        for attempt in range(self.max_retries + 1):
+            deployment = self._admit(tokens, entry, excluded)
+            start = time.monotonic()
+            try:
+                result = call(deployment)
+            except Exception as e:
+                with self._condition:
+                    retry = self._record_error(e, deployment, attempt, excluded)
+                    self._condition.notify_all()
+                if not retry:
+                    raise
+                self._give_up(e, attempt)
+                continue
+            except BaseException:
+                # Interrupted while in flight, the deployment must not stay busy
+                with self._condition:
+                    deployment.release()
+                    self._condition.notify_all()
+                raise
+            with self._condition:
+                deployment.succeed(time.monotonic() - start)
+                self._condition.notify_all()
+            return result
+
+    def settle(self, deployment: Deployment, estimated: int, used: int) -> None:
+        """Correct the tokens taken for a request once its usage is known."""
+        with self._condition:
+            self._settle(deployment, estimated, used)
+            # A refund can let a waiting request in
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return self._stats()
+
+
+class AsyncRequestScheduler(BaseScheduler):
+    """Schedule the requests of coroutines on one event loop, see `BaseScheduler`."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Created on first use, in the event loop of the app
+        self._condition = None
+
+    async def _notify(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def _admit(self, tokens: int, entry: tuple, excluded: set) -> Deployment:
+        """Wait until the request is first in line and a deployment is available."""
+        deadline = time.monotonic() + self.max_wait
+        self._enqueue(entry)
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        try:
+            async with self._condition:
+                while True:
+                    deployment, timeout = self._poll(tokens, entry, excluded, deadline)
+                    if deployment:
+                        return deployment
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), timeout)
+                    except TimeoutError:
+                        pass
+        finally:
+            self._dequeue(entry)
+            await self._notify()
+
+    async def run(self, call: Callable, tokens: int = 0, priority: int | None = None):
+        """
+        Await `call(deployment)` when a deployment is available, and send it again
+        on 429 responses and failures.
+        """
+        if priority is None:
+            priority = request_priority.get()
+        # A retried request keeps its place in line
+        entry = (priority, next(self._sequence))
+        excluded = set()
+        for attempt in range(self.max_retries + 1):
+            deployment = await self._admit(tokens, entry, excluded)
+            start = time.monotonic()
+            try:
+                result = await call(deployment)
+            except Exception as e:
+                retry = self._record_error(e, deployment, attempt, excluded)
+                await self._notify()
+                if not retry:
+                    raise
+                self._give_up(e, attempt)
+                continue
+            except BaseException:
+                # Cancelled while in flight, the deployment must not stay busy
+                deployment.release()
+                await self._notify()
+                raise
+            deployment.succeed(time.monotonic() - start)
+            await self._notify()
+            return result
+
+    async def settle(self, deployment: Deployment, estimated: int, used: int) -> None:
+        """Correct the tokens taken for a request once its usage is known."""
+        self._settle(deployment, estimated, used)
+        # A refund can let a waiting request in
+        await self._notify()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._stats()
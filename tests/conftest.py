@@ -0,0 +1,42 @@
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+# The modules shared by the demos
+sys.path.insert(0, str(ROOT))
+
+
+def load(name: str, module: str = "app"):
+    """Import a module of a demo as when it runs as a script, with placeholder keys."""
+    os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:9")
+    os.environ.setdefault("AZURE_OPENAI_API_KEY", "test-key")
+    for model in ("STABLE_IMAGE_CORE", "BRIA_23_FAST", "STABLE_DIFFUSION_35"):
+        os.environ.setdefault(f"{model}_ENDPOINT", "http://127.0.0.1:9")
+        os.environ.setdefault(f"{model}_KEY", "test-key")
+    if str(ROOT / name) not in sys.path:
+        sys.path.insert(0, str(ROOT / name))
+    spec = importlib.util.spec_from_file_location(
+        f"{name.replace('-', '_')}_{module}", ROOT / name / f"{module}.py"
+    )
+    loaded = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(loaded)
+    return loaded
+
+
+@pytest.fixture(scope="session")
+def function_calling_search():
+    return load("function-calling-search")
+
+
+@pytest.fixture(scope="session")
+def conversational_search():
+    return load("conversational-search")
+
+
+@pytest.fixture(scope="session")
+def maas_image_generation():
+    return load("maas-image-generation")
@@ -0,0 +1,42 @@
+import base64
+import json
+import random
+from io import BytesIO
+
+import pytest
+
+IMAGE = bytes(random.Random(42).randrange(256) for _ in range(10_000))
+
+
+def decode(app, document: bytes, chunk_size: int, field: str = "image"):
+    file = BytesIO()
+    decoder = app.Base64FieldDecoder(field, file)
+    for i in range(0, len(document), chunk_size):
+        decoder.feed(document[i : i + chunk_size])
+    return decoder, file.getvalue()
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 100_000])
+def test_the_field_is_decoded_in_chunks_of_any_size(maas_image_generation, chunk_size):
+    document = json.dumps(
+        {"seed": 1, "image": base64.b64encode(IMAGE).decode(), "finish": "ok"}
+    ).encode()
+    decoder, decoded = decode(maas_image_generation, document, chunk_size)
+    assert decoder.done
+    assert decoded == IMAGE
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 64])
+def test_escaped_slashes_and_line_breaks_are_skipped(maas_image_generation, chunk_size):
+    encoded = base64.encodebytes(IMAGE).decode()
+    document = json.dumps({"b64_json": encoded}).replace("/", "\\/").encode()
+    decoder, decoded = decode(maas_image_generation, document, chunk_size, "b64_json")
+    assert decoder.done
+    assert decoded == IMAGE
+
+
+def test_a_document_without_the_field_is_not_done(maas_image_generation):
+    document = json.dumps({"error": "content filtered"}).encode()
+    decoder, decoded = decode(maas_image_generation, document, 8)
+    assert not decoder.done
+    assert decoded == b""
@@ -0,0 +1,44 @@
+from shared.destinations import destination_index
+
+
+def test_exact_names_and_codes_resolve():
+    assert destination_index.resolve("Spain") == ("ES",)
+    assert destination_index.resolve("the Netherlands") == ("NL",)
+    assert destination_index.resolve("Côte d'Azur") == ("FR",)
+    assert destination_index.resolve("gr") == ("GR",)
+
+
+def test_names_within_one_typo_resolve():
+    assert destination_index.resolve("Zwitserlnd") == ("CH",)
+    assert destination_index.resolve("Portugall") == ("PT",)
+    assert destination_index.resolve("Greace") == ("GR",)
+    assert destination_index.resolve("Sweeeden") == ()
+
+
+def test_regions_resolve_to_their_countries():
+    assert destination_index.resolve("Middellandse Zee") == (
+        "ES",
+        "FR",
+        "IT",
+        "GR",
+        "HR",
+        "TR",
+        "CY",
+        "MT",
+    )
+    assert destination_index.normalize_destinations(["Benelux", "Belgium"]) == [
+        "BE",
+        "NL",
+        "LU",
+    ]
+
+
+def test_unknown_names_are_kept():
+    assert destination_index.resolve("Atlantis") == ()
+    assert destination_index.resolve("unknown place 1") == ()
+    assert destination_index.normalize_destinations("Atlantis") == ["Atlantis"]
+
+
+def test_find_matches_the_longest_names():
+    matches = destination_index.find("Skiing in the Swiss Alps or Austria")
+    assert [codes for codes, _, _ in matches] == [("CH",), ("AT",)]
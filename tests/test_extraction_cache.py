@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+
+def cache(app, **kwargs):
+    return app.ExtractionCache(**{"max_entries": 2, "ttl": 60, **kwargs})
+
+
+def test_keys_ignore_case_whitespace_and_punctuation(function_calling_search):
+    extraction_cache = cache(function_calling_search)
+    key = extraction_cache.key("Beach holiday in  Spain", "gpt-4o-mini")
+    assert extraction_cache.key(" beach HOLIDAY in spain!", "gpt-4o-mini") == key
+    assert extraction_cache.key("Beach holiday in Spain", "gpt-4o") != key
+    assert extraction_cache.key("Beach holiday in Italy", "gpt-4o-mini") != key
+
+
+def test_entries_expire_after_the_ttl(function_calling_search):
+    extraction_cache = cache(function_calling_search, ttl=60)
+
+    async def expire():
+        await extraction_cache.set("key", {"parameters": {}})
+        assert await extraction_cache.get("key") == {"parameters": {}}
+        value, _ = extraction_cache.entries["key"]
+        extraction_cache.entries["key"] = (value, time.time() - 1)
+        return await extraction_cache.get("key")
+
+    assert asyncio.run(expire()) is None
+    assert extraction_cache.stats() == {
+        "entries": 0,
+        "hits": 1,
+        "misses": 1,
+        "evictions": 0,
+    }
+
+
+def test_least_recently_used_entries_are_evicted(function_calling_search):
+    extraction_cache = cache(function_calling_search, max_entries=2)
+
+    async def fill():
+        await extraction_cache.set("first", {"n": 1})
+        await extraction_cache.set("second", {"n": 2})
+        await extraction_cache.get("first")
+        await extraction_cache.set("third", {"n": 3})
+
+    asyncio.run(fill())
+    assert list(extraction_cache.entries) == ["first", "third"]
+    assert extraction_cache.stats()["evictions"] == 1
+
+
+def test_entries_survive_a_restart_in_sqlite(function_calling_search, tmp_path):
+    path = str(tmp_path / "extractions.db")
+    asyncio.run(
+        cache(function_calling_search, path=path).set("key", {"parameters": {}})
+    )
+    restarted = cache(function_calling_search, path=path)
+    assert asyncio.run(restarted.get("key")) == {"parameters": {}}
@@ -0,0 +1,64 @@
+from datetime import date
+
+TODAY = date(2025, 3, 1)
+
+
+def confident(app, query: str) -> bool:
+    _, confidence = app.extract_parameters_locally(query, TODAY)
+    return min(confidence.values()) >= app.FAST_PATH_CONFIDENCE
+
+
+def test_plain_queries_are_extracted(function_calling_search):
+    query = (
+        "A sun vacation to Spain for 2 adults and 1 child, departing on July 15th"
+        " for 7 days."
+    )
+    parameters, _ = function_calling_search.extract_parameters_locally(query, TODAY)
+    assert parameters == {
+        "destination": ["ES"],
+        "departure_date": "2025-07-15",
+        "duration": 7,
+        "participants": {"adults": 2, "children": 1},
+        "trip_type": "sun",
+    }
+    assert confident(function_calling_search, query)
+
+
+def test_dutch_queries_are_extracted(function_calling_search):
+    parameters, _ = function_calling_search.extract_parameters_locally(
+        "Strandvakantie naar Griekenland voor twee volwassenen en een kind,"
+        " vertrek 2025-06-01, 2 weken.",
+        TODAY,
+    )
+    assert parameters == {
+        "destination": ["GR"],
+        "departure_date": "2025-06-01",
+        "duration": 14,
+        "participants": {"adults": 2, "children": 1},
+        "trip_type": "sun",
+    }
+
+
+def test_kind_is_only_counted_with_dutch_numbers(function_calling_search):
+    parameters, _ = function_calling_search.extract_parameters_locally(
+        "Beach in Spain for 2 adults, one kind of hotel, July 15th, 7 days", TODAY
+    )
+    assert "children" not in parameters["participants"]
+
+
+def test_vague_queries_are_left_to_the_model(function_calling_search):
+    # A month without a day, and a family that can't be counted
+    assert not confident(
+        function_calling_search,
+        "Skiing in Austria in December for a family of 4, 10 days",
+    )
+    # A region that spans several countries
+    assert not confident(
+        function_calling_search,
+        "Cruise on the Mediterranean for 2 adults, 2025-06-01, 7 days",
+    )
+    # Conflicting durations
+    assert not confident(
+        function_calling_search,
+        "Beach in Spain for 2 adults on July 15th, 7 days or 10 days",
+    )
@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+
+@pytest.fixture
+def cache(maas_image_generation, tmp_path):
+    return maas_image_generation.ImageCache(str(tmp_path / "cache"), 250)
+
+
+def store(cache, key: str, size: int = 100) -> str:
+    """Write an image file of `size` bytes in the cache directory and cache it."""
+    os.makedirs(cache.directory, exist_ok=True)
+    path = os.path.join(cache.directory, f".{key}.tmp")
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG" + key.encode().ljust(size - 4, b"\0"))
+    return cache.set(key, path)
+
+
+def test_the_directory_is_created_on_first_use(cache):
+    assert not os.path.exists(cache.directory)
+    assert cache.get("missing") is None
+    assert os.path.isdir(cache.directory)
+
+
+def test_keys_cover_the_model_and_every_parameter(cache):
+    key = cache.key("Stable Image Core", {"prompt": "a cat", "seed": 1})
+    assert cache.key("Stable Image Core", {"seed": 1, "prompt": "a cat"}) == key
+    assert cache.key("Stable Image Core", {"prompt": "a cat", "seed": 2}) != key
+    assert cache.key("Bria 2.3 Fast", {"prompt": "a cat", "seed": 1}) != key
+
+
+def test_hits_are_served_from_a_link_outside_the_cache(cache):
+    store(cache, "first")
+    path = cache.get("first")
+    assert os.path.dirname(path) != cache.directory
+    with open(path, "rb") as file:
+        assert file.read().startswith(b"\x89PNGfirst")
+    assert cache.stats()["hits"] == 1
+
+
+def test_least_recently_used_images_are_evicted(cache):
+    store(cache, "first")
+    store(cache, "second")
+    cache.get("first")
+    store(cache, "third")
+    assert list(cache.entries) == ["first", "third"]
+    assert cache.bytes == 200
+    assert cache.get("second") is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_a_served_image_survives_its_eviction(cache):
+    path = store(cache, "first")
+    store(cache, "second")
+    store(cache, "third")
+    assert "first" not in cache.entries
+    assert os.path.exists(path)
+
+
+def test_images_of_other_workers_count_at_the_next_scan(maas_image_generation, cache):
+    store(cache, "first")
+    other = maas_image_generation.ImageCache(cache.directory, 250, rescan_interval=0)
+    store(other, "second")
+    assert other.bytes == 200
+    assert other.get("first") is not None
@@ -0,0 +1,38 @@
+import base64
+from io import BytesIO
+
+from PIL import Image
+
+
+def write(tmp_path, name: str, mode: str, size: tuple, format: str) -> str:
+    path = str(tmp_path / name)
+    Image.new(mode, size, "red").save(path, format=format)
+    return path
+
+
+def decoded(encoded: str) -> Image.Image:
+    return Image.open(BytesIO(base64.b64decode(encoded)))
+
+
+def test_photos_are_scaled_down_and_sent_as_jpeg(maas_image_generation, tmp_path):
+    path = write(tmp_path, "photo.png", "RGB", (4000, 2000), "PNG")
+    image = decoded(maas_image_generation.encode_image_prompt(path, "1024x1024", 90))
+    assert image.format == "JPEG"
+    assert image.size == (1024, 512)
+
+
+def test_transparent_images_are_sent_as_png(maas_image_generation, tmp_path):
+    path = write(tmp_path, "logo.png", "RGBA", (512, 512), "PNG")
+    image = decoded(maas_image_generation.encode_image_prompt(path, "1024x1024", 90))
+    assert image.format == "PNG"
+    assert image.size == (512, 512)
+
+
+def test_encoded_images_are_cached_by_content_and_size(maas_image_generation, tmp_path):
+    cache = maas_image_generation.ImagePromptCache(max_entries=2, quality=90)
+    path = write(tmp_path, "photo.jpg", "RGB", (2000, 2000), "JPEG")
+    copy = write(tmp_path, "copy.jpg", "RGB", (2000, 2000), "JPEG")
+    encoded = cache.get(path, "1024x1024")
+    assert cache.get(copy, "1024x1024") == encoded
+    assert cache.get(path, "512x512") != encoded
+    assert (cache.hits, cache.misses) == (1, 2)
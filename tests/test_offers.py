@@ -0,0 +1,26 @@
+import pytest
+from conftest import load
+
+
+@pytest.fixture(scope="module")
+def offers():
+    return load("conversational-search", "offers")
+
+
+def test_more_participants_narrow(offers):
+    previous = offers.fingerprint(
+        {"destination": "Spain", "participants": {"adults": 2}}
+    )
+    current = offers.fingerprint(
+        {"destination": "Spain", "participants": {"adults": 2, "children": 1}}
+    )
+    assert offers.narrows(previous, current)
+    assert not offers.narrows(current, previous)
+
+
+def test_dropped_participants_do_not_narrow(offers):
+    previous = offers.fingerprint(
+        {"destination": "Spain", "participants": {"adults": 2}}
+    )
+    current = offers.fingerprint({"destination": "Spain"})
+    assert not offers.narrows(previous, current)
@@ -0,0 +1,27 @@
+def test_subscribers_get_the_changes_of_a_turn(conversational_search):
+    events = conversational_search.ParameterEvents()
+    received = []
+
+    def failing(session_id, changes):
+        raise RuntimeError("subscriber failed")
+
+    events.subscribe(failing)
+    events.subscribe(lambda session_id, changes: received.append((session_id, changes)))
+    events.publish("session", {"destination": ["ES"]})
+    assert received == [("session", {"destination": ["ES"]})]
+
+
+def test_the_app_logs_parameter_changes(conversational_search, caplog):
+    caplog.set_level("INFO")
+    conversational_search.parameter_events.publish("session", {"adults": 2})
+    assert 'Parameters of session session changed: {"adults": 2}' in caplog.text
+
+
+def test_only_changed_fields_are_reported(conversational_search):
+    state = conversational_search.ConversationState()
+    state.merge_parameters({"destination": ["ES"], "participants": {"adults": 2}})
+    state.turn_changes = {}
+    changes = state.merge_parameters(
+        {"destination": ["ES"], "participants": {"adults": 2, "children": 1}}
+    )
+    assert changes == state.turn_changes == {"children": 1}
@@ -0,0 +1,34 @@
+import time
+from types import SimpleNamespace
+
+from shared.queueing import QueueMonitor
+
+
+def test_track_counts_running_events_and_their_wait():
+    monitor = QueueMonitor(10, {"search": 4})
+    request = SimpleNamespace(state=SimpleNamespace(queued_at=time.monotonic() - 1))
+    with monitor.track("search", request):
+        assert monitor.stats()["groups"]["search"]["running"] == 1
+    group = monitor.stats()["groups"]["search"]
+    assert group["running"] == 0
+    assert group["started"] == 1
+    assert group["limit"] == 4
+    assert group["wait_p50"] >= 1
+
+
+def test_joined_counts_queued_and_rejected_events():
+    monitor = QueueMonitor(1, {})
+    monitor.joined(200)
+    monitor.joined(503)
+    monitor.joined(503)
+    stats = monitor.stats()
+    assert (stats["queued"], stats["rejected"]) == (1, 2)
+
+
+def test_events_outside_the_queue_have_no_wait():
+    monitor = QueueMonitor(10, {"grid": 2})
+    with monitor.track("grid"):
+        pass
+    group = monitor.stats()["groups"]["grid"]
+    assert group["started"] == 1
+    assert group["wait_p50"] == 0.0
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from shared.scheduling import (
+    BACKGROUND,
+    BREAKER_FAILURES,
+    INTERACTIVE,
+    AsyncRequestScheduler,
+    Deployment,
+    RequestScheduler,
+    SchedulerBusy,
+)
+
+
+def deployment(rpm: int = 0, tpm: int = 0, cooldown: float = 30) -> Deployment:
+    return Deployment("http://127.0.0.1:9", "key", "gpt", rpm, tpm, cooldown)
+
+
+class ServerError(Exception):
+    response = SimpleNamespace(status_code=500, headers={})
+
+
+def test_cancelled_call_releases_the_deployment():
+    pool = deployment()
+    # An open breaker past its cooldown, so the next request is the trial
+    pool.failures = BREAKER_FAILURES
+    scheduler = AsyncRequestScheduler([pool], 8, 5, 0)
+    started = asyncio.Event()
+
+    async def hang(deployment):
+        started.set()
+        await asyncio.Event().wait()
+
+    async def cancel_in_flight():
+        task = asyncio.create_task(scheduler.run(hang, 10))
+        await started.wait()
+        assert pool.trial
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_in_flight())
+    assert pool.in_flight == 0
+    assert not pool.trial
+    assert pool.delay(10, 0.0) == 0.0
+
+
+def test_interrupted_call_releases_the_deployment():
+    pool = deployment()
+    scheduler = RequestScheduler([pool], 8, 5, 0)
+
+    def interrupt(deployment):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run(interrupt)
+    assert pool.in_flight == 0
+    assert not pool.trial
+
+
+def test_interactive_requests_go_first():
+    pool = deployment()
+    scheduler = AsyncRequestScheduler([pool], 8, 5, 0)
+    order = []
+
+    async def call(deployment, name):
+        order.append(name)
+
+    async def run():
+        # Requests wait until the deployment is back
+        pool.paused_until = time.monotonic() + 0.1
+        batch = asyncio.create_task(
+            scheduler.run(lambda d: call(d, "batch"), 1, BACKGROUND)
+        )
+        await asyncio.sleep(0.01)
+        search = asyncio.create_task(
+            scheduler.run(lambda d: call(d, "search"), 1, INTERACTIVE)
+        )
+        await asyncio.gather(batch, search)
+
+    asyncio.run(run())
+    assert order == ["search", "batch"]
+
+
+def test_full_queue_rejects_requests_of_the_same_priority():
+    pool = deployment()
+    pool.paused_until = time.monotonic() + 0.2
+    scheduler = RequestScheduler([pool], 1, 5, 0)
+    waiting = threading.Thread(
+        target=scheduler.run, args=(lambda d: None, 1, BACKGROUND)
+    )
+    waiting.start()
+    while not scheduler.stats()["waiting"]:
+        time.sleep(0.001)
+
+    with pytest.raises(SchedulerBusy):
+        scheduler.run(lambda d: None, 1, BACKGROUND)
+    # A request of higher priority than every waiting one still gets in line
+    assert scheduler.run(lambda d: "answer", 1, INTERACTIVE) == "answer"
+    waiting.join()
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_failures_open_the_breaker_until_a_trial_succeeds():
+    pool = deployment(cooldown=0.05)
+    scheduler = RequestScheduler([pool], 8, 5, BREAKER_FAILURES - 1)
+
+    def fail(deployment):
+        raise ServerError
+
+    with pytest.raises(ServerError):
+        scheduler.run(fail)
+    assert pool.failures == BREAKER_FAILURES
+    assert pool.delay(0, time.monotonic()) > 0
+    assert scheduler.stats()["failed_over"] == BREAKER_FAILURES
+
+    time.sleep(0.05)
+    trials = []
+    scheduler.run(lambda deployment: trials.append(deployment.trial))
+    assert trials == [True]
+    assert pool.failures == 0
+    assert not pool.trial
+
+
+def test_settle_corrects_the_tokens_to_the_usage():
+    pool = deployment(tpm=6000)
+    scheduler = RequestScheduler([pool], 8, 5, 0)
+    scheduler.run(lambda deployment: None, 80)
+    level = pool.tokens.level
+
+    scheduler.settle(pool, 80, 30)
+    assert pool.tokens.level == pytest.approx(level + 50)
+    scheduler.settle(pool, 30, 70)
+    assert pool.tokens.level == pytest.approx(level + 10)
+    # Refunds never fill the bucket beyond its capacity
+    scheduler.settle(pool, 1000, 0)
+    assert pool.tokens.level == pool.tokens.capacity
+    assert scheduler.stats()["used_tokens"] == 100
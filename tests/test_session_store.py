@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+
+def turn(app, state, user_message: str, parameters: dict) -> None:
+    """Add a turn with its extracted parameters and an offer search, as a chat does."""
+    if not state.message_history:
+        state.message_history.append(app.get_system_message())
+    state.message_history.append({"role": "user", "content": user_message})
+    state.merge_parameters(parameters)
+    state.message_history.append({"role": "assistant", "content": "Noted."})
+    state.searched_parameters = state.parameters.to_dict()
+    state.search_outcomes["search"] += 1
+
+
+@pytest.fixture
+def store(conversational_search, tmp_path):
+    return conversational_search.SQLiteSessionStore(str(tmp_path / "sessions.db"), 3600)
+
+
+def test_a_restored_session_continues_where_it_left_off(conversational_search, store):
+    state = store.get("session")
+    turn(conversational_search, state, "Spain please", {"destination": ["ES"]})
+    turn(conversational_search, state, "For two", {"participants": {"adults": 2}})
+    store.save("session", state)
+
+    restored = store.get("session")
+    assert restored.parameters.to_dict() == state.parameters.to_dict()
+    assert restored.parameters.formatted == state.parameters.formatted
+    assert restored.parameters.revision == state.parameters.revision == 2
+    assert restored.shown_revision == restored.parameters.revision
+    assert restored.searched_parameters == state.searched_parameters
+    assert restored.search_outcomes == {"hit": 0, "refinement": 0, "search": 2}
+    assert restored.message_history == state.message_history
+    assert restored.turn_changes == {}
+
+
+def test_an_unchanged_turn_keeps_the_revision(conversational_search, store):
+    state = store.get("session")
+    turn(conversational_search, state, "Spain please", {"destination": ["ES"]})
+    store.save("session", state)
+
+    restored = store.get("session")
+    turn(conversational_search, restored, "Still Spain", {"destination": ["ES"]})
+    assert restored.parameters.revision == 1
+    assert restored.turn_changes == {}
+
+
+def test_concurrent_saves_of_a_session_are_refused(conversational_search, store):
+    first = store.get("session")
+    second = store.get("session")
+    turn(conversational_search, first, "Spain please", {"destination": ["ES"]})
+    turn(conversational_search, second, "Greece please", {"destination": ["GR"]})
+    store.save("session", first)
+    with pytest.raises(conversational_search.ConcurrentUpdateError):
+        store.save("session", second)
+
+
+def test_idle_and_least_recently_used_sessions_are_evicted(conversational_search):
+    store = conversational_search.SessionStore(max_sessions=2, idle_ttl=3600)
+    first = store.get("first")
+    store.get("second")
+    assert store.get("first") is first
+    store.get("third")
+    assert store.stats()["sessions"] == 2
+    assert store.get("first") is first
+    assert store.evictions == 1
+
+    store.idle_ttl = 0
+    assert store.stats()["sessions"] == 0
+
+
+def test_closing_the_tab_keeps_a_stored_session(conversational_search, store):
+    state = store.get("session")
+    turn(conversational_search, state, "Spain please", {"destination": ["ES"]})
+    store.save("session", state)
+    store.unload("session")
+    assert store.get("session").parameters.to_dict() == {"destination": ["ES"]}
+
+    memory = conversational_search.SessionStore(max_sessions=10, idle_ttl=3600)
+    state = memory.get("session")
+    memory.unload("session")
+    assert memory.get("session") is not state
+
+
+def test_turns_of_a_session_run_one_after_the_other(conversational_search):
+    locks = conversational_search.SessionLocks()
+    running = []
+    overlapped = threading.Event()
+
+    def hold(session_id: str):
+        with locks.hold(session_id):
+            running.append(session_id)
+            if len(running) > 1:
+                overlapped.set()
+            time.sleep(0.05)
+            running.remove(session_id)
+
+    threads = [threading.Thread(target=hold, args=("session",)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not overlapped.is_set()
+    assert locks._locks == {}